@@ -1,10 +1,37 @@
+import sys
+
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import profiling
+import warmup
+
+# (script, title) in navigation order, which is also the order warm-up primes them in
+PAGES = [
+    ('pages/1_Spending_Overview.py', 'Spending Overview'),
+    ('pages/2_Spending_by_Category.py', 'Spending by Category'),
+    ('pages/3_Error_Fraud_Analysis.py', 'Error & Fraud Analysis'),
+    ('pages/4_Forecasting.py', 'Forecasting'),
+    ('pages/5_User_Explorer.py', 'User Explorer'),
+]
+
+# `python app.py [--server.port ...]` starts warming up first, then serves this
+# file from the same process, so the caches fill before the first visitor
+if __name__ == '__main__' and get_script_run_ctx() is None:
+    from streamlit.web import cli
+
+    warmup.start(PAGES)
+    sys.argv = ['streamlit', 'run', __file__, *sys.argv[1:]]
+    sys.exit(cli.main())
 
 st.set_page_config(page_title='Personal Finance Dashboard', layout='wide')
-hide_pages = st.navigation([
-    st.Page('pages/1_Spending_Overview.py', title='Spending Overview'),
-    st.Page('pages/2_Spending_by_Category.py', title='Spending by Category'),
-    st.Page('pages/3_Error_Fraud_Analysis.py', title='Error & Fraud Analysis'),
-    st.Page('pages/4_Forecasting.py', title='Forecasting'),
-])
-hide_pages.run()
\ No newline at end of file
+pages = [st.Page(path, title=title) for path, title in PAGES]
+# Query timings and profiles, for whoever runs the server with FINANCE_ADMIN=1
+if profiling.ADMIN:
+    pages.append(st.Page('pages/6_Performance.py', title='Performance'))
+# Under `streamlit run app.py` warm-up starts with the first session instead
+warmup.start(PAGES)
+hide_pages = st.navigation(pages)
+with profiling.page_run(hide_pages.title, profile=st.session_state.get('profile_pages', False)):
+    hide_pages.run()
+warmup.rendered()
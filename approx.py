@@ -0,0 +1,329 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import numpy as np
+import pandas as pd
+
+import db
+import error_flags
+
+# Approximate answers for the Spending by Category and Error & Fraud pages,
+# estimated from a stratified sample of transactions in milliseconds while an
+# exact answer that has to read transactions itself (the in-memory engine's,
+# see columnar.py) is still loading.
+#
+# setup_db.py draws the sample at ingest. Within every (month, mcc) stratum
+# the rows are ordered by a hash of their id, and the first
+# max(MIN_STRATUM_ROWS, ceil(rate * rows)) are kept for the largest rate.
+# Each smaller rate's sample is a prefix of the same order, so one table
+# serves every rate.
+#
+# Sums and counts are Horvitz-Thompson estimates: each sampled row stands for
+# stratum rows / sampled rows transactions. Margins are 95% intervals from the
+# stratified variance. Averages are ratios of two estimates, and their margins
+# come from linearisation.
+#
+# Fraud rates are not estimated. Every fraud chart reads the rollup, which
+# answers exactly in milliseconds, so the sample carries no fraud labels.
+# Under the SQL engine nothing reads transactions at page time and
+# setup_db.py draws no sample.
+
+# Sample rates setup_db.py draws under FINANCE_ENGINE=numpy unless
+# --sample-rates says otherwise
+SAMPLE_RATES = [float(rate) for rate in os.environ.get('FINANCE_SAMPLE_RATES', '0.001,0.01').split(',')]
+
+# A stratum's variance needs two rows. Smaller strata are kept whole.
+MIN_STRATUM_ROWS = 2
+
+# Normal quantile of the 95% margins
+Z = 1.96
+
+# The sample for the largest rate, with every row's stratum size and its
+# position in the stratum's hash order. Knuth's multiplicative hash spreads
+# consecutive ids, which are consecutive in time, across the order.
+# Months before {from_month} are left out, so an append redraws only the
+# strata its rows reach.
+SAMPLE_SQL = """
+    SELECT month, mcc, error_mask, amount_cents, stratum_rows, pick
+    FROM (
+        SELECT
+            t.month,
+            t.mcc,
+            t.error_mask,
+            t.amount_cents,
+            COUNT(*) OVER (PARTITION BY t.month, t.mcc) AS stratum_rows,
+            ROW_NUMBER() OVER (
+                PARTITION BY t.month, t.mcc
+                ORDER BY (t.id * 2654435761) % 4294967296, t.id
+            ) AS pick
+        FROM transactions t
+        WHERE t.month >= {from_month}
+    ) AS ranked
+    WHERE pick <= {min_rows} OR pick - 1 < stratum_rows * {rate}
+"""
+
+# Keeps the strata before {from_month} and redraws the rest
+SAMPLE_MERGE_SQL = """
+    SELECT month, mcc, error_mask, amount_cents, stratum_rows, pick
+    FROM transactions_sample
+    WHERE month < {from_month}
+    UNION ALL
+    {redrawn}
+"""
+
+
+def sample_sql(rate, from_month=0):
+    return SAMPLE_SQL.format(from_month=from_month, min_rows=MIN_STRATUM_ROWS, rate=rate)
+
+
+def stored_rates():
+    # Rates of the stored sample, none when setup_db.py has not drawn one
+    try:
+        return db.query('SELECT rate FROM sample_rates ORDER BY rate')['rate'].tolist()
+    except Exception as e:
+        if not db.missing_table(e):
+            raise
+        return []
+
+
+def rate_label(rate):
+    return f'{100 * rate:g}% sample'
+
+
+class Sample:
+    # One process-wide copy of transactions_sample. Rows are held as NumPy
+    # columns; `stratum` codes each row's (month, mcc).
+
+    def __init__(self, version=None):
+        self.version = version
+        self.rates = stored_rates()
+        df = db.query('SELECT * FROM transactions_sample')
+        self.month = df['month'].to_numpy(dtype='int64')
+        self.mcc = df['mcc'].to_numpy(dtype='int64')
+        self.error_mask = df['error_mask'].to_numpy(dtype='int64')
+        self.amount_cents = df['amount_cents'].to_numpy(dtype='float64')
+        self.pick = df['pick'].to_numpy(dtype='int64')
+        self.stratum_rows = df['stratum_rows'].to_numpy(dtype='float64')
+        self.stratum = pd.factorize(self.month * 10_000 + self.mcc)[0] if len(df) else np.empty(0, dtype='int64')
+
+        names = db.query('SELECT mcc, description FROM mcc_codes')
+        lookup = dict(zip(names['mcc'], names['description']))
+        self.description = np.array([lookup.get(m) for m in self.mcc], dtype='object')
+        self._strata = {}
+
+    # ── Kernels ────────────────────────────────────────────────────────────────
+    def _rows(self, rate, months):
+        # The rate's rows in the (first, last) YYYYMM range, with every
+        # stratum's population and sampled row count
+        if rate not in self._strata:
+            keep = (self.pick <= MIN_STRATUM_ROWS) | (self.pick - 1 < self.stratum_rows * rate)
+            size = self.stratum.max() + 1 if len(self.stratum) else 0
+            sampled = np.bincount(self.stratum[keep], minlength=size).astype('float64')
+            population = np.zeros(size)
+            population[self.stratum] = self.stratum_rows
+            self._strata[rate] = keep, population, sampled
+        keep, population, sampled = self._strata[rate]
+        first, last = months
+        return np.flatnonzero(keep & (self.month >= first) & (self.month <= last)), population, sampled
+
+    def _estimate(self, rate, months, key, where=None):
+        # Estimated transactions, spend (cents) and average amount per group,
+        # each with its 95% margin. key(rows)
+        # returns the rows again (a row in several groups repeated) and the
+        # group of each. `where` narrows the rows first.
+        rows, population, sampled = self._rows(rate, months)
+        if where is not None:
+            rows = rows[where(rows)]
+        rows, groups = key(rows)
+        codes, keys = pd.factorize(groups, use_na_sentinel=False)
+
+        # Sums within each (stratum, group) cell. Rows of the stratum outside
+        # the group count as zeros, which the variance terms account for.
+        cells, cell = np.unique(self.stratum[rows] * len(keys) + codes, return_inverse=True)
+        cell_stratum, cell_group = cells // max(len(keys), 1), cells % max(len(keys), 1)
+        n = np.bincount(cell, minlength=len(cells)).astype('float64')
+        a = np.bincount(cell, weights=self.amount_cents[rows], minlength=len(cells))
+        a2 = np.bincount(cell, weights=self.amount_cents[rows] ** 2, minlength=len(cells))
+
+        big_n, small_n = population[cell_stratum], sampled[cell_stratum]
+        weight = big_n / small_n
+        # N^2 (1 - n/N) / (n (n - 1)): zero for strata sampled whole
+        spread = np.where(small_n > 1, big_n ** 2 * (1 - small_n / big_n) / (small_n * np.maximum(small_n - 1, 1)), 0.0)
+
+        def per_group(values):
+            return np.bincount(cell_group, weights=values, minlength=len(keys))
+
+        count, spend = per_group(weight * n), per_group(weight * a)
+        var_count = per_group(spread * (n - n * n / small_n))
+        var_spend = per_group(spread * (a2 - a * a / small_n))
+        cov_spend = per_group(spread * (a - a * n / small_n))
+
+        # Linearised variance of spend / count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            avg = spend / count
+            var_avg = (var_spend - 2 * avg * cov_spend + avg * avg * var_count) / count ** 2
+        return pd.DataFrame({
+            'key': list(keys),
+            'n': count, 'n_moe': Z * np.sqrt(np.maximum(var_count, 0)),
+            'cents': spend, 'cents_moe': Z * np.sqrt(np.maximum(var_spend, 0)),
+            'avg_cents': avg, 'avg_moe': Z * np.sqrt(np.maximum(var_avg, 0)),
+        })
+
+    # ── Page estimates ─────────────────────────────────────────────────────────
+    # Same columns as the matching query in queries.py, each estimated one
+    # followed by its `<column>_moe` margin. `months` is the query's (first,
+    # last) YYYYMM range.
+    def top_categories(self, rate, months, by, limit=10):
+        # TOP_BY_VOLUME (by='number_transactions') or TOP_BY_AVG
+        # (by='avg_transaction')
+        df = self._estimate(rate, months, lambda rows: (rows, self.description[rows]))
+        df = pd.DataFrame({
+            'description': df['key'],
+            'number_transactions': df['n'].round().astype('int64'),
+            'number_transactions_moe': df['n_moe'].round(),
+            'total_spent': df['cents'] / 100,
+            'total_spent_moe': df['cents_moe'] / 100,
+            'avg_transaction': (df['avg_cents'] / 100).round(2),
+            'avg_transaction_moe': (df['avg_moe'] / 100).round(2),
+        })
+        return df.sort_values([by, 'description'], ascending=[False, True]).head(limit).reset_index(drop=True)
+
+    def category_monthly_totals(self, category, rate, months):
+        df = self._estimate(rate, months, lambda rows: (rows, self.month[rows]),
+                            where=lambda rows: self.description[rows] == category)
+        return pd.DataFrame({
+            'month': df['key'].astype('int64'),
+            'monthly_total': df['cents'] / 100,
+            'monthly_total_moe': df['cents_moe'] / 100,
+        }).sort_values('month').reset_index(drop=True)
+
+    def error_distribution(self, rate, months, limit=10):
+        # Transactions with exactly one error
+        flags = list(error_flags.FLAGS.values())
+        df = self._estimate(rate, months, lambda rows: (rows, error_flags.labels(self.error_mask[rows])),
+                            where=lambda rows: np.isin(self.error_mask[rows], flags))
+        df = pd.DataFrame({
+            'errors': df['key'],
+            'transaction_count': df['n'].round().astype('int64'),
+            'transaction_count_moe': df['n_moe'].round(),
+        })
+        return df.sort_values(['transaction_count', 'errors'], ascending=[False, True]) \
+            .head(limit).reset_index(drop=True)
+
+
+_sample = None
+_sample_lock = threading.Lock()
+
+
+def get_sample(version=None):
+    # The process-wide sample, shared by every session. Loaded on first use
+    # and reloaded when the data version moves on.
+    global _sample
+    with _sample_lock:
+        if _sample is None or _sample.version != version:
+            _sample = None
+            _sample = Sample(version)
+        return _sample
+
+
+def margins(df):
+    # The `_moe` columns of an estimate, none for an exact answer
+    return [column for column in df.columns if column.endswith('_moe')]
+
+
+def margin(df, column):
+    # Name of the column's margin, for a chart's error bars, or None
+    return f'{column}_moe' if f'{column}_moe' in df.columns else None
+
+
+# ── Estimate first, exact after ────────────────────────────────────────────────
+# A page load goes through Preview.load. The exact loader runs in a thread
+# pool shared by every session. If it answers within REFINE_WAIT, which a
+# cached answer always does, that answer is used. Otherwise the page draws
+# the estimate and keeps the future. The page then polls the futures and
+# reruns once one lands. The rerun reads a load that finished lately straight
+# from its loader's cache. A second session asking for the same load waits on
+# the same future. The pool runs outside any session, so the exact loaders
+# are cached with show_spinner=False: a spinner is the one thing they would
+# try to draw.
+REFINE_WAIT = 0.1
+REFINE_POLL_SECONDS = 0.5
+REFINE_WORKERS = 4
+
+# Loads remembered as finished, oldest forgotten first. Only the keys are
+# kept; the answers live in the loaders' caches.
+FINISHED_KEYS = 256
+
+_refine_pool  = None
+_running      = {}
+_finished     = OrderedDict()
+_running_lock = threading.Lock()
+
+
+def _done(key, future):
+    with _running_lock:
+        _running.pop(key, None)
+        _finished[key] = True
+        _finished.move_to_end(key)
+        while len(_finished) > FINISHED_KEYS:
+            _finished.popitem(last=False)
+
+
+def _submit(exact, args):
+    # Future for the exact load, started unless one is already running, or
+    # None when it finished lately
+    global _refine_pool
+    key = (exact.__name__, args)
+    with _running_lock:
+        if key in _finished:
+            return None
+        future = _running.get(key)
+        started = future is None
+        if started:
+            if _refine_pool is None:
+                _refine_pool = ThreadPoolExecutor(max_workers=REFINE_WORKERS, thread_name_prefix='refine')
+            future = _running[key] = _refine_pool.submit(exact, *args)
+    if started:
+        future.add_done_callback(lambda f: _done(key, f))
+    return future
+
+
+class Preview:
+    # The estimate-first loads of one page run. `rate` is the sample rate
+    # estimates come from, or None to wait for exact answers. With `refine`
+    # off, estimates are final and no exact query is run, which is how a
+    # busy server trades precision for speed.
+
+    def __init__(self, rate, refine=True):
+        self.rate = rate
+        self.refine = refine
+        self.waiting = []
+        self._estimated = set()
+
+    def load(self, exact, estimate, *args):
+        # exact(*args), or estimate(rate, *args) until it is ready. The exact
+        # answer is read back through the loader rather than taken from the
+        # future, so each session gets its own copy from the cache.
+        if self.rate is None:
+            return exact(*args)
+        if self.refine:
+            future = _submit(exact, args)
+            try:
+                if future is not None:
+                    future.result(timeout=REFINE_WAIT)
+                return exact(*args)
+            except TimeoutError:
+                self.waiting.append(future)
+        result = estimate(self.rate, *args)
+        self._estimated.add(id(result))
+        return result
+
+    def estimated(self, result):
+        return id(result) in self._estimated
+
+    def caption(self):
+        # Shown under a chart drawn from the sample
+        text = f'Estimated from a {rate_label(self.rate)}, error bars are 95% margins.'
+        return text + (' Refining to the exact answer...' if self.refine else '')
@@ -0,0 +1,61 @@
+# Loads the in-memory columnar engine, checks every aggregate it serves
+# against the SQL it replaces, and prints both latencies and the engine's
+# memory footprint.
+#
+#   python setup_db.py && python precompute.py
+#   python -m benchmarks.columnar_engine --repeat 5
+import argparse
+import statistics
+import time
+
+import columnar
+import db
+import queries
+from benchmarks.compare_backends import same_result, time_query
+
+
+def time_call(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return result, statistics.median(timings)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the columnar engine with the SQL backend.')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per aggregate (median is reported)')
+    args = parser.parse_args()
+
+    backend = db.get_backend()
+    started = time.perf_counter()
+    store = columnar.TransactionStore(db.data_version())
+    print(f'Loaded {len(store):,} rows in {time.perf_counter() - started:.1f}s, '
+          f'{store.nbytes / 2**20:,.1f} MiB')
+    print(store.memory_usage().to_string())
+    print()
+
+    category = backend.query(queries.TOP_CATEGORIES)['description'][0]
+    months = queries.ALL_MONTHS
+    checks = {
+        'monthly_totals': (queries.MONTHLY_TOTALS, months, store.monthly_totals),
+        'top_by_volume': (queries.TOP_BY_VOLUME, months, store.top_by_volume),
+        'top_by_avg': (queries.TOP_BY_AVG, months, store.top_by_avg),
+        'category_monthly_totals': (queries.CATEGORY_MONTHLY_TOTALS, (category, *months),
+                                    lambda: store.category_monthly_totals(category)),
+        'error_distribution': (queries.ERROR_DISTRIBUTION, months, store.error_distribution),
+    }
+
+    print(f"{'aggregate':<26}{backend.name:>12}{'numpy':>12}{'speedup':>10}  match")
+    mismatches = 0
+    for name, (sql, params, fn) in checks.items():
+        expected, sql_time = time_query(backend, sql, params, args.repeat)
+        result, engine_time = time_call(fn, args.repeat)
+        match = same_result(expected, result)
+        mismatches += not match
+        print(f'{name:<26}{sql_time * 1000:>10.1f}ms{engine_time * 1000:>10.2f}ms'
+              f'{sql_time / engine_time:>9.0f}x  {"yes" if match else "NO"}')
+
+    if mismatches:
+        raise SystemExit(f'{mismatches} aggregates returned different results')
@@ -0,0 +1,68 @@
+# Runs every page query on the SQLite database and the Parquet export, checks
+# that both return the same frame and prints the timings side by side.
+#
+#   python setup_db.py && python setup_db.py --format parquet
+#   python -m benchmarks.compare_backends --repeat 5
+import argparse
+import re
+import statistics
+import time
+
+import pandas as pd
+
+import db
+import queries
+
+
+def time_query(backend, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = backend.query(sql, params)
+        timings.append(time.perf_counter() - started)
+    return result, statistics.median(timings)
+
+
+def query_params(sql, category, days, months):
+    # Values for the query's placeholders, in the order they appear
+    params = ()
+    for match in re.finditer(r'description = \?|(\w+) BETWEEN \? AND \?', sql):
+        if match.group(1) is None:
+            params += (category,)
+        else:
+            params += days if match.group(1) == 'day' else months
+    return params
+
+
+def same_result(left, right):
+    try:
+        pd.testing.assert_frame_equal(left, right, check_dtype=False, rtol=1e-9)
+        return True
+    except AssertionError:
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare page query results and latency across backends.')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per query (median is reported)')
+    args = parser.parse_args()
+
+    backends = [db.SQLiteBackend(), db.ParquetBackend()]
+    category = backends[0].query(queries.TOP_CATEGORIES)['description'][0]
+    days = tuple(int(day) for day in backends[0].query(queries.DAY_RANGE).iloc[0])
+    # The last two calendar years, the range a recent-window view reads
+    months = (days[1] // 10_000 * 100 - 99, days[1] // 100)
+
+    print(f"{'query':<26}" + ''.join(f'{b.name:>12}' for b in backends) + f"{'speedup':>10}  match")
+    mismatches = 0
+    for name, sql in queries.PAGE_QUERIES.items():
+        params = query_params(sql, category, days, months)
+        results = [time_query(b, sql, params, args.repeat) for b in backends]
+        (base, base_time), (other, other_time) = results
+        match = same_result(base, other)
+        mismatches += not match
+        print(f'{name:<26}' + ''.join(f'{t * 1000:>10.1f}ms' for _, t in results)
+              + f'{base_time / other_time:>9.1f}x  {"yes" if match else "NO"}')
+
+    if mismatches:
+        raise SystemExit(f'{mismatches} queries returned different results')
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Synthetic stand-in for the Kaggle download, for measuring performance at any
+# scale. Writes the same five files with the same columns and quirks:
+# '$'-prefixed amounts and incomes, comma-joined `errors`, blank errors for
+# clean transactions, ONLINE merchants with no state/zip, and Yes/No fraud
+# labels for a subset of transaction ids.
+#
+#   python -m benchmarks.generate_data --rows 1000000 --out data
+
+MCC_CODES = {
+    5411: 'Grocery Stores, Supermarkets', 5499: 'Miscellaneous Food Stores',
+    5541: 'Service Stations', 5812: 'Eating Places and Restaurants',
+    5912: 'Drug Stores and Pharmacies', 4829: 'Money Transfer',
+    5300: 'Wholesale Clubs', 5814: 'Fast Food Restaurants',
+    4121: 'Taxicabs and Limousines', 4784: 'Tolls and Bridge Fees',
+    5311: 'Department Stores', 5310: 'Discount Stores',
+    4900: 'Utilities - Electric, Gas, Water, Sanitary',
+    5942: 'Book Stores', 5651: 'Family Clothing Stores',
+    5732: 'Electronics Stores', 5045: 'Computers, Computer Peripheral Equipment',
+    7538: 'Automotive Service Shops', 7011: 'Lodging - Hotels, Motels, Resorts',
+    3000: 'Airlines', 4814: 'Telecommunication Services',
+    5815: 'Digital Goods - Media, Books, Apps', 5921: 'Package Stores, Beer, Wine, Liquor',
+    8011: 'Doctors, Physicians', 8021: 'Dentists and Orthodontists',
+    5211: "Lumber and Building Materials", 5719: 'Miscellaneous Home Furnishing Stores',
+    5970: "Artist Supply Stores, Craft Shops", 5094: 'Precious Stones and Metals',
+    7801: "Betting (including Lottery Tickets, Casinos)",
+}
+ERROR_TYPES = [
+    'Insufficient Balance', 'Bad PIN', 'Technical Glitch', 'Bad Card Number',
+    'Bad Expiration', 'Bad CVV', 'Bad Zipcode',
+]
+CITIES = [('Beulah', 'ND', 58523.0), ('La Verne', 'CA', 91750.0),
+          ('Monterey Park', 'CA', 91754.0), ('Houston', 'TX', 77002.0),
+          ('Brooklyn', 'NY', 11201.0), ('Columbus', 'OH', 43215.0)]
+USE_CHIP = ['Swipe Transaction', 'Chip Transaction', 'Online Transaction']
+
+START = np.datetime64('2010-01-01T00:00')
+END   = np.datetime64('2019-11-01T00:00')
+FIRST_ID = 7475327
+
+MIN_ROWS = 10_000
+MAX_ROWS = 50_000_000
+
+
+def write_users(path, n_users, rng):
+    income = rng.lognormal(10.9, 0.45, n_users).round().astype(int)
+    users = pd.DataFrame({
+        'id': np.arange(n_users),
+        'current_age': rng.integers(18, 90, n_users),
+        'retirement_age': rng.integers(60, 75, n_users),
+        'birth_year': rng.integers(1930, 2002, n_users),
+        'birth_month': rng.integers(1, 13, n_users),
+        'gender': rng.choice(['Male', 'Female'], n_users),
+        'address': [f'{i} Main Street' for i in range(n_users)],
+        'latitude': rng.uniform(25, 48, n_users).round(2),
+        'longitude': rng.uniform(-122, -70, n_users).round(2),
+        'per_capita_income': ['$' + str(v) for v in (income * 0.5).round().astype(int)],
+        'yearly_income': ['$' + str(v) for v in income],
+        'total_debt': ['$' + str(v) for v in rng.integers(0, 300000, n_users)],
+        'credit_score': rng.integers(480, 850, n_users),
+        'num_credit_cards': rng.integers(1, 9, n_users),
+    })
+    users.to_csv(path, index=False)
+
+
+def write_cards(path, n_users, rng):
+    n_cards = n_users * 3
+    cards = pd.DataFrame({
+        'id': np.arange(n_cards),
+        'client_id': np.repeat(np.arange(n_users), 3),
+        'card_brand': rng.choice(['Visa', 'Mastercard', 'Amex', 'Discover'], n_cards),
+        'card_type': rng.choice(['Debit', 'Credit', 'Debit (Prepaid)'], n_cards),
+        'card_number': rng.integers(4_000_000_000_000_000, 5_999_999_999_999_999, n_cards),
+        'expires': [f'{m:02d}/{y}' for m, y in zip(rng.integers(1, 13, n_cards), rng.integers(2020, 2025, n_cards))],
+        'cvv': rng.integers(100, 1000, n_cards),
+        'has_chip': rng.choice(['YES', 'NO'], n_cards, p=[0.9, 0.1]),
+        'num_cards_issued': rng.integers(1, 4, n_cards),
+        'credit_limit': ['$' + str(v) for v in rng.integers(0, 40000, n_cards)],
+        'acct_open_date': [f'{m:02d}/{y}' for m, y in zip(rng.integers(1, 13, n_cards), rng.integers(1995, 2020, n_cards))],
+        'year_pin_last_changed': rng.integers(2002, 2020, n_cards),
+        'card_on_dark_web': 'No',
+    })
+    cards.to_csv(path, index=False)
+
+
+def transaction_chunk(start_id, n, n_users, rng, minute_offsets):
+    mccs = np.array(list(MCC_CODES))
+    weights = np.linspace(3, 0.2, len(mccs))
+    weights /= weights.sum()
+
+    amount = rng.lognormal(3.4, 1.1, n)
+    amount[rng.random(n) < 0.05] *= -1
+    amount = np.clip(amount, -500, 7000).round(2)
+
+    n_errors = np.where(rng.random(n) < 0.016, rng.integers(1, 3, n), 0)
+    errors = np.full(n, None, dtype=object)
+    for i in np.flatnonzero(n_errors):
+        errors[i] = ','.join(rng.choice(ERROR_TYPES, n_errors[i], replace=False))
+
+    city_idx = rng.integers(0, len(CITIES), n)
+    use_chip = rng.choice(USE_CHIP, n, p=[0.5, 0.38, 0.12])
+    online = use_chip == 'Online Transaction'
+    client_id = rng.integers(0, n_users, n)
+
+    dates = START + minute_offsets.astype('timedelta64[m]')
+    return pd.DataFrame({
+        'id': np.arange(start_id, start_id + n),
+        'date': pd.to_datetime(dates).strftime('%Y-%m-%d %H:%M:%S'),
+        'client_id': client_id,
+        'card_id': client_id * 3 + rng.integers(0, 3, n),
+        'amount': np.char.add('$', np.char.mod('%.2f', amount)),
+        'use_chip': use_chip,
+        'merchant_id': rng.integers(1, 100000, n),
+        'merchant_city': np.where(online, 'ONLINE', [CITIES[i][0] for i in city_idx]),
+        'merchant_state': np.where(online, None, [CITIES[i][1] for i in city_idx]),
+        'zip': np.where(online, np.nan, [CITIES[i][2] for i in city_idx]),
+        'mcc': rng.choice(mccs, n, p=weights),
+        'errors': errors,
+    })
+
+
+def generate(out_dir, rows, users=None, fraud_rate=0.0015, labelled=0.67, chunk_size=500_000, seed=42):
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    n_users = users or max(50, min(2000, rows // 6000))
+
+    write_users(os.path.join(out_dir, 'users_data.csv'), n_users, rng)
+    write_cards(os.path.join(out_dir, 'cards_data.csv'), n_users, rng)
+    with open(os.path.join(out_dir, 'mcc_codes.json'), 'w') as f:
+        json.dump({str(k): v for k, v in MCC_CODES.items()}, f)
+
+    # Transactions are written in id (and therefore date) order, like the source.
+    total_minutes = int((END - START) / np.timedelta64(1, 'm'))
+    path = os.path.join(out_dir, 'transactions_data.csv')
+    labels_path = os.path.join(out_dir, 'train_fraud_labels.json')
+    with open(labels_path, 'w') as labels:
+        labels.write('{"target": {')
+        first = True
+        written = 0
+        while written < rows:
+            n = min(chunk_size, rows - written)
+            lo = total_minutes * written // rows
+            hi = total_minutes * (written + n) // rows
+            offsets = np.sort(rng.integers(lo, max(hi, lo + 1), n))
+            chunk = transaction_chunk(FIRST_ID + written, n, n_users, rng, offsets)
+            chunk.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+
+            keep = rng.random(n) < labelled
+            fraud = rng.random(n) < fraud_rate
+            entries = np.char.add(
+                np.char.add('"', chunk['id'].to_numpy()[keep].astype(str)),
+                np.where(fraud[keep], '": "Yes"', '": "No"'),
+            )
+            if len(entries):
+                labels.write(('' if first else ', ') + ', '.join(entries))
+                first = False
+            written += n
+            print(f'  {written:,} / {rows:,} transactions', flush=True)
+        labels.write('}}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic copy of the Kaggle transactions dataset.')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of transactions (10k to 50M)')
+    parser.add_argument('--users', type=int, default=None, help='number of users (default scales with --rows)')
+    parser.add_argument('--out', default='data', help='output directory')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if not MIN_ROWS <= args.rows <= MAX_ROWS:
+        parser.error(f'--rows must be between {MIN_ROWS:,} and {MAX_ROWS:,}')
+
+    started = time.perf_counter()
+    generate(args.out, args.rows, users=args.users, seed=args.seed)
+    print(f'Generated {args.rows:,} transactions in {args.out}/ ({time.perf_counter() - started:.1f}s)')
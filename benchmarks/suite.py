@@ -0,0 +1,226 @@
+# End-to-end benchmark: builds the database from a data/ folder, runs
+# precompute, the forecast batch, the page SARIMAX fits and every load_*
+# function in pages/, and records wall time, peak RSS and rows/sec per step
+# to a JSON baseline. Commit the baseline and regressions show up in a diff.
+#
+#   python -m benchmarks.suite --rows 1000000              # synthetic data
+#   python -m benchmarks.suite --workdir ~/kaggle          # existing data/
+#
+# Every step runs in its own process so its peak RSS is its own. The working
+# directory gets a data/ folder with the five source files; the database and
+# precomputed outputs are written next to them.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO, 'benchmarks', 'baseline.json')
+
+
+# ── Steps run inside the child process ─────────────────────────────────────────
+def loader_args(fn):
+    # Arguments by parameter name, matching what the pages pass
+    import approx
+    import db
+    import forecasting
+    import queries
+    import trends
+
+    values = {
+        'version': lambda: db.data_version(),
+        'category': lambda: db.query(queries.TOP_CATEGORIES)['description'][0],
+        'client_id': lambda: int(db.query(queries.USER_IDS)['client_id'][0]),
+        'series': lambda: forecasting.TOTAL,
+        # The trend charts at their heaviest: every day of the data
+        'start': lambda: trends.date_range(db.query(queries.DAY_RANGE))[0],
+        'end': lambda: trends.date_range(db.query(queries.DAY_RANGE))[1],
+        'granularity': lambda: 'Day',
+        # Every error combination
+        'mask': lambda: 0,
+        # The estimates from the smallest sample
+        'rate': lambda: approx.stored_rates()[0],
+    }
+    names = fn.__code__.co_varnames[:fn.__code__.co_argcount]
+    return [values[name]() for name in names]
+
+
+def result_rows(result):
+    # Rows in a loader's return value: frames and lists by length, tuples of
+    # them summed, anything else (a model, a matrix object) counted as one
+    if isinstance(result, tuple):
+        return sum(result_rows(r) for r in result)
+    if hasattr(result, '__len__'):
+        return len(result)
+    return 1
+
+
+def run_loaders(page):
+    from warmup import page_loaders
+
+    timings = {}
+    for name, fn in page_loaders(os.path.join(REPO, 'pages', page)).items():
+        args = loader_args(fn)
+        started = time.perf_counter()
+        result = fn(*args)
+        seconds = time.perf_counter() - started
+        timings[name] = {'seconds': seconds, 'rows': result_rows(result)}
+    return timings
+
+
+def run_fits():
+    # The fits the Forecasting page falls back to when no artifact exists:
+    # the total and the busiest category, eval and full model each
+    import db
+    import forecasting
+    import queries
+
+    category = db.query(queries.TOP_CATEGORIES)['description'][0]
+    timings = {}
+    for name, series, order in [
+        ('total', forecasting.load_total_series(), forecasting.TOTAL_ORDER),
+        ('category', forecasting.load_category_series(category), forecasting.CATEGORY_ORDER),
+    ]:
+        started = time.perf_counter()
+        forecasting.fit_artifact(series, order)
+        timings[name] = {'seconds': time.perf_counter() - started, 'rows': len(series)}
+    return timings
+
+
+# ── Driver ─────────────────────────────────────────────────────────────────────
+def measure(command, workdir):
+    # Wall time and peak RSS of one child process. On Linux the peak covers
+    # the child's own worker processes too (the largest of them).
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    started = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.PIPE, text=True)
+    output = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise SystemExit(f'{" ".join(command)} failed with exit code {proc.returncode}')
+    return output, seconds, usage.ru_maxrss / 1024
+
+
+def step(seconds, peak_rss_mb, rows):
+    return {
+        'seconds': round(seconds, 3),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'rows': int(rows),
+        'rows_per_sec': round(rows / seconds) if seconds else None,
+    }
+
+
+def transaction_count(workdir):
+    import sqlite3
+    conn = sqlite3.connect(os.path.join(workdir, 'data', 'finance.db'))
+    try:
+        return conn.execute('SELECT COUNT(*) FROM transactions').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_suite(workdir, rows=None, seed=42, workers=None):
+    python = sys.executable
+    steps = {}
+
+    if rows:
+        print(f'Generating {rows:,} transactions in {workdir}/data')
+        _, seconds, rss = measure([python, '-m', 'benchmarks.generate_data', '--rows', str(rows),
+                                   '--seed', str(seed), '--out', 'data'], workdir)
+        steps['generate_data'] = step(seconds, rss, rows)
+
+    workers_args = ['--workers', str(workers)] if workers else []
+    # The sample is drawn by default only under FINANCE_ENGINE=numpy, and the
+    # estimate loaders are timed either way
+    sample_args = ['--sample-rates', os.environ.get('FINANCE_SAMPLE_RATES', '0.001,0.01')]
+    print('Running setup_db.py')
+    _, seconds, rss = measure([python, os.path.join(REPO, 'setup_db.py'), *workers_args, *sample_args], workdir)
+    n = transaction_count(workdir)
+    steps['setup_db'] = step(seconds, rss, n)
+
+    print('Running precompute.py')
+    _, seconds, rss = measure([python, os.path.join(REPO, 'precompute.py'), '--skip-forecasts'], workdir)
+    steps['precompute'] = step(seconds, rss, n)
+
+    print('Running forecast.py')
+    _, seconds, rss = measure([python, os.path.join(REPO, 'forecast.py'), *workers_args], workdir)
+    steps['forecast_batch'] = step(seconds, rss, n)
+
+    print('Timing the Forecasting page fits')
+    output, _, rss = measure([python, '-m', 'benchmarks.suite', '--child', 'fits'], workdir)
+    for name, t in json.loads(output.splitlines()[-1]).items():
+        steps[f'fit_{name}'] = step(t['seconds'], rss, t['rows'])
+
+    for page in sorted(os.listdir(os.path.join(REPO, 'pages'))):
+        if not page.endswith('.py'):
+            continue
+        print(f'Timing loaders in {page}')
+        output, _, rss = measure([python, '-m', 'benchmarks.suite', '--child', f'loaders:{page}'], workdir)
+        for name, t in json.loads(output.splitlines()[-1]).items():
+            steps[f'{page[:-3]}.{name}'] = step(t['seconds'], rss, t['rows'])
+
+    return {
+        'meta': {
+            'transactions': n,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'steps': steps,
+    }
+
+
+def print_comparison(result, previous):
+    before = previous.get('steps', {}) if previous else {}
+    print(f"\n{'step':<48}{'seconds':>10}{'peak MB':>10}{'rows/sec':>12}{'vs baseline':>13}")
+    for name, s in result['steps'].items():
+        change = ''
+        if name in before and before[name]['seconds']:
+            change = f"{100 * (s['seconds'] / before[name]['seconds'] - 1):+.0f}%"
+        rate = f"{s['rows_per_sec']:,}" if s['rows_per_sec'] is not None else '-'
+        print(f"{name:<48}{s['seconds']:>10.3f}{s['peak_rss_mb']:>10.1f}{rate:>12}{change:>13}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the data pipeline and page loaders and write a JSON baseline.')
+    parser.add_argument('--rows', type=int, default=None,
+                        help='generate this many synthetic transactions first (10k to 50M)')
+    parser.add_argument('--workdir', default=None,
+                        help='directory holding data/ (default: a new temporary directory, needs --rows)')
+    parser.add_argument('--seed', type=int, default=42, help='seed for the synthetic data')
+    parser.add_argument('--workers', type=int, default=None, help='--workers passed to setup_db.py and forecast.py')
+    parser.add_argument('--out', default=BASELINE_PATH, help='JSON file to write (compared against if it exists)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Inside a measured child process: print the timings as the last line
+        if args.child == 'fits':
+            print(json.dumps(run_fits()))
+        else:
+            print(json.dumps(run_loaders(args.child.split(':', 1)[1])))
+        raise SystemExit(0)
+
+    if args.workdir is None and args.rows is None:
+        parser.error('give --rows to generate data, or --workdir pointing at an existing data/ folder')
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='finance-bench-'))
+    os.makedirs(os.path.join(workdir, 'data'), exist_ok=True)
+
+    previous = None
+    if os.path.exists(args.out):
+        with open(args.out) as f:
+            previous = json.load(f)
+
+    result = run_suite(workdir, rows=args.rows, seed=args.seed, workers=args.workers)
+    print_comparison(result, previous)
+
+    with open(args.out, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f'\nBaseline written to {args.out}')
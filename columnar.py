@@ -0,0 +1,274 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import db
+import error_flags
+
+# Set FINANCE_ENGINE=numpy to answer the page aggregates from transactions
+# held in memory as NumPy columns instead of sending SQL to the backend.
+ENGINE  = os.environ.get('FINANCE_ENGINE', 'sql')
+ENABLED = ENGINE == 'numpy'
+
+# Transactions are read from the backend in id ranges of this size
+LOAD_CHUNK_IDS = 1_000_000
+
+LOAD_SQL = """
+    SELECT t.month, t.mcc, t.client_id, t.error_mask, t.amount_cents, f.is_fraud
+    FROM transactions t
+    LEFT JOIN fraud_labels f ON t.id = f.transaction_id
+    WHERE t.id > ? AND t.id <= ?
+"""
+
+
+def _month_code(yyyymm):
+    # Months since January 1970, small enough for int16
+    yyyymm = np.asarray(yyyymm, dtype='int64')
+    return ((yyyymm // 100 - 1970) * 12 + yyyymm % 100 - 1).astype('int16')
+
+
+def _yyyymm(code):
+    code = np.asarray(code, dtype='int64')
+    return (code // 12 + 1970) * 100 + code % 12 + 1
+
+
+def _round_half_away(hundredths):
+    # Rounded to whole hundredths the way SQLite's ROUND(x, 2) does, halves
+    # away from zero. Series.round(2) rounds halves to even, and on the
+    # binary value, where 72.475 is just below itself.
+    return np.sign(hundredths) * np.floor(np.abs(hundredths) + 0.5) / 100
+
+
+class _Dictionary:
+    # Grows a value -> code mapping across chunks. NULL gets a code like any
+    # other value and decodes back to None.
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, column):
+        inverse, uniques = pd.factorize(column, use_na_sentinel=False)
+        mapping = np.array([
+            self._codes.setdefault(None if pd.isna(u) else u, len(self._codes))
+            for u in uniques
+        ], dtype='int32')
+        self.values = list(self._codes)
+        return mapping[inverse] if len(mapping) else np.empty(0, dtype='int32')
+
+
+class TransactionStore:
+    # One process-wide copy of the transactions the pages aggregate:
+    #
+    #   amount_cents  int64   exact money
+    #   month         int16   months since 1970-01
+    #   mcc           codes into self.mcc_values
+    #   client        codes into self.client_values
+    #   error_mask    uint8   error_flags bits, labelled by error_flags.LABELS
+    #   is_fraud      bool    labelled fraud
+    #   labelled      bool    has a fraud label at all
+    #
+    # Rows are sorted by (mcc, month), so a category is a handful of
+    # contiguous slices and per-mcc totals are one np.add.reduceat.
+    # Dictionary codes use the smallest integer type that fits.
+
+    def __init__(self, version=None):
+        # Holds the transactions up to the data version's watermark (the
+        # current one when None, nothing before the first precompute): the
+        # rows the rollup-backed queries answer for. Transactions are
+        # append-only by id, so rows appended while loading are all above it
+        # and the count read here holds.
+        self.version = version
+        hi = (version if version is not None else db.data_version()) or 0
+        sizes = db.query('SELECT COUNT(*) AS n, MIN(id) AS lo FROM transactions WHERE id <= ?', (hi,))
+        n = int(sizes['n'][0])
+        lo = int(sizes['lo'][0]) - 1 if n else hi
+
+        amount_cents = np.empty(n, dtype='int64')
+        month = np.empty(n, dtype='int16')
+        mcc, client = (np.empty(n, dtype='int32') for _ in range(2))
+        error_mask = np.empty(n, dtype='uint8')
+        is_fraud = np.empty(n, dtype='bool')
+        labelled = np.empty(n, dtype='bool')
+        dictionaries = {'mcc': _Dictionary(), 'client': _Dictionary()}
+
+        filled = 0
+        for after_id in range(lo, hi, LOAD_CHUNK_IDS):
+            chunk = db.query(LOAD_SQL, (after_id, min(after_id + LOAD_CHUNK_IDS, hi)))
+            rows = slice(filled, filled + len(chunk))
+            amount_cents[rows] = chunk['amount_cents'].to_numpy()
+            month[rows] = _month_code(chunk['month'].to_numpy())
+            mcc[rows] = dictionaries['mcc'].encode(chunk['mcc'])
+            client[rows] = dictionaries['client'].encode(chunk['client_id'])
+            error_mask[rows] = chunk['error_mask'].to_numpy()
+            fraud = chunk['is_fraud'].to_numpy(dtype='float64', na_value=np.nan)
+            is_fraud[rows] = fraud == 1
+            labelled[rows] = ~np.isnan(fraud)
+            filled += len(chunk)
+
+        def narrow(codes, dictionary):
+            return codes.astype(np.min_scalar_type(max(len(dictionary.values) - 1, 0)))
+
+        order = np.lexsort((month, mcc))
+        self.amount_cents = amount_cents[order]
+        self.month = month[order]
+        self.mcc = narrow(mcc, dictionaries['mcc'])[order]
+        self.client = narrow(client, dictionaries['client'])[order]
+        self.error_mask = error_mask[order]
+        self.is_fraud = is_fraud[order]
+        self.labelled = labelled[order]
+
+        self.mcc_values = np.array(dictionaries['mcc'].values, dtype='int64')
+        self.client_values = np.array(dictionaries['client'].values, dtype='int64')
+        # Rows of mcc code i are mcc_offsets[i]:mcc_offsets[i + 1]
+        self.mcc_offsets = np.searchsorted(self.mcc, np.arange(len(self.mcc_values) + 1))
+
+        # Category description per mcc code (None where mcc_codes has no entry)
+        names = db.query('SELECT mcc, description FROM mcc_codes')
+        lookup = dict(zip(names['mcc'], names['description']))
+        self.mcc_descriptions = np.array([lookup.get(int(m)) for m in self.mcc_values], dtype='object')
+
+    def __len__(self):
+        return len(self.amount_cents)
+
+    # ── Footprint ──────────────────────────────────────────────────────────────
+    def memory_usage(self):
+        # Bytes held per column, dictionaries and offsets included
+        arrays = {
+            'amount_cents': self.amount_cents, 'month': self.month, 'mcc': self.mcc,
+            'client': self.client, 'error_mask': self.error_mask, 'is_fraud': self.is_fraud,
+            'labelled': self.labelled, 'mcc_offsets': self.mcc_offsets,
+            'mcc_values': self.mcc_values, 'client_values': self.client_values,
+        }
+        return pd.Series({name: array.nbytes for name, array in arrays.items()}, name='bytes')
+
+    @property
+    def nbytes(self):
+        return int(self.memory_usage().sum())
+
+    # ── Kernels ────────────────────────────────────────────────────────────────
+    def _category_rows(self, category):
+        # Row indices of every mcc with this description, as contiguous slices
+        codes = np.flatnonzero(self.mcc_descriptions == category)
+        return np.concatenate([np.arange(self.mcc_offsets[c], self.mcc_offsets[c + 1]) for c in codes]) \
+            if len(codes) else np.empty(0, dtype='int64')
+
+    def _in_months(self, months):
+        # Row mask for a (first, last) YYYYMM range, or every row for None
+        if months is None:
+            return np.ones(len(self), dtype=bool)
+        # In int64: ALL_MONTHS reaches past what the int16 codes can hold
+        first, last = ((np.int64(m) // 100 - 1970) * 12 + np.int64(m) % 100 - 1 for m in months)
+        return (self.month >= first) & (self.month <= last)
+
+    def _monthly(self, month, amount_cents):
+        # bincount sums in float64, which is exact for integer cents totals
+        # below 2**53 (about $90 trillion)
+        counts = np.bincount(month)
+        cents = np.bincount(month, weights=amount_cents)
+        present = np.flatnonzero(counts)
+        return pd.DataFrame({
+            'month': _yyyymm(present),
+            'monthly_total': cents[present] / 100,
+        })
+
+    def _per_mcc(self, months=None):
+        starts = self.mcc_offsets[:-1]
+        if months is None:
+            n, amount_cents = np.diff(self.mcc_offsets), self.amount_cents
+        else:
+            keep = self._in_months(months)
+            n = np.add.reduceat(keep.astype('int64'), starts) if len(self) else 0
+            amount_cents = np.where(keep, self.amount_cents, 0)
+        cents = np.add.reduceat(amount_cents, starts) if len(self) else 0
+        df = pd.DataFrame({
+            'description': self.mcc_descriptions,
+            'n': n,
+            'cents': cents,
+        })
+        df = df[df['n'] > 0]
+        return df.groupby('description', dropna=False, sort=False)[['n', 'cents']].sum().reset_index()
+
+    # ── Page aggregates ────────────────────────────────────────────────────────
+    # Same columns as the matching query in queries.py. `months` is the
+    # query's (first, last) YYYYMM range, None for the whole history.
+    def monthly_totals(self, months=None):
+        keep = self._in_months(months)
+        return self._monthly(self.month[keep], self.amount_cents[keep])
+
+    def category_monthly_totals(self, category, months=None):
+        rows = self._category_rows(category)
+        rows = rows[self._in_months(months)[rows]]
+        return self._monthly(self.month[rows], self.amount_cents[rows])
+
+    def category_summary(self, months=None):
+        df = self._per_mcc(months)
+        return pd.DataFrame({
+            'description': df['description'],
+            'number_transactions': df['n'],
+            'total_spent': df['cents'] / 100,
+            'avg_transaction': _round_half_away(df['cents'] / df['n']),
+        })
+
+    def top_by_volume(self, limit=10, months=None):
+        df = self.category_summary(months)
+        return df.sort_values(['number_transactions', 'description'], ascending=[False, True]) \
+            .head(limit).reset_index(drop=True)
+
+    def top_by_avg(self, limit=10, months=None):
+        df = self.category_summary(months)
+        return df.sort_values(['avg_transaction', 'description'], ascending=[False, True]) \
+            .head(limit).reset_index(drop=True)
+
+    def all_categories(self):
+        return sorted({d for d in self.mcc_descriptions if d is not None})
+
+    def error_distribution(self, limit=10, months=None):
+        # Transactions with exactly one error, i.e. a single bit set
+        counts = np.bincount(self.error_mask[self._in_months(months)], minlength=error_flags.COMBINATIONS)
+        flags = np.array(list(error_flags.FLAGS.values()))
+        df = pd.DataFrame({'errors': error_flags.labels(flags), 'transaction_count': counts[flags]})
+        df = df[df['transaction_count'] > 0]
+        return df.sort_values(['transaction_count', 'errors'], ascending=[False, True]) \
+            .head(limit).reset_index(drop=True)
+
+    def fraud_rate(self, by='month', category=None):
+        # Labelled fraud count and rate grouped by 'month', 'errors' or
+        # 'category', optionally within one category. Matches the columns of
+        # the fraud CSVs precompute.py writes.
+        rows = self._category_rows(category) if category is not None else slice(None)
+        keys, names = {
+            'month': (self.month, None),
+            'errors': (self.error_mask, error_flags.LABELS),
+            'category': (self.mcc, self.mcc_descriptions),
+        }[by]
+        keys = keys[rows]
+        total = np.bincount(keys)
+        fraud = np.bincount(keys, weights=self.is_fraud[rows]).astype('int64')
+        present = np.flatnonzero(total)
+        df = pd.DataFrame({
+            by: _yyyymm(present) if names is None else np.asarray(names, dtype='object')[present],
+            'total_transactions': total[present],
+            'fraud_count': fraud[present],
+        })
+        if by == 'category':
+            df = df.groupby('category', dropna=False, sort=False).sum().reset_index()
+        df['fraud_rate'] = _round_half_away(10_000 * df['fraud_count'] / df['total_transactions'])
+        return df
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get_store(version=None):
+    # The process-wide store, shared by every session. Loaded on first use and
+    # reloaded when the data version moves on.
+    global _store
+    with _lock:
+        if _store is None or _store.version != version:
+            _store = None
+            _store = TransactionStore(version)
+        return _store
@@ -0,0 +1,403 @@
+import atexit
+import contextlib
+import hashlib
+import os
+import pathlib
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import pandas as pd
+
+import profiling
+
+DB_PATH     = 'data/finance.db'
+PARQUET_DIR = 'data/parquet'
+
+# Which store the dashboard reads from: 'sqlite' (data/finance.db) or
+# 'parquet' (the year-partitioned export in data/parquet, queried with DuckDB).
+BACKEND = os.environ.get('FINANCE_BACKEND', 'sqlite')
+
+# Rows per DataFrame yielded by stream()
+STREAM_BATCH_ROWS = 50_000
+
+# fingerprint() is recomputed at most this often, in seconds
+FINGERPRINT_TTL = 1.0
+
+
+def _stat_digest(paths):
+    # Digest of the identity, size and modification time of each file, so a
+    # rebuilt, replaced or appended-to file gives a new value
+    h = hashlib.sha256()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        h.update(repr((str(path), st.st_ino, st.st_size, st.st_mtime_ns)).encode())
+    return h.hexdigest()[:16]
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    # Applied to every pooled connection. mmap_size lets reads come straight
+    # from the OS page cache, cache_size (negative means KiB) keeps the hot
+    # index pages of each connection resident, and temp_store keeps the scratch
+    # B-trees behind GROUP BY / DISTINCT / ORDER BY in memory.
+    PRAGMAS = {
+        'mmap_size': 1 << 30,
+        'cache_size': -64_000,
+        'temp_store': 'MEMORY',
+    }
+
+    # Prepared statements kept per connection, keyed on the SQL text. Loaders
+    # pass values as `?` parameters, so every call of a loader hits the cache.
+    CACHED_STATEMENTS = 256
+
+    def __init__(self, path=DB_PATH, pool_size=8):
+        self.path = path
+        self._uri = pathlib.Path(path).resolve().as_uri() + '?mode=ro'
+        # LIFO so the most recently used connection, with the warmest page
+        # cache, is handed out first. A connection belongs to one thread for
+        # the length of a query, and at most pool_size are open at once.
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self._uri, uri=True,
+            check_same_thread=False,
+            cached_statements=self.CACHED_STATEMENTS,
+        )
+        for pragma, value in self.PRAGMAS.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        with self._lock:
+            self._opened.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        # Checks a read-only connection out of the pool for the calling thread
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+
+    def query(self, sql, params=()):
+        with self.connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def fingerprint(self):
+        # Changes whenever anything writes to the database file
+        return _stat_digest([self.path, f'{self.path}-wal'])
+
+    def explain(self, sql, params=()):
+        # EXPLAIN QUERY PLAN as an indented tree, and the steps that read a
+        # stored table or index in full: SCAN steps other than those over a
+        # subquery or CTE the plan builds itself, or a SELECT with no FROM
+        with self.connection() as conn:
+            rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        depth, lines = {0: -1}, []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node] + detail)
+        details = [detail for *_, detail in rows]
+        built = {d.split()[1] for d in details if d.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+        full_scans = [d for d in details if d.startswith('SCAN ') and d.split()[1] not in built
+                      and d != 'SCAN CONSTANT ROW']
+        return '\n'.join(lines), full_scans
+
+    def stream(self, sql, params=(), batch_rows=STREAM_BATCH_ROWS):
+        # Yields the result in DataFrames of up to batch_rows rows, fetched
+        # one batch at a time. Uses its own read-only connection with sorts
+        # spilling to disk, since a row-level query may be too large for the
+        # in-memory temp store the pool uses. Closed when the generator is.
+        conn = sqlite3.connect(self._uri, uri=True)
+        try:
+            conn.execute(f"PRAGMA mmap_size = {self.PRAGMAS['mmap_size']}")
+            conn.execute('PRAGMA temp_store = FILE')
+            cursor = conn.execute(sql, params)
+            columns = [d[0] for d in cursor.description]
+            while rows := cursor.fetchmany(batch_rows):
+                yield pd.DataFrame.from_records(rows, columns=columns)
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            for conn in self._opened:
+                conn.close()
+            self._opened.clear()
+        self._idle = queue.LifoQueue()
+
+    def materialize(self, name, sql, indexes=(), watermark=None):
+        # Built under a scratch name and swapped in within one transaction, so
+        # `sql` may read the table it replaces and readers never see it half done.
+        # The table's watermark is recorded in the same transaction. Writes go
+        # through their own connection, outside the read-only pool, with the
+        # transaction opened explicitly: sqlite3 would otherwise run each DDL
+        # statement on its own.
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(f'DROP TABLE IF EXISTS {name}__new')
+                conn.execute(f'CREATE TABLE {name}__new AS {sql}')
+                conn.execute(f'DROP TABLE IF EXISTS {name}')
+                conn.execute(f'ALTER TABLE {name}__new RENAME TO {name}')
+                for statement in indexes:
+                    conn.execute(statement)
+                if watermark is not None:
+                    conn.execute('CREATE TABLE IF NOT EXISTS watermarks (name TEXT PRIMARY KEY, max_id INTEGER)')
+                    conn.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?)', (name, watermark))
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def watermark(self, name):
+        try:
+            df = self.query('SELECT max_id FROM watermarks WHERE name = ?', (name,))
+        except Exception as e:
+            if not missing_table(e):
+                raise
+            return None
+        return None if df.empty else int(df['max_id'][0])
+
+    def store(self, name, df, indexes=()):
+        # Same swap as materialize, for rows computed in Python
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute(f'DROP TABLE IF EXISTS {name}__new')
+            df.to_sql(f'{name}__new', conn, index=False)
+            with conn:
+                conn.execute(f'DROP TABLE IF EXISTS {name}')
+                conn.execute(f'ALTER TABLE {name}__new RENAME TO {name}')
+                for statement in indexes:
+                    conn.execute(statement)
+        finally:
+            conn.close()
+
+
+class ParquetBackend:
+    name = 'parquet'
+
+    def __init__(self, root=PARQUET_DIR):
+        import duckdb
+
+        # Each table is a directory of Parquet files. transactions is split
+        # into year=YYYY/ directories, which DuckDB exposes as a `year` column
+        # and uses to skip whole partitions.
+        self.root = root
+        self.conn = duckdb.connect()
+        for table in sorted(os.listdir(root)):
+            self._create_view(table)
+
+    def _create_view(self, table):
+        files = os.path.join(self.root, table, '**', '*.parquet')
+        self.conn.execute(f"""
+            CREATE OR REPLACE VIEW {table} AS
+            SELECT * FROM read_parquet('{files}', hive_partitioning = true)
+        """)
+
+    def _relation(self, sql, params):
+        # A cursor per call, since one DuckDB connection is not safe to share
+        # between Streamlit's script threads.
+        rel = self.conn.cursor().sql(sql, params=list(params) or None)
+
+        # DuckDB widens SUM over integers to HUGEINT, which pandas turns into
+        # float64. Narrow it back so results match SQLite's int64 columns.
+        columns = [
+            f'CAST("{col}" AS BIGINT) AS "{col}"' if str(dtype) == 'HUGEINT' else f'"{col}"'
+            for col, dtype in zip(rel.columns, rel.types)
+        ]
+        return rel.project(', '.join(columns))
+
+    def query(self, sql, params=()):
+        return self._relation(sql, params).df()
+
+    def fingerprint(self):
+        # Changes whenever a Parquet file is added, removed or rewritten
+        return _stat_digest(sorted(pathlib.Path(self.root).rglob('*.parquet')))
+
+    def explain(self, sql, params=()):
+        # DuckDB's physical plan. A Parquet scan with no filter pushed into
+        # it reads every file of the table, so that is reported as full.
+        rows = self.conn.cursor().execute(f'EXPLAIN {sql}', list(params) or None).fetchall()
+        text = '\n'.join(plan for _, plan in rows)
+        if 'Filters:' in text:
+            return text, []
+        return text, [op for op in ('READ_PARQUET', 'SEQ_SCAN') if op in text]
+
+    def stream(self, sql, params=(), batch_rows=STREAM_BATCH_ROWS):
+        # Yields the result in DataFrames of up to batch_rows rows, pulled
+        # from DuckDB's Arrow record batch reader as they are consumed
+        for batch in self._relation(sql, params).fetch_record_batch(batch_rows):
+            yield batch.to_pandas()
+
+    def materialize(self, name, sql, indexes=(), watermark=None):
+        # Written to a temporary file first so `sql` may read the table it
+        # replaces and readers never see a partial file. The watermark goes
+        # in the file's own metadata, so it is replaced along with the rows.
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'part-0.parquet')
+        metadata = f", KV_METADATA {{max_id: '{int(watermark)}'}}" if watermark is not None else ''
+        self.conn.execute(f"COPY ({sql}) TO '{path}.tmp' (FORMAT PARQUET{metadata})")
+        os.replace(f'{path}.tmp', path)
+        self._create_view(name)
+
+    def watermark(self, name):
+        path = os.path.join(self.root, name, 'part-0.parquet')
+        if not os.path.exists(path):
+            return None
+        rows = self.conn.cursor().execute(
+            "SELECT value FROM parquet_kv_metadata(?) WHERE key = 'max_id'", [path]).fetchall()
+        return int(rows[0][0]) if rows else None
+
+    def store(self, name, df, indexes=()):
+        directory = os.path.join(self.root, name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'part-0.parquet')
+        df.to_parquet(f'{path}.tmp', index=False)
+        os.replace(f'{path}.tmp', path)
+        self._create_view(name)
+
+    def close(self):
+        self.conn.close()
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'parquet': ParquetBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if BACKEND not in BACKENDS:
+            raise ValueError(f'Unknown FINANCE_BACKEND {BACKEND!r}, expected one of {sorted(BACKENDS)}')
+        _backend = BACKENDS[BACKEND]()
+    return _backend
+
+
+def query(sql, params=()):
+    # Recorded in the profiling log with its latency, result size and plan
+    backend = get_backend()
+    _, full_scans = profiling.plan(backend, sql, params)
+    with profiling.timed('query', sql, backend=backend.name, full_scans=full_scans) as event:
+        df = backend.query(sql, params)
+        event['rows'], event['bytes'] = profiling.frame_size(df)
+    return df
+
+
+def stream(sql, params=(), batch_rows=STREAM_BATCH_ROWS):
+    # Runs `sql` as a generator of DataFrames, so results far larger than
+    # memory can be written out batch by batch. Recorded once exhausted or
+    # closed, with the time the consumer spent between batches included.
+    backend = get_backend()
+    with profiling.timed('stream', sql, backend=backend.name, rows=0, bytes=0) as event:
+        batches = backend.stream(sql, params, batch_rows)
+        try:
+            for df in batches:
+                rows, nbytes = profiling.frame_size(df)
+                event['rows'] += rows
+                event['bytes'] += nbytes
+                yield df
+        finally:
+            batches.close()
+
+
+def fuse(*queries):
+    # Combines single-row queries into one statement, so a loader that needs
+    # several metrics makes one round trip and reads each table once. Column
+    # names must be distinct; `?` parameters keep their order across parts.
+    parts = [f'({sql}) AS q{i}' for i, sql in enumerate(queries)]
+    return 'SELECT * FROM ' + ' CROSS JOIN '.join(parts)
+
+
+def materialize(name, sql, indexes=(), watermark=None):
+    # Stores the result of `sql` as table `name` in the active backend.
+    # `indexes` are CREATE INDEX statements, applied where the backend has them.
+    # `watermark`, the highest transaction id the table covers, is stored
+    # atomically with it and read back by watermark().
+    with profiling.timed('materialize', name, sql=sql):
+        get_backend().materialize(name, sql, indexes, watermark)
+
+
+def watermark(name):
+    # Highest transaction id folded into table `name` by its last
+    # materialize(), or None if it was never given one
+    return get_backend().watermark(name)
+
+
+def store(name, df, indexes=()):
+    # Stores DataFrame `df` as table `name`, replacing it atomically like materialize
+    with profiling.timed('store', name, rows=len(df)):
+        get_backend().store(name, df, indexes)
+
+
+@atexit.register
+def close():
+    # Closes every connection the active backend opened. Runs at interpreter
+    # exit, and can be called earlier by scripts that are done reading.
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
+
+
+_fingerprint = (0.0, None)
+
+
+def fingerprint():
+    # Identifies the current contents of the active backend's files, for
+    # caches that outlive the process. Cheap (a stat per file) and memoised
+    # for FINGERPRINT_TTL seconds.
+    global _fingerprint
+    checked, value = _fingerprint
+    now = time.monotonic()
+    if value is None or now - checked > FINGERPRINT_TTL:
+        value = get_backend().fingerprint()
+        _fingerprint = (now, value)
+    return value
+
+
+def data_version():
+    # Highest transaction id folded into the rollup, bumped by every
+    # precompute.py run. Each page reads it once per run and passes it to all
+    # of its loaders as `version`, the cache key that makes them pick up
+    # newly folded-in transactions without a server restart. None before the
+    # first precompute.
+    try:
+        return int(query('SELECT max_id FROM rollup_watermark')['max_id'][0])
+    except Exception as e:
+        if not missing_table(e):
+            raise
+        return None
+
+
+def missing_table(e):
+    # Whether exception `e` is a query on a table that does not exist yet:
+    # sqlite3's "no such table", which pandas wraps as DatabaseError, or
+    # DuckDB's CatalogException. Anything else (a locked or corrupt file, a
+    # missing column) is a real failure for the caller to raise.
+    if isinstance(e, pd.errors.DatabaseError):
+        return 'no such table' in str(e)
+    duckdb = sys.modules.get('duckdb')
+    return duckdb is not None and isinstance(e, duckdb.CatalogException)
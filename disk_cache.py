@@ -0,0 +1,244 @@
+import ast
+import functools
+import glob
+import hashlib
+import inspect
+import os
+import pickle
+import textwrap
+import threading
+
+import pandas as pd
+
+import db
+import profiling
+
+# A tier of loader results on disk, under the in-memory Streamlit caches and
+# shared by every server process on the host, so a restart or another replica
+# starts warm. Entries are keyed on the loader's source, its arguments,
+# db.fingerprint() and CODE_VERSION, so rebuilding the database or changing
+# the code retires all of them. Set FINANCE_DISK_CACHE=0 to turn it off.
+ENABLED   = os.environ.get('FINANCE_DISK_CACHE', '1') != '0'
+CACHE_DIR = os.environ.get('FINANCE_CACHE_DIR', 'data/cache')
+
+# Total size kept on disk. Past it the least recently read entries go first.
+MAX_BYTES = int(os.environ.get('FINANCE_CACHE_MB', '512')) << 20
+
+# evict() scans the whole cache, so a process runs it only once it has written
+# this much since its last run, or on its first write under a new fingerprint.
+# The cache can overshoot MAX_BYTES by this much per process in between.
+EVICT_EVERY_BYTES = MAX_BYTES // 16
+
+# Bumped whenever the way entries are stored changes, to retire all of them
+CACHE_VERSION = 1
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# DataFrames are stored as Arrow IPC (Feather) files, anything else pickled
+ARROW, PICKLE = '.arrow', '.pkl'
+
+
+# ── Entries ────────────────────────────────────────────────────────────────────
+def _code_version():
+    # Digest of CACHE_VERSION and every module of the project. A loader's own
+    # source is in its key, but not that of the helpers it calls (queries,
+    # trends, columnar, approx and the rest), so any change to them retires
+    # every entry.
+    h = hashlib.sha256(str(CACHE_VERSION).encode())
+    for path in sorted(glob.glob(os.path.join(PROJECT_DIR, '*.py'))):
+        with open(path, 'rb') as f:
+            h.update(os.path.basename(path).encode() + f.read())
+    return h.hexdigest()[:16]
+
+
+CODE_VERSION = _code_version()
+
+
+def _directory(fingerprint):
+    # Entries live in one directory per database fingerprint and code version
+    return f'{fingerprint}-{CODE_VERSION}'
+
+
+def _key(name, source, args, kwargs):
+    try:
+        payload = pickle.dumps((args, sorted(kwargs.items())), protocol=4)
+    except Exception:
+        return None
+    return hashlib.sha256(name.encode() + source.encode() + payload).hexdigest()[:32]
+
+
+def _read(base):
+    # (result, bytes) stored under `base`, or None. Reading an entry marks it
+    # recently used.
+    for ext in (ARROW, PICKLE):
+        path = base + ext
+        try:
+            if ext == ARROW:
+                from pyarrow import feather
+                result = feather.read_feather(path)
+            else:
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+            os.utime(path)
+            return result, os.path.getsize(path)
+        except FileNotFoundError:
+            continue
+        except Exception:
+            # Truncated or written by an incompatible version
+            _remove(path)
+    return None
+
+
+def _arrow_safe(df):
+    # Whether the frame comes back from Arrow unchanged: string column names,
+    # no object columns holding anything but strings and no index frequency
+    # (Arrow does not keep one)
+    if getattr(df.index, 'freq', None) is not None:
+        return False
+    return all(isinstance(column, str) for column in df.columns) and all(
+        pd.api.types.infer_dtype(df[column], skipna=True) in ('string', 'empty')
+        for column in df.columns if df[column].dtype == object)
+
+
+def _write(base, result):
+    # Written to a file of this process's own first so readers in other
+    # processes never see a partial entry. Returns the bytes written.
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    tmp = f'{base}.{os.getpid()}.tmp'
+    path = None
+    if isinstance(result, pd.DataFrame) and _arrow_safe(result):
+        try:
+            from pyarrow import feather
+            feather.write_feather(result, tmp)
+            path = base + ARROW
+        except Exception:
+            # Column types Arrow cannot hold (mixed objects, say) are pickled
+            pass
+    if path is None:
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        path = base + PICKLE
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict(fingerprint=None, max_bytes=MAX_BYTES):
+    # Removes every entry made under another fingerprint or code version,
+    # then the least recently read entries until the cache fits in max_bytes
+    current = _directory(fingerprint or db.fingerprint())
+    entries = []
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for directory in os.scandir(CACHE_DIR):
+        if not directory.is_dir():
+            continue
+        for entry in os.scandir(directory.path):
+            if directory.name != current:
+                _remove(entry.path)
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        if directory.name != current:
+            try:
+                os.rmdir(directory.path)
+            except OSError:
+                pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+
+
+_written = {'fingerprint': None, 'bytes': 0}
+_written_lock = threading.Lock()
+
+
+def _wrote(fingerprint, size):
+    # Counts a write and runs evict() once one is due
+    with _written_lock:
+        _written['bytes'] += size
+        due = _written['fingerprint'] != fingerprint or _written['bytes'] >= EVICT_EVERY_BYTES
+        if due:
+            _written.update(fingerprint=fingerprint, bytes=0)
+    if due:
+        evict(fingerprint)
+
+
+# ── Loaders ────────────────────────────────────────────────────────────────────
+def _source(fn):
+    # fn's source without its decorators, so a page's loader and the bare copy
+    # warm-up calls share entries
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(fn)))
+    except (OSError, TypeError, SyntaxError):
+        return ''
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            node.decorator_list = []
+    return ast.unparse(tree)
+
+
+def persist(fn, fingerprint):
+    # fn(*args) answered from disk when an entry for this fingerprint exists,
+    # otherwise called and stored. Unpicklable arguments skip the disk.
+    name = f'{fn.__module__}.{fn.__qualname__}'
+    source = _source(fn)
+
+    def call(*args, **kwargs):
+        key = _key(name, source, args, kwargs) if ENABLED else None
+        if key is None:
+            return fn(*args, **kwargs)
+        current = fingerprint()
+        base = os.path.join(CACHE_DIR, _directory(current), key)
+        with profiling.timed('disk_cache', fn.__name__) as event:
+            found = _read(base)
+            event['cache'] = 'hit' if found is not None else 'miss'
+            if found is not None:
+                event['bytes'] = found[1]
+                return found[0]
+        result = fn(*args, **kwargs)
+        try:
+            _wrote(current, _write(base, result))
+        except OSError:
+            # A full or read-only disk only costs the next process a recompute
+            pass
+        return result
+    return call
+
+
+def tier(cache):
+    # Puts the disk tier under an in-memory cache decorator. Used through
+    # profiling.loader:
+    #
+    #   @profiling.loader(disk_cache.tier(st.cache_data))
+    #   def load_metrics(version): ...
+    #
+    # Memory is checked first, then disk, and only then does the loader run.
+    # Both levels are keyed on db.fingerprint() as well as the arguments, so
+    # a rebuilt database is picked up without a restart.
+    def decorate(fn):
+        persisted = persist(fn, db.fingerprint)
+
+        @functools.wraps(fn)
+        def keyed(*args, db_fingerprint, **kwargs):
+            return persisted(*args, **kwargs)
+        cached = cache(keyed)
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            return cached(*args, db_fingerprint=db.fingerprint(), **kwargs)
+        call.clear = cached.clear
+        return call
+    return decorate
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+# The transaction `errors` field is a comma-joined list of these. setup_db.py
+# stores it once as an integer `error_mask` with one bit per error, so every
+# query tests bits instead of matching substrings. Bits follow the priority
+# sql/queries.sql uses to pick a transaction's primary error, which makes the
+# primary error the lowest set bit: mask & -mask.
+FLAGS = {
+    'Insufficient Balance': 1,
+    'Bad CVV': 2,
+    'Bad PIN': 4,
+    'Technical Glitch': 8,
+    'Bad Card Number': 16,
+    'Bad Expiration': 32,
+    'Bad Zipcode': 64,
+}
+
+# Every combination of flags, so an error_mask always indexes LABELS
+COMBINATIONS = 1 << len(FLAGS)
+
+# The error_flags lookup table: one row per flag with its priority (1 = highest)
+FLAGS_TABLE = pd.DataFrame({
+    'flag': list(FLAGS.values()),
+    'name': list(FLAGS),
+    'priority': range(1, len(FLAGS) + 1),
+})
+
+
+def label(mask):
+    # Comma-joined flag names in priority order, None for no error
+    names = [name for name, flag in FLAGS.items() if mask & flag]
+    return ','.join(names) if names else None
+
+
+# Label of every mask, indexed by the mask
+LABELS = np.array([label(mask) for mask in range(COMBINATIONS)], dtype='object')
+
+
+def encode(errors):
+    # Series of raw `errors` strings (NULL for none) -> int64 masks. Unknown
+    # error names raise rather than silently losing a flag.
+    present = errors.dropna()
+    masks = pd.Series(0, index=errors.index, dtype='int64')
+    if present.empty:
+        return masks
+    dummies = present.str.get_dummies(sep=',')
+    dummies.columns = dummies.columns.str.strip()
+    unknown = set(dummies.columns) - set(FLAGS)
+    if unknown:
+        raise ValueError(f'Unknown transaction errors {sorted(unknown)}, add them to error_flags.FLAGS')
+    bits = np.array([FLAGS[name] for name in dummies.columns], dtype='int64')
+    masks[present.index] = np.bitwise_or.reduce(dummies.to_numpy(dtype='int64') * bits, axis=1)
+    return masks
+
+
+def labels(masks):
+    return LABELS[np.asarray(masks, dtype='int64')]
@@ -0,0 +1,98 @@
+import numpy as np
+
+# Additive Holt-Winters with a damped trend, ETS(A,Ad,A), fitted to many
+# monthly series at once. Series are the rows of a matrix. Every combination
+# of smoothing parameters in the grid below runs for every series together,
+# one NumPy operation per month, and each series keeps the combination with
+# the lowest one-step squared error. A hundred series fit in well under a
+# second, where SARIMAX takes about a second per series.
+
+PERIOD = 12
+
+# Smoothing grid. BETA and GAMMA are fractions of their admissible range
+# (beta <= alpha, gamma <= 1 - alpha), so every combination is a valid model.
+ALPHA = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9)
+BETA  = (0.0, 0.05, 0.2, 0.5)
+GAMMA = (0.0, 0.05, 0.2, 0.5)
+PHI   = (0.9, 0.98, 1.0)
+
+# Two-sided 95% normal quantile, for the prediction intervals
+Z_95 = 1.959964
+
+
+def _grid():
+    # (alpha, beta, gamma, phi) for every combination, each of shape (G,)
+    a, b, g, p = (axis.ravel() for axis in np.meshgrid(ALPHA, BETA, GAMMA, PHI, indexing='ij'))
+    return a, a * b, (1 - a) * g, p
+
+
+def _initial(y, period):
+    # Classical start from the first two seasons: the first season's mean
+    # level, the change between the two season means as the trend and the
+    # first season's deviations as the seasonal terms
+    first, second = y[:, :period].mean(axis=1), y[:, period:2 * period].mean(axis=1)
+    return first, (second - first) / period, y[:, :period] - first[:, None]
+
+
+def _filter(y, alpha, beta, gamma, phi, period):
+    # Runs the smoothing recursions over months period..T for every series
+    # (rows of y) under every parameter set (columns of the (S, G) parameter
+    # arrays). Returns the summed squared one-step errors, the number of
+    # errors and the final level, trend and seasonal states, where
+    # season[..., k] is the term for months k, k + period, ...
+    level, trend, season = _initial(y, period)
+    lanes = alpha.shape
+    level = np.broadcast_to(level[:, None], lanes).copy()
+    trend = np.broadcast_to(trend[:, None], lanes).copy()
+    season = np.broadcast_to(season[:, None, :], lanes + (period,)).copy()
+    sse = np.zeros(lanes)
+    for t in range(period, y.shape[1]):
+        k = t % period
+        damped = phi * trend
+        error = y[:, t, None] - (level + damped + season[..., k])
+        sse += error * error
+        level += damped + alpha * error
+        trend = damped + beta * error
+        season[..., k] += gamma * error
+    return sse, y.shape[1] - period, level, trend, season
+
+
+def fit(y, period=PERIOD):
+    # Fits every row of y, a (series, months) float matrix with at least two
+    # full seasons. Returns the chosen parameters and final states per series,
+    # plus sigma2, the one-step error variance the intervals are built on.
+    y = np.asarray(y, dtype='float64')
+    if y.shape[1] < 2 * period:
+        raise ValueError(f'Need at least {2 * period} months to fit, got {y.shape[1]}')
+    grid = [np.broadcast_to(param, (len(y), len(param))) for param in _grid()]
+    sse, _, _, _, _ = _filter(y, *grid, period)
+    best = sse.argmin(axis=1)
+    alpha, beta, gamma, phi = (param[np.arange(len(y)), best][:, None] for param in grid)
+    sse, n, level, trend, season = _filter(y, alpha, beta, gamma, phi, period)
+    return {
+        'alpha': alpha[:, 0], 'beta': beta[:, 0], 'gamma': gamma[:, 0], 'phi': phi[:, 0],
+        'level': level[:, 0], 'trend': trend[:, 0], 'season': season[:, 0, :],
+        'sigma2': sse[:, 0] / n,
+        'months': y.shape[1],
+        'period': period,
+    }
+
+
+def forecast(model, horizon):
+    # (mean, lower, upper), each (series, horizon), for the `horizon` months
+    # after the fitted data, with 95% prediction intervals from the
+    # closed-form ETS(A,Ad,A) forecast variance:
+    #   sigma2 * (1 + sum_{j<h} c_j^2),  c_j = alpha + beta * phi_j + gamma * [j % period == 0]
+    # where phi_j = phi + phi^2 + ... + phi^j
+    period = model['period']
+    h = np.arange(1, horizon + 1)
+    phi = model['phi'][:, None]
+    phi_h = np.cumsum(phi ** h, axis=1)
+    slots = (model['months'] + h - 1) % period
+    mean = model['level'][:, None] + phi_h * model['trend'][:, None] + model['season'][:, slots]
+
+    c = model['alpha'][:, None] + model['beta'][:, None] * phi_h + model['gamma'][:, None] * (h % period == 0)
+    # Variance of the h-step error sums c_j^2 for j < h
+    spread = np.concatenate([np.zeros((len(c), 1)), np.cumsum(c[:, :-1] ** 2, axis=1)], axis=1)
+    se = np.sqrt(model['sigma2'][:, None] * (1 + spread))
+    return mean, mean - Z_95 * se, mean + Z_95 * se
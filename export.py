@@ -0,0 +1,170 @@
+import argparse
+import os
+import queue
+import threading
+import time
+
+import db
+
+# Row-level extracts from sql/queries.sql, runnable by name
+EXPORT_QUERIES = {
+    # Running total spend per user over time (one row per transaction)
+    'running_totals': """
+        SELECT
+            client_id,
+            date,
+            amount_cents / 100.0 AS amount,
+            SUM(amount_cents) OVER (PARTITION BY client_id ORDER BY date) / 100.0 AS running_total
+        FROM transactions
+    """,
+    # Month-on-month spending change per user
+    'month_on_month': """
+        WITH monthly_spending AS (
+            SELECT
+                client_id,
+                month,
+                SUM(amount_cents) / 100.0 AS monthly_spending
+            FROM transactions
+            GROUP BY client_id, month
+        )
+        SELECT
+            client_id,
+            month,
+            monthly_spending,
+            LAG(monthly_spending) OVER (PARTITION BY client_id ORDER BY month) AS prev_month_spending,
+            ROUND(monthly_spending - LAG(monthly_spending) OVER (PARTITION BY client_id ORDER BY month), 2) AS month_on_month_change
+        FROM monthly_spending
+    """,
+    # Every transaction with its category and fraud label
+    'transactions': """
+        SELECT
+            t.id,
+            t.date,
+            t.client_id,
+            t.card_id,
+            t.amount_cents / 100.0 AS amount,
+            t.use_chip,
+            t.merchant_id,
+            t.merchant_city,
+            t.merchant_state,
+            t.zip,
+            t.mcc,
+            mcc_codes.description AS category,
+            t.errors,
+            f.is_fraud
+        FROM transactions t
+        LEFT JOIN mcc_codes ON t.mcc = mcc_codes.mcc
+        LEFT JOIN fraud_labels f ON t.id = f.transaction_id
+    """,
+}
+
+FORMATS = ('csv', 'parquet')
+
+
+def _csv_writer(path):
+    f = open(path, 'w', newline='')
+    first = True
+
+    def write(df):
+        nonlocal first
+        df.to_csv(f, header=first, index=False)
+        first = False
+    return write, f.close
+
+
+def _parquet_writer(path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # The first batch fixes the schema; later batches are cast to it. A
+    # column that is entirely NULL in the first batch is taken to be text.
+    state = {}
+
+    def write(df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if 'writer' not in state:
+            schema = pa.schema([
+                pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema
+            ]).remove_metadata()
+            state['schema'] = schema
+            state['writer'] = pq.ParquetWriter(path, schema)
+        state['writer'].write_table(table.cast(state['schema']))
+
+    def close():
+        if 'writer' in state:
+            state['writer'].close()
+    return write, close
+
+
+def export(sql, path, params=(), fmt=None, batch_rows=db.STREAM_BATCH_ROWS, max_batches=4):
+    # Streams the result of `sql` into a CSV or Parquet file, returning the
+    # row count. A reader thread fetches batches into a queue holding at most
+    # max_batches of them, so it blocks whenever the writer falls behind and
+    # memory stays around (max_batches + 2) * batch_rows rows whatever the
+    # result size. The file appears under `path` only once it is complete.
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format {fmt!r}, expected one of {FORMATS}')
+
+    batches = queue.Queue(maxsize=max_batches)
+    stop = threading.Event()
+    failure = []
+
+    def offer(item):
+        # Blocks while the queue is full, giving up once the writer has stopped
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        stream = db.stream(sql, params, batch_rows)
+        try:
+            for df in stream:
+                if not offer(df):
+                    break
+        except Exception as e:
+            failure.append(e)
+        finally:
+            stream.close()
+            offer(None)
+
+    write, close = (_csv_writer if fmt == 'csv' else _parquet_writer)(f'{path}.tmp')
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    rows = 0
+    try:
+        while (df := batches.get()) is not None:
+            write(df)
+            rows += len(df)
+    finally:
+        stop.set()
+        close()
+        reader.join()
+    if failure:
+        os.remove(f'{path}.tmp')
+        raise failure[0]
+    os.replace(f'{path}.tmp', path)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream a row-level query to CSV or Parquet with bounded memory.')
+    parser.add_argument('query', nargs='?', choices=sorted(EXPORT_QUERIES),
+                        help='named extract to run (or pass --sql)')
+    parser.add_argument('--sql', help='SQL to run instead of a named extract')
+    parser.add_argument('--out', required=True, help='output file; .csv or .parquet picks the format')
+    parser.add_argument('--format', choices=FORMATS, help='output format (default: from --out)')
+    parser.add_argument('--batch-rows', type=int, default=db.STREAM_BATCH_ROWS,
+                        help='rows fetched and written per batch')
+    args = parser.parse_args()
+    if (args.query is None) == (args.sql is None):
+        parser.error('give either a named query or --sql')
+
+    started = time.perf_counter()
+    rows = export(args.sql or EXPORT_QUERIES[args.query], args.out, fmt=args.format, batch_rows=args.batch_rows)
+    elapsed = time.perf_counter() - started
+    print(f'Done - {rows:,} rows written to {args.out} in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/sec)')
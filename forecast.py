@@ -0,0 +1,24 @@
+import argparse
+import os
+import time
+
+import forecasting
+
+parser = argparse.ArgumentParser(description='Fit SARIMA forecasts for the total and every merchant category.')
+parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                    help='worker processes fitting models (default: all cores)')
+parser.add_argument('--search', action='store_true',
+                    help='pick each series\' SARIMA order by AIC search instead of the fixed defaults')
+parser.add_argument('--report', default=forecasting.REPORT_PATH,
+                    help='CSV listing the outcome of every series')
+args = parser.parse_args()
+
+started = time.perf_counter()
+report = forecasting.run_batch(workers=args.workers, report_path=args.report, search=args.search)
+
+counts = report['status'].value_counts()
+print(f'Done - {len(report)} series in {time.perf_counter() - started:.1f}s: '
+      + ', '.join(f'{n} {status}' for status, n in counts.items()))
+problems = report[report['status'].isin(['failed', 'not_converged'])]
+if len(problems):
+    print(f'{len(problems)} series need a look, see {args.report}')
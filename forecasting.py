@@ -0,0 +1,581 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+import db
+import ets
+import profiling
+import queries
+
+MODEL_DIR   = 'data/models'
+REPORT_PATH = 'data/forecast_report.csv'
+
+# Bumped whenever the artifact layout or the fitting recipe changes, so old
+# artifacts are ignored rather than misread. Each version has its own directory.
+STORE_VERSION = 1
+
+# (order, seasonal_order) used by the Forecasting page
+TOTAL_ORDER    = ((1, 0, 1), (1, 0, 1, 12))
+CATEGORY_ORDER = ((1, 1, 1), (1, 1, 1, 12))
+
+# Name of the overall series in the forecasts table and the batch report
+TOTAL = 'Total'
+
+# The eval model trains on everything before this date and is scored on the rest
+SPLIT_DATE = '2019-01-01'
+HORIZON    = 12
+
+# Processes fitting the models the Forecasting page asks for while it renders
+FIT_WORKERS = 2
+
+# Set FINANCE_FORECAST_ENGINE=ets to forecast the page's categories with the
+# batch Holt-Winters engine (ets.py) instead of a SARIMA model per category
+ENGINE = os.environ.get('FINANCE_FORECAST_ENGINE', 'sarima')
+
+
+# ── Series ─────────────────────────────────────────────────────────────────────
+def monthly_series(df):
+    # (month, monthly_total) rows as returned by the page queries, indexed by
+    # month start so SARIMAX dates its forecasts. Months with no transactions
+    # have no rollup rows; they are filled in as zero spend so the index
+    # stays regular. No rows give an empty series.
+    if df.empty:
+        return pd.Series([], index=pd.DatetimeIndex([], freq='MS'), dtype='float64', name='monthly_total')
+    months = pd.to_datetime(df['month'].astype(str), format='%Y%m')
+    series = pd.Series(df['monthly_total'].to_numpy(dtype='float64'), index=months.values, name='monthly_total')
+    return series.reindex(pd.date_range(months.min(), months.max(), freq='MS'), fill_value=0.0)
+
+
+def load_total_series():
+    return monthly_series(db.query(queries.MONTHLY_TOTALS, queries.ALL_MONTHS))
+
+
+def load_category_series(category):
+    return monthly_series(db.query(queries.CATEGORY_MONTHLY_TOTALS, (category, *queries.ALL_MONTHS)))
+
+
+def fingerprint(series, order):
+    # Identifies an artifact: the exact input series, the model order and the
+    # recipe. Any new or corrected month gives a new fingerprint.
+    h = hashlib.sha256()
+    h.update(repr((STORE_VERSION, order, SPLIT_DATE, HORIZON)).encode())
+    h.update(series.index.asi8.tobytes())
+    h.update(series.to_numpy(dtype='float64').tobytes())
+    return h.hexdigest()[:32]
+
+
+# ── Fitting ────────────────────────────────────────────────────────────────────
+def _fit(series, order, start_params=None):
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    model = SARIMAX(series, order=order[0], seasonal_order=order[1])
+    # Convergence is recorded in the artifact rather than warned about
+    with warnings.catch_warnings(), profiling.timed('fit', format_order(order), rows=len(series)):
+        warnings.simplefilter('ignore')
+        if start_params is not None:
+            # Coefficients the warm start does not cover begin at zero
+            start_params = [start_params.get(name, 0.0) for name in model.param_names]
+        return model.fit(disp=False, start_params=start_params)
+
+
+def percentage_error(actuals, predicted):
+    # MAPE along the last axis over the months with nonzero actuals, like
+    # backtest: a month with no spend has no percentage error. NaN when every
+    # month is zero.
+    nonzero = actuals != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.where(nonzero, np.abs(actuals - predicted) / np.abs(actuals), 0.0)
+        return pct.sum(axis=-1) / nonzero.sum(axis=-1) * 100
+
+
+def fit_artifact(series, order):
+    # Fits the 2019 eval model and the full-history model and keeps everything
+    # the page draws, plus the fitted parameters so a results object can be
+    # rebuilt later without another maximum-likelihood fit.
+    from sklearn.metrics import mean_absolute_error
+
+    train = series[series.index < SPLIT_DATE]
+    test  = series[series.index >= SPLIT_DATE]
+
+    eval_result = _fit(train, order)
+    eval_mean = eval_result.get_forecast(steps=len(test)).predicted_mean
+    mae  = mean_absolute_error(test, eval_mean)
+    mape = percentage_error(test.to_numpy(), eval_mean.to_numpy())
+
+    result = _fit(series, order)
+    forecast = result.get_forecast(steps=HORIZON)
+
+    return {
+        'store_version': STORE_VERSION,
+        'fingerprint': fingerprint(series, order),
+        'order': order,
+        'series': series,
+        'params': result.params,
+        'eval_params': eval_result.params,
+        'converged': bool(result.mle_retvals.get('converged', True)
+                          and eval_result.mle_retvals.get('converged', True)),
+        'eval_mean': eval_mean,
+        'mae': mae,
+        'mape': mape,
+        'future_mean': forecast.predicted_mean,
+        'future_ci': forecast.conf_int(),
+    }
+
+
+def load_result(artifact, eval=False):
+    # Full SARIMAX results for an artifact, re-filtered with the stored
+    # parameters instead of re-estimated. Takes milliseconds.
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    series = artifact['series']
+    if eval:
+        series = series[series.index < SPLIT_DATE]
+    order = artifact['order']
+    model = SARIMAX(series, order=order[0], seasonal_order=order[1])
+    return model.filter(artifact['eval_params' if eval else 'params'])
+
+
+# ── Artifact store ─────────────────────────────────────────────────────────────
+def _artifact_path(key):
+    return os.path.join(MODEL_DIR, f'v{STORE_VERSION}', f'{key}.pkl')
+
+
+def load_artifact(key):
+    try:
+        with open(_artifact_path(key), 'rb') as f:
+            return pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def save_artifact(artifact):
+    # Written to a temporary file first so a page never reads a partial pickle
+    path = _artifact_path(artifact['fingerprint'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+
+
+def get_artifact(series, order):
+    # Stored artifact for this series and order, fitting and storing it first
+    # if the series has changed since the last precompute run.
+    artifact = load_artifact(fingerprint(series, order))
+    if artifact is None:
+        artifact = fit_artifact(series, order)
+        save_artifact(artifact)
+    return artifact
+
+
+# ── Order search ───────────────────────────────────────────────────────────────
+# Values select_order may pick for each term of (p,d,q)(P,D,Q,m)
+SEARCH_GRID = {
+    'p': (0, 1, 2), 'd': (0, 1), 'q': (0, 1, 2),
+    'P': (0, 1),    'D': (0, 1), 'Q': (0, 1),
+    'm': 12,
+}
+# Lowest-AIC candidates per level whose neighbours are tried next
+SEARCH_BEAM = 3
+ADF_ALPHA   = 0.05
+
+
+def _differencing(series, grid):
+    # (d, D) pairs worth searching. Any pair that leaves the series failing
+    # the notebook's ADF stationarity test is under-differenced and dropped
+    # before a single model is fitted. Pairs that difference more than needed
+    # stay in, since the notebook found d=1 can beat d=0 on a series ADF
+    # already calls stationary.
+    from statsmodels.tsa.stattools import adfuller
+
+    m = grid['m']
+    pairs = []
+    for d in grid['d']:
+        for D in grid['D']:
+            x = series.to_numpy(dtype='float64')
+            for _ in range(D):
+                x = x[m:] - x[:-m]
+            x = np.diff(x, n=d)
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', FutureWarning)
+                    stationary = adfuller(x)[1] < ADF_ALPHA
+            except ValueError:
+                stationary = False
+            if stationary:
+                pairs.append((d, D))
+    return pairs or [(max(grid['d']), max(grid['D']))]
+
+
+def _fit_candidate(series, order, start_params):
+    # One search fit, run in a worker process. A fit that raises scores inf.
+    try:
+        result = _fit(series, order, start_params)
+    except Exception:
+        return order, np.inf, None, False
+    converged = bool(result.mle_retvals.get('converged', True))
+    return order, result.aic, result.params.to_dict(), converged
+
+
+def _search_key(series, grid, beam):
+    return 'search-' + fingerprint(series, ('search', sorted(grid.items()), beam))
+
+
+def select_order(series, grid=SEARCH_GRID, beam=SEARCH_BEAM, workers=None):
+    # Lowest-AIC (order, seasonal_order) for `series` on its pre-2019 part.
+    #
+    # Each surviving (d, D) branch starts from the white-noise model and grows
+    # one coefficient at a time. Only neighbours of the `beam` best models at
+    # each level are tried, each fit warm-started from the parameters of the
+    # model it grew from, and a branch stops once a level fails to improve its
+    # AIC. Each level is fitted in parallel across branches. The result is
+    # cached per series fingerprint, so an unchanged series is never searched
+    # twice. workers=1 searches in-process, for use inside a batch worker.
+    key = _search_key(series, grid, beam)
+    cached = load_artifact(key)
+    if cached is not None:
+        return cached
+
+    train = series[series.index < SPLIT_DATE]
+    terms = ('p', 'q', 'P', 'Q')
+    start = tuple(min(grid[t]) for t in terms)
+    m = grid['m']
+
+    def full_order(pair, coeffs):
+        (d, D), (p, q, P, Q) = pair, coeffs
+        return ((p, d, q), (P, D, Q, m))
+
+    frontier = {pair: {start: None} for pair in _differencing(train, grid)}
+    best_aic = {pair: np.inf for pair in frontier}
+    fitted = {}
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        while frontier:
+            tasks = [(full_order(pair, coeffs), warm)
+                     for pair, level in frontier.items()
+                     for coeffs, warm in level.items()
+                     if full_order(pair, coeffs) not in fitted]
+            orders = [order for order, _ in tasks]
+            warms = [warm for _, warm in tasks]
+            run = pool.map if pool else map
+            for order, aic, params, converged in run(_fit_candidate, repeat(train), orders, warms):
+                fitted[order] = (aic, params, converged)
+
+            next_frontier = {}
+            for pair, level in frontier.items():
+                ranked = sorted(level, key=lambda c: fitted[full_order(pair, c)][0])
+                level_best = fitted[full_order(pair, ranked[0])][0]
+                if not level_best < best_aic[pair]:
+                    continue
+                best_aic[pair] = level_best
+                children = {}
+                for coeffs in ranked[:beam]:
+                    params = fitted[full_order(pair, coeffs)][1]
+                    for i, term in enumerate(terms):
+                        grown = coeffs[:i] + (coeffs[i] + 1,) + coeffs[i + 1:]
+                        if grown[i] in grid[term]:
+                            children.setdefault(grown, params)
+                if children:
+                    next_frontier[pair] = children
+            frontier = next_frontier
+    finally:
+        if pool:
+            pool.shutdown()
+
+    candidates = pd.DataFrame(
+        [(order[0], order[1], aic, converged) for order, (aic, _, converged) in fitted.items()],
+        columns=['order', 'seasonal_order', 'aic', 'converged'],
+    ).sort_values('aic', ignore_index=True)
+    # A converged fit is preferred over a lower AIC that did not converge
+    pick = candidates[candidates['converged'] & np.isfinite(candidates['aic'])]
+    pick = pick if len(pick) else candidates
+    grid_size = len(grid['d']) * len(grid['D']) * np.prod([len(grid[t]) for t in terms])
+
+    search = {
+        'fingerprint': key,
+        'order': (pick['order'][pick.index[0]], pick['seasonal_order'][pick.index[0]]),
+        'candidates': candidates,
+        'fitted': len(fitted),
+        'grid_size': int(grid_size),
+    }
+    save_artifact(search)
+    return search
+
+
+def model_order(series, default):
+    # Searched order for this series if `python forecast.py --search` has
+    # covered it, otherwise `default`. Never searches itself, so pages can
+    # call it.
+    search = load_artifact(_search_key(series, SEARCH_GRID, SEARCH_BEAM))
+    return search['order'] if search is not None else default
+
+
+# ── Backtesting ────────────────────────────────────────────────────────────────
+# Origins start once this many months are known, two full seasonal cycles
+BACKTEST_MIN_TRAIN = 24
+
+
+def backtest(artifact, horizon=HORIZON, min_train=BACKTEST_MIN_TRAIN):
+    # Rolling-origin errors for every forecast origin and horizon, without
+    # refitting. The eval model's parameters (fitted on pre-2019 data) are
+    # held fixed and one Kalman filter pass over the whole series gives the
+    # predicted state at every month. Pushing all those states through the
+    # transition matrix together yields every origin's h-step forecast, one
+    # matrix product per horizon. The result equals refiltering the series up
+    # to each origin and calling get_forecast.
+    #
+    # Returns one row per horizon (1..horizon) with MAE, MAPE and RMSE over
+    # every origin that has an actual value that far ahead.
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+    series = artifact['series']
+    order = artifact['order']
+    model = SARIMAX(series, order=order[0], seasonal_order=order[1])
+    ssm = model.filter(artifact['eval_params']).filter_results
+
+    y = series.to_numpy(dtype='float64')
+    n = len(y)
+    origins = np.arange(min_train, n)
+    T, c = ssm.transition[:, :, 0], ssm.state_intercept[:, :1]
+    Z, d = ssm.design[:, :, 0], ssm.obs_intercept[:, :1]
+
+    # Column j of `state` is the state at origin j given data before it,
+    # advanced one step per horizon
+    state = ssm.predicted_state[:, origins]
+    forecasts = np.empty((horizon, len(origins)))
+    for h in range(horizon):
+        forecasts[h] = (Z @ state + d)[0]
+        state = T @ state + c
+
+    # actuals[h, j] is the month forecasts[h, j] predicts, NaN past the end
+    target = origins[None, :] + np.arange(horizon)[:, None]
+    actuals = np.where(target < n, y[np.minimum(target, n - 1)], np.nan)
+
+    errors = forecasts - actuals
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.abs(errors) / np.abs(actuals)
+    pct[~np.isfinite(pct)] = np.nan
+    return pd.DataFrame({
+        'horizon': np.arange(1, horizon + 1),
+        'origins': np.sum(~np.isnan(errors), axis=1),
+        'mae': np.nanmean(np.abs(errors), axis=1),
+        'mape': np.nanmean(pct, axis=1) * 100,
+        'rmse': np.sqrt(np.nanmean(errors ** 2, axis=1)),
+    })
+
+
+# ── Batch ──────────────────────────────────────────────────────────────────────
+FORECAST_COLUMNS = ['series', 'month', 'forecast', 'lower', 'upper', 'mae', 'mape', 'converged']
+BACKTEST_COLUMNS = ['series', 'horizon', 'origins', 'mae', 'mape', 'rmse']
+
+
+def _concat(frames, columns):
+    # pd.concat raises on an empty list
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def forecast_rows(name, artifact):
+    # One row per forecast month, in the layout of the `forecasts` table
+    mean, ci = artifact['future_mean'], artifact['future_ci']
+    return pd.DataFrame({
+        'series': name,
+        'month': mean.index.year * 100 + mean.index.month,
+        'forecast': mean.to_numpy(),
+        'lower': ci.iloc[:, 0].to_numpy(),
+        'upper': ci.iloc[:, 1].to_numpy(),
+        'mae': artifact['mae'],
+        'mape': artifact['mape'],
+        'converged': int(artifact['converged']),
+    })
+
+
+def format_order(order):
+    (p, d, q), (P, D, Q, m) = order
+    return f'({p},{d},{q})x({P},{D},{Q},{m})'
+
+
+def _fit_task(name, series, order, search):
+    # Runs in a worker process. Errors come back as a report entry so one bad
+    # series does not abort the batch.
+    started = time.perf_counter()
+    try:
+        if search:
+            order = select_order(series, workers=1)['order']
+        artifact = fit_artifact(series, order)
+        save_artifact(artifact)
+    except Exception as e:
+        return name, None, format_order(order), 'failed', f'{type(e).__name__}: {e}', time.perf_counter() - started
+    status = 'ok' if artifact['converged'] else 'not_converged'
+    return name, artifact, format_order(order), status, '', time.perf_counter() - started
+
+
+def batch_jobs():
+    # (name, series, order) for the total and every category. All category
+    # series come from one query and are split up in pandas.
+    jobs = [(TOTAL, load_total_series(), TOTAL_ORDER)]
+    df = db.query(queries.ALL_CATEGORY_MONTHLY_TOTALS)
+    for category, rows in df.groupby('category', sort=True):
+        jobs.append((category, monthly_series(rows), CATEGORY_ORDER))
+    return jobs
+
+
+def run_batch(workers=None, report_path=REPORT_PATH, search=False):
+    # Fits every series whose artifact is missing across a process pool, then
+    # rewrites the `forecasts` and `backtests` tables from all artifacts and a
+    # per-series report of what was fitted, reused, failed or did not converge.
+    # search=True picks each series' order with select_order first; series
+    # searched on an earlier run reuse that order.
+    artifacts, report = {}, []
+    pending = []
+    for name, series, default in batch_jobs():
+        order = model_order(series, default)
+        artifact = load_artifact(fingerprint(series, order))
+        needs_search = search and order == default and load_artifact(
+            _search_key(series, SEARCH_GRID, SEARCH_BEAM)) is None
+        if artifact is None or needs_search:
+            pending.append((name, series, order, needs_search))
+        else:
+            artifacts[name] = artifact
+            report.append((name, format_order(order), 'cached', '', 0.0))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_fit_task, *job) for job in pending]
+            for future in as_completed(futures):
+                name, artifact, order, status, error, seconds = future.result()
+                if artifact is not None:
+                    artifacts[name] = artifact
+                report.append((name, order, status, error, round(seconds, 2)))
+
+    df_report = pd.DataFrame(report, columns=['series', 'order', 'status', 'error', 'seconds']).sort_values('series')
+    df_report.to_csv(report_path, index=False)
+
+    # Every fit can fail (or there may be no series at all); the tables are
+    # still rewritten, empty, so the page stops drawing stale forecasts
+    forecasts = _concat([forecast_rows(name, artifact) for name, artifact in sorted(artifacts.items())],
+                        FORECAST_COLUMNS)
+    db.store('forecasts', forecasts, indexes=[
+        'CREATE INDEX idx_forecasts_series_month ON forecasts (series, month)',
+    ])
+
+    # Rerun on every refresh: it only filters, so all series take about as
+    # long as a single fit
+    backtests = _concat([backtest(artifact).assign(series=name)
+                         for name, artifact in sorted(artifacts.items())], BACKTEST_COLUMNS)
+    db.store('backtests', backtests[BACKTEST_COLUMNS], indexes=[
+        'CREATE INDEX idx_backtests_series ON backtests (series, horizon)',
+    ])
+    return df_report
+
+
+# ── Holt-Winters engine ────────────────────────────────────────────────────────
+def category_matrix():
+    # (categories, months, totals) with totals[i, j] the spend of categories[i]
+    # in months[j]. Months a category has no transactions in are zero.
+    df = db.query(queries.ALL_CATEGORY_MONTHLY_TOTALS)
+    wide = df.pivot(index='category', columns='month', values='monthly_total')
+    months = pd.to_datetime(wide.columns.astype(str), format='%Y%m')
+    full = pd.date_range(months.min(), months.max(), freq='MS')
+    wide.columns = months
+    wide = wide.reindex(columns=full).fillna(0.0)
+    return wide.index.tolist(), full, wide.to_numpy(dtype='float64')
+
+
+def ets_forecasts():
+    # Every category fitted with ets in two calls: one on the months before
+    # SPLIT_DATE, scored on the rest like the SARIMA eval model, and one on
+    # the full history for the forecast. Rows in the layout of the
+    # `forecasts` table.
+    categories, months, totals = category_matrix()
+    train = months < SPLIT_DATE
+    with profiling.timed('fit', 'ets', rows=totals.size):
+        predicted = ets.forecast(ets.fit(totals[:, train]), int((~train).sum()))[0]
+        mean, lower, upper = ets.forecast(ets.fit(totals), HORIZON)
+
+    test = totals[:, ~train]
+    errors = np.abs(test - predicted)
+    mape = percentage_error(test, predicted)
+    future = pd.date_range(months[-1], periods=HORIZON + 1, freq='MS')[1:]
+    return pd.DataFrame({
+        'series': np.repeat(categories, HORIZON),
+        'month': np.tile(future.year * 100 + future.month, len(categories)),
+        'forecast': mean.ravel(),
+        'lower': lower.ravel(),
+        'upper': upper.ravel(),
+        'mae': np.repeat(errors.mean(axis=1), HORIZON),
+        'mape': np.repeat(mape, HORIZON),
+        'converged': 1,
+    })
+
+
+# ── Background fits ────────────────────────────────────────────────────────────
+# The Forecasting page never fits inline. A model it needs is fitted in a
+# process pool shared by every session of the server, and the page shows the
+# last known forecast until the new one is stored. Fits are keyed by
+# fingerprint, so a second request for the same series waits on the same job.
+_fit_pool  = None
+_fits      = {}
+_fits_lock = threading.Lock()
+
+
+def _fit_done(name, rows, future):
+    # Fits run in worker processes, so their timing is recorded here
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, _, order, status, error, seconds = future.result()
+    profiling.record('fit', order, seconds, series=name, rows=rows, error=error or None)
+
+
+def submit_fit(name, series, order):
+    # Future for the background fit of this series and order, started unless
+    # one is already running or has finished. Resolves to a _fit_task result.
+    global _fit_pool
+    key = fingerprint(series, order)
+    with _fits_lock:
+        future = _fits.get(key)
+        if future is None:
+            if _fit_pool is None:
+                _fit_pool = ProcessPoolExecutor(max_workers=FIT_WORKERS)
+            try:
+                future = _fit_pool.submit(_fit_task, name, series, order, False)
+            except BrokenProcessPool:
+                # A worker was killed (out of memory, say); start a new pool
+                _fit_pool = ProcessPoolExecutor(max_workers=FIT_WORKERS)
+                future = _fit_pool.submit(_fit_task, name, series, order, False)
+            future.add_done_callback(lambda f: _fit_done(name, len(series), f))
+            _fits[key] = future
+    return future
+
+
+def fit_status(name, series, order):
+    # ('ready', None) once the artifact for this series and order is stored,
+    # ('fitting', None) while its background fit runs, or ('failed', error).
+    # Never blocks: a missing artifact starts (or joins) a background fit. A
+    # failed fit is not retried until the series changes.
+    key = fingerprint(series, order)
+    if os.path.exists(_artifact_path(key)):
+        with _fits_lock:
+            _fits.pop(key, None)
+        return 'ready', None
+    future = submit_fit(name, series, order)
+    if not future.done():
+        return 'fitting', None
+    try:
+        _, artifact, _, _, error, _ = future.result()
+    except Exception as e:
+        artifact, error = None, f'{type(e).__name__}: {e}'
+    if artifact is None:
+        return 'failed', error
+    # Fitted, but the stored pickle has since been removed
+    with _fits_lock:
+        _fits.pop(key, None)
+    return fit_status(name, series, order)
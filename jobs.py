@@ -0,0 +1,232 @@
+import hashlib
+import inspect
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import db
+import error_flags
+import queries
+
+# Fingerprint of every job's last successful build, so an unchanged job is
+# skipped on the next run
+STATE_PATH = 'data/precompute_state.json'
+
+# Bumped whenever the way outputs are written changes, to rebuild everything
+JOBS_VERSION = 1
+
+# How each input table is fingerprinted: a query whose result changes whenever
+# the table's contents do, kept cheap enough to run before every refresh.
+# Only tables a job reads are listed: every job reads the rollup, whose
+# is_fraud column carries the fraud labels, so a relabel reaches them through
+# it. Small tables are read whole.
+SOURCES = {
+    'rollup': """
+        SELECT
+            COUNT(*) AS cells,
+            SUM(n) AS n,
+            SUM(sum_cents) AS sum_cents,
+            SUM(sum_sq_cents) AS sum_sq_cents,
+            MIN(min_cents) AS min_cents,
+            MAX(max_cents) AS max_cents,
+            SUM(n * month) AS month_weight,
+            SUM(n * mcc) AS mcc_weight,
+            SUM(n * error_mask) AS error_weight,
+            SUM(n * IFNULL(is_fraud, 2)) AS fraud_weight
+        FROM rollup
+    """,
+    'mcc_codes': 'SELECT mcc, description FROM mcc_codes ORDER BY mcc',
+}
+
+
+class Job:
+    # One precomputed artifact: `sql` run against the active backend,
+    # optionally reshaped by `transform`, written to `output` as CSV.
+    # `inputs` are the SOURCES tables the query reads and `after` the jobs
+    # whose outputs it needs; a job reruns when any of them changes. `params`
+    # fill the query's `?` placeholders.
+
+    def __init__(self, name, output, sql, inputs, after=(), transform=None, params=()):
+        self.name = name
+        self.output = output
+        self.sql = sql
+        self.params = tuple(params)
+        self.inputs = tuple(inputs)
+        self.after = tuple(after)
+        self.transform = transform
+
+    def definition(self):
+        # Everything about the job itself that should trigger a rebuild
+        transform = inspect.getsource(self.transform) if self.transform else None
+        return [JOBS_VERSION, self.name, self.output, self.sql, list(self.params), transform]
+
+    def build(self):
+        df = db.query(self.sql, self.params)
+        if self.transform is not None:
+            df = self.transform(df)
+        # Written to a temporary file first so a page never reads a partial CSV
+        df.to_csv(f'{self.output}.tmp', index=False)
+        os.replace(f'{self.output}.tmp', self.output)
+        return len(df)
+
+
+def _ordered(jobs):
+    # Jobs sorted so each comes after the jobs it depends on
+    by_name = {job.name: job for job in jobs}
+    if len(by_name) != len(jobs):
+        raise ValueError('Job names must be unique')
+    ordered, state = [], {}
+
+    def visit(job):
+        if state.get(job.name) == 'done':
+            return
+        if state.get(job.name) == 'visiting':
+            raise ValueError(f'Job {job.name!r} depends on itself')
+        state[job.name] = 'visiting'
+        for name in job.after:
+            if name not in by_name:
+                raise ValueError(f'Job {job.name!r} runs after unknown job {name!r}')
+            visit(by_name[name])
+        unknown = set(job.inputs) - set(SOURCES)
+        if unknown:
+            raise ValueError(f'Job {job.name!r} reads unknown inputs {sorted(unknown)}')
+        state[job.name] = 'done'
+        ordered.append(job)
+
+    for job in jobs:
+        visit(job)
+    return ordered
+
+
+def source_fingerprint(source):
+    df = db.query(SOURCES[source])
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+
+
+def fingerprints(jobs):
+    # Per-job fingerprint over its definition, its inputs' fingerprints and
+    # those of the jobs it runs after. Computed from the inputs alone, so a
+    # downstream job's is known before anything runs.
+    jobs = _ordered(jobs)
+    sources = {source: source_fingerprint(source) for source in sorted({s for job in jobs for s in job.inputs})}
+    prints = {}
+    for job in jobs:
+        payload = [job.definition(),
+                   [(source, sources[source]) for source in sorted(job.inputs)],
+                   [(name, prints[name]) for name in sorted(job.after)]]
+        prints[job.name] = hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+    return prints
+
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state, path=STATE_PATH):
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def run(jobs, workers=None, force=False, state_path=STATE_PATH):
+    # Builds every job whose fingerprint changed since its last successful
+    # build (or whose output is missing), each on its own thread and so its
+    # own pooled read-only connection. A job starts as soon as the jobs it
+    # runs after are done, so a full refresh takes about as long as the
+    # slowest chain. Returns a report of what was built, fresh, failed or
+    # blocked behind a failure.
+    jobs = _ordered(jobs)
+    prints = fingerprints(jobs)
+    state = load_state(state_path)
+    report = {}
+
+    pending = []
+    for job in jobs:
+        if not force and state.get(job.name) == prints[job.name] and os.path.exists(job.output):
+            report[job.name] = (job.name, job.output, 'fresh', '', None, 0.0)
+        else:
+            pending.append(job)
+
+    def build(job):
+        started = time.perf_counter()
+        rows = job.build()
+        return rows, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=workers or max(len(pending), 1)) as pool:
+        running = {}
+        try:
+            while pending or running:
+                for job in list(pending):
+                    statuses = [report[name][2] if name in report else None for name in job.after]
+                    if any(status in ('failed', 'blocked') for status in statuses):
+                        report[job.name] = (job.name, job.output, 'blocked', 'an upstream job failed', None, 0.0)
+                        pending.remove(job)
+                    elif all(status in ('built', 'fresh') for status in statuses):
+                        running[pool.submit(build, job)] = job
+                        pending.remove(job)
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        rows, seconds = future.result()
+                    except Exception as e:
+                        report[job.name] = (job.name, job.output, 'failed', f'{type(e).__name__}: {e}', None, 0.0)
+                        state.pop(job.name, None)
+                    else:
+                        report[job.name] = (job.name, job.output, 'built', '', rows, round(seconds, 2))
+                        state[job.name] = prints[job.name]
+        finally:
+            save_state(state, state_path)
+
+    return pd.DataFrame([report[job.name] for job in jobs],
+                        columns=['job', 'output', 'status', 'error', 'rows', 'seconds'])
+
+
+# ── Artifacts ──────────────────────────────────────────────────────────────────
+# Read by the Error & Fraud Analysis page when it shows the whole history. All
+# are slices of the rollup cube, which costs the same few thousand rows whether
+# or not the run was incremental.
+def _format_months(df):
+    df['month'] = pd.to_datetime(df['month'].astype(str), format='%Y%m').dt.strftime('%Y-%m')
+    return df
+
+
+def _label_errors(df):
+    df.insert(0, 'errors', error_flags.labels(df['error_mask']))
+    return df
+
+
+JOBS = [
+    # Fraud rate by error combination
+    Job('fraud_by_error', 'data/fraud_by_error.csv', queries.FRAUD_BY_ERROR,
+        inputs=['rollup'], transform=_label_errors, params=queries.ALL_MONTHS),
+
+    # Fraud rate over time
+    Job('fraud_over_time', 'data/fraud_over_time.csv', """
+        SELECT
+            month,
+            SUM(n) AS total_transactions,
+            IFNULL(SUM(n * is_fraud), 0) AS fraud_count,
+            ROUND(100.0 * IFNULL(SUM(n * is_fraud), 0) / SUM(n), 2) AS fraud_rate
+        FROM rollup
+        GROUP BY month
+        ORDER BY month ASC
+    """, inputs=['rollup'], transform=_format_months),
+
+    # Fraud vs non-fraud amounts
+    Job('fraud_amounts', 'data/fraud_amounts.csv', queries.FRAUD_AMOUNTS,
+        inputs=['rollup'], params=queries.ALL_MONTHS),
+
+    # Fraud rate by merchant category
+    Job('fraud_by_category', 'data/fraud_by_category.csv', queries.FRAUD_BY_CATEGORY,
+        inputs=['rollup', 'mcc_codes'], params=queries.ALL_MONTHS),
+]
@@ -1,8 +1,14 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import plotly.graph_objects as go
 
+import columnar
+import db
+import disk_cache
+import profiling
+import queries
+import trends
+
 st.markdown("""
     <style>
         .block-container {
@@ -15,64 +21,74 @@ st.markdown("<h1 style='text-align: center;'>US Consumer Spending Analysis</h1>"
 st.markdown("<h5 style='text-align: center;'>Exploring spending patterns, merchant trends, and financial forecasting across a synthetic US banking dataset.</h5>", unsafe_allow_html=True)
 st.markdown("<p style='text-align: center; color: grey;'>by Yasith Senanayake</p>", unsafe_allow_html=True)
 
+version = db.data_version()
+
 # ── Data Loaders ───────────────────────────────────────────────────────────────
-@st.cache_data
-def load_metrics():
-    conn = sqlite3.connect('data/finance.db')
-    total_spent = pd.read_sql_query("""
-        SELECT SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS total_spent
-        FROM transactions
-    """, conn)
-    total_count = pd.read_sql_query("SELECT COUNT(*) AS count FROM transactions", conn)
-    unique_users = pd.read_sql_query("SELECT COUNT(DISTINCT client_id) AS count FROM transactions", conn)
-    return total_spent, total_count, unique_users
+# Every loader reads only the date range picked below. The metrics cover each
+# whole month the range touches.
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64)))
+def load_metrics(start, end, version):
+    months = trends.month_range(start, end)
+    return db.query(db.fuse(queries.ROLLUP_TOTALS, queries.UNIQUE_USERS), months + months)
+
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_date_range(version):
+    return trends.date_range(db.query(queries.DAY_RANGE))
 
-@st.cache_data
-def load_monthly():
-    conn = sqlite3.connect('data/finance.db')
-    df = pd.read_sql_query("""
-        SELECT 
-            strftime('%Y-%m', date) AS month,
-            SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS monthly_total
-        FROM transactions
-        GROUP BY month
-        ORDER BY month ASC
-    """, conn)
-    df['month'] = pd.to_datetime(df['month'])
-    df['ma_3']  = df['monthly_total'].rolling(window=3).mean()
-    df['ma_12'] = df['monthly_total'].rolling(window=12).mean()
-    return df
+# One entry per range and granularity viewed. Only the range asked for is
+# read, plus a year before it for the moving averages.
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64)))
+def load_trend(start, end, granularity, version):
+    if granularity != 'Month':
+        totals = trends.daily(db.query(queries.DAILY_TOTALS, trends.day_range(start, end)))
+    elif columnar.ENABLED:
+        totals = trends.monthly(columnar.get_store(version).monthly_totals(trends.trend_months(start, end)))
+    else:
+        totals = trends.monthly(db.query(queries.MONTHLY_TOTALS, trends.trend_months(start, end)))
+    return trends.trend(totals, granularity, start, end)
 
 st.subheader('Spending Overview')
+# Zooming happens on the server: the range picked here decides what every
+# query reads, and no more than trends.MAX_POINTS points are drawn.
+first_day, last_day = load_date_range(version)
+start, end = st.slider('Date range', min_value=first_day, max_value=last_day,
+                       value=(first_day, last_day), format='YYYY-MM-DD')
+
 # ── Metrics ────────────────────────────────────────────────────────────────────
-df_total, df_count, df_users = load_metrics()
+df_metrics = load_metrics(start, end, version)
 
 col1, col2, col3 = st.columns(3)
 with col1:
     with st.container(border=True):
-        st.metric('Total Spent', f"${df_total['total_spent'][0]:,.2f}")
+        st.metric('Total Spent', f"${df_metrics['total_spent'][0]:,.2f}")
 with col2:
     with st.container(border=True):
-        st.metric('Number of Transactions', f"{df_count['count'][0]:,}")
+        st.metric('Number of Transactions', f"{df_metrics['transaction_count'][0]:,}")
 with col3:
     with st.container(border=True):
-        st.metric('Unique Users', f"{df_users['count'][0]:,}")
+        st.metric('Unique Users', f"{df_metrics['unique_users'][0]:,}")
+
+# ── Chart: Spending over Time with Moving Averages ─────────────────────────────
+_, col2 = st.columns([4, 1])
+with col2:
+    granularity = st.selectbox('Granularity', ['Auto', *trends.GRANULARITIES])
+if granularity == 'Auto':
+    granularity = trends.auto_granularity(start, end)
 
-# ── Chart: Monthly Spending with Moving Averages ───────────────────────────────
-df_monthly = load_monthly()
-st.markdown("<h3 style='text-align: center;'>Monthly Spending over Time</h3>", unsafe_allow_html=True)
+df_trend = load_trend(start, end, granularity, version)
+st.markdown(f"<h3 style='text-align: center;'>{trends.TITLES[granularity]} Spending over Time</h3>", unsafe_allow_html=True)
 
 fig = go.Figure()
 fig.add_trace(go.Scatter(
-    x=df_monthly['month'], y=df_monthly['monthly_total'],
+    x=df_trend.index, y=df_trend['total'],
     name='Actual', line=dict(color='steelblue'), opacity=0.6
 ))
 fig.add_trace(go.Scatter(
-    x=df_monthly['month'], y=df_monthly['ma_3'],
+    x=df_trend.index, y=df_trend['ma_3'],
     name='3-Month MA', line=dict(color='orange')
 ))
 fig.add_trace(go.Scatter(
-    x=df_monthly['month'], y=df_monthly['ma_12'],
+    x=df_trend.index, y=df_trend['ma_12'],
     name='12-Month MA', line=dict(color='green')
 ))
 fig.update_layout(
@@ -81,14 +97,5 @@ fig.update_layout(
     yaxis_tickformat='.2s',
     yaxis_tickprefix='$',
     template='plotly_white',
-    xaxis=dict(
-        rangeselector=dict(
-            buttons=[
-                dict(label='2 Years', step='year', stepmode='backward', count=2),
-                dict(label='5 Years', step='year', stepmode='backward', count=5),
-                dict(label='All', count=118, step='month', stepmode='backward'),
-            ]
-        ),
-    )
 )
-st.plotly_chart(fig, width='stretch')
\ No newline at end of file
+st.plotly_chart(fig, width='stretch')
@@ -1,9 +1,16 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+import approx
+import columnar
+import db
+import disk_cache
+import profiling
+import queries
+import trends
+
 st.markdown("""
     <style>
         .block-container {
@@ -16,46 +23,71 @@ st.markdown("<h1 style='text-align: center;'>Spending by Category</h1>", unsafe_
 st.markdown("<h5 style='text-align: center;'>Breakdown of transaction volume and spend across merchant categories.</h5>", unsafe_allow_html=True)
 st.markdown("<p style='text-align: center; color: grey;'>by Yasith Senanayake</p>", unsafe_allow_html=True)
 
-@st.cache_data
-def load_top_by_volume():
-    conn = sqlite3.connect('data/finance.db')
-    return pd.read_sql_query("""
-        SELECT 
-            mcc_codes.description,
-            COUNT(*) AS number_transactions,
-            SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS total_spent,
-            ROUND(AVG(CAST(REPLACE(amount, '$', '') AS REAL)), 2) AS avg_transaction
-        FROM transactions
-        LEFT JOIN mcc_codes ON transactions.mcc = mcc_codes.mcc
-        GROUP BY mcc_codes.description
-        ORDER BY number_transactions DESC
-        LIMIT 10
-    """, conn)
-
-@st.cache_data
-def load_top_by_avg():
-    conn = sqlite3.connect('data/finance.db')
-    return pd.read_sql_query("""
-        SELECT 
-            mcc_codes.description,
-            COUNT(*) AS number_transactions,
-            SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS total_spent,
-            ROUND(AVG(CAST(REPLACE(amount, '$', '') AS REAL)), 2) AS avg_transaction
-        FROM transactions
-        LEFT JOIN mcc_codes ON transactions.mcc = mcc_codes.mcc
-        GROUP BY mcc_codes.description
-        ORDER BY avg_transaction DESC
-        LIMIT 10
-    """, conn)
-
-df_volume = load_top_by_volume()
-df_avg    = load_top_by_avg()
+version = db.data_version()
+
+# Every loader reads only the date range picked below. The top 10 charts
+# cover each whole month the range touches.
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_date_range(version):
+    return trends.date_range(db.query(queries.DAY_RANGE))
+
+# The refine pool calls these outside any session, hence no spinner (approx.py)
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64, show_spinner=False)))
+def load_top_by_volume(start, end, version):
+    if columnar.ENABLED:
+        return columnar.get_store(version).top_by_volume(months=trends.month_range(start, end))
+    return db.query(queries.TOP_BY_VOLUME, trends.month_range(start, end))
+
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64, show_spinner=False)))
+def load_top_by_avg(start, end, version):
+    if columnar.ENABLED:
+        return columnar.get_store(version).top_by_avg(months=trends.month_range(start, end))
+    return db.query(queries.TOP_BY_AVG, trends.month_range(start, end))
+
+# Estimates of the same from the stratified sample (approx.py), drawn while
+# the in-memory engine is still loading the exact answer
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_sample_rates(version):
+    return approx.stored_rates()
+
+@profiling.loader(st.cache_data(max_entries=64))
+def load_top_by_volume_estimate(rate, start, end, version):
+    return approx.get_sample(version).top_categories(rate, trends.month_range(start, end), 'number_transactions')
+
+@profiling.loader(st.cache_data(max_entries=64))
+def load_top_by_avg_estimate(rate, start, end, version):
+    return approx.get_sample(version).top_categories(rate, trends.month_range(start, end), 'avg_transaction')
+
+first_day, last_day = load_date_range(version)
+start, end = st.slider('Date range', min_value=first_day, max_value=last_day,
+                       value=(first_day, last_day), format='YYYY-MM-DD')
+
+# Accuracy trades precision for speed: below Exact, a chart whose exact answer
+# is not ready is drawn from a sample of that size first. Only the in-memory
+# engine reads transactions itself (the first call per data version loads
+# them whole); SQL answers come from the rollup tables in milliseconds and
+# are never estimated. Under load, turning off refining keeps the estimates
+# and runs no exact queries.
+levels = {approx.rate_label(rate): rate for rate in load_sample_rates(version)} if columnar.ENABLED else {}
+if levels:
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        level = st.select_slider('Accuracy', options=[*levels, 'Exact'], value='Exact')
+    with col2:
+        refine = st.toggle('Refine to exact', value=True, disabled=level == 'Exact')
+    preview = approx.Preview(levels.get(level), refine)
+else:
+    preview = approx.Preview(None)
+
+df_volume = preview.load(load_top_by_volume, load_top_by_volume_estimate, start, end, version)
+df_avg    = preview.load(load_top_by_avg, load_top_by_avg_estimate, start, end, version)
 
 st.subheader('Top 10 Categories by Transaction Volume')
 fig_vol = px.bar(
     df_volume, x='number_transactions', y='description',
     orientation='h',
     labels={'number_transactions': 'Number of Transactions', 'description': ''},
+    error_x=approx.margin(df_volume, 'number_transactions'),
     template='plotly_white',
 )
 fig_vol.update_traces(marker_color='steelblue')
@@ -64,60 +96,76 @@ fig_vol.update_layout(
     xaxis=dict(tickformat='~s')
 )
 st.plotly_chart(fig_vol, width='stretch')
+if preview.estimated(df_volume):
+    st.caption(preview.caption())
 
 st.subheader('Top 10 Categories by Average Transaction Size')
 fig_avg = px.bar(
     df_avg, x='avg_transaction', y='description',
     orientation='h',
     labels={'avg_transaction': 'Average Transaction ($)', 'description': ''},
+    error_x=approx.margin(df_avg, 'avg_transaction'),
     template='plotly_white',
 )
 fig_avg.update_traces(marker_color='seagreen')
 fig_avg.update_layout(yaxis=dict(categoryorder='total ascending'))
 st.plotly_chart(fig_avg, width='stretch')
+if preview.estimated(df_avg):
+    st.caption(preview.caption())
+
+# One entry per category, range and granularity viewed. Only the range asked
+# for is read, plus a year before it for the moving averages. With the
+# in-memory engine a category's months are a slice of the shared arrays
+# rather than a query.
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64, show_spinner=False)))
+def load_category_trends(category, start, end, granularity, version):
+    if granularity != 'Month':
+        df = db.query(queries.CATEGORY_DAILY_TOTALS, (category, *trends.day_range(start, end)))
+        return trends.trend(trends.daily(df), granularity, start, end)
+    if columnar.ENABLED:
+        df = columnar.get_store(version).category_monthly_totals(category, trends.trend_months(start, end))
+    else:
+        df = db.query(queries.CATEGORY_MONTHLY_TOTALS, (category, *trends.trend_months(start, end)))
+    return trends.trend(trends.monthly(df), granularity, start, end)
 
-@st.cache_data
-def load_category_trends(category):
-    conn = sqlite3.connect('data/finance.db')
-    df = pd.read_sql_query(f"""
-        SELECT 
-            strftime('%Y-%m', date) AS month,
-            SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS monthly_total
-        FROM transactions
-        LEFT JOIN mcc_codes ON transactions.mcc = mcc_codes.mcc
-        WHERE mcc_codes.description = '{category}'
-        GROUP BY month
-        ORDER BY month ASC
-    """, conn)
-    df['month'] = pd.to_datetime(df['month'])
-    df = df.set_index('month')
-    df['ma_3']  = df['monthly_total'].rolling(window=3).mean()
-    df['ma_12'] = df['monthly_total'].rolling(window=12).mean()
-    return df
-
-@st.cache_data
-def load_all_categories():
-    conn = sqlite3.connect('data/finance.db')
-    return pd.read_sql_query("""
-        SELECT DISTINCT mcc_codes.description
-        FROM transactions
-        LEFT JOIN mcc_codes ON transactions.mcc = mcc_codes.mcc
-        WHERE mcc_codes.description IS NOT NULL
-        ORDER BY mcc_codes.description ASC
-    """, conn)['description'].tolist()
+# Monthly only: a sample thin enough to be fast leaves too few rows per day
+@profiling.loader(st.cache_data(max_entries=64))
+def load_category_trends_estimate(rate, category, start, end, granularity, version):
+    df = approx.get_sample(version).category_monthly_totals(category, rate, trends.trend_months(start, end))
+    df_trend = trends.trend(trends.monthly(df), granularity, start, end)
+    margins = pd.Series(df['monthly_total_moe'].to_numpy(), index=trends.monthly(df).index)
+    df_trend['total_moe'] = margins.reindex(df_trend.index, fill_value=0.0)
+    return df_trend
+
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_all_categories(version):
+    if columnar.ENABLED:
+        return columnar.get_store(version).all_categories()
+    return db.query(queries.ALL_CATEGORIES)['description'].tolist()
 
 
 st.subheader('Category Spending Trends')
 
-categories = load_all_categories()
-selected = st.selectbox('Select a category', categories)
+categories = load_all_categories(version)
+col1, col2 = st.columns([4, 1])
+with col1:
+    selected = st.selectbox('Select a category', categories)
+with col2:
+    granularity = st.selectbox('Granularity', ['Auto', *trends.GRANULARITIES])
+if granularity == 'Auto':
+    granularity = trends.auto_granularity(start, end)
 
-df_trend = load_category_trends(selected)
+if granularity == 'Month':
+    df_trend = preview.load(load_category_trends, load_category_trends_estimate,
+                            selected, start, end, granularity, version)
+else:
+    df_trend = load_category_trends(selected, start, end, granularity, version)
 
 fig_trend = go.Figure()
 fig_trend.add_trace(go.Scatter(
-    x=df_trend.index, y=df_trend['monthly_total'],
-    name='Actual', line=dict(color='steelblue'), opacity=0.6
+    x=df_trend.index, y=df_trend['total'],
+    name='Actual', line=dict(color='steelblue'), opacity=0.6,
+    error_y=dict(array=df_trend['total_moe']) if 'total_moe' in df_trend else None,
 ))
 fig_trend.add_trace(go.Scatter(
     x=df_trend.index, y=df_trend['ma_3'],
@@ -128,20 +176,23 @@ fig_trend.add_trace(go.Scatter(
     name='12-Month MA', line=dict(color='green')
 ))
 fig_trend.update_layout(
-    xaxis_title='Month',
+    xaxis_title=granularity,
     yaxis_title='Total Spend',
     yaxis_tickformat='.2s',
     yaxis_tickprefix='$',
     template='plotly_white',
-    xaxis=dict(
-        range=['2010-01-01', '2019-10-01'],
-        rangeselector=dict(
-            buttons=[
-                dict(label='2 Years', step='year', stepmode='backward', count=2),
-                dict(label='5 Years', step='year', stepmode='backward', count=5),
-                dict(label='All', count=118, step='month', stepmode='backward'),
-            ]
-        ),
-    )
 )
-st.plotly_chart(fig_trend, width='stretch')
\ No newline at end of file
+st.plotly_chart(fig_trend, width='stretch')
+if preview.estimated(df_trend):
+    st.caption(preview.caption())
+
+# ── Refinement ─────────────────────────────────────────────────────────────────
+# While an exact answer a chart above is estimating is still running, poll it
+# and rerun the page once it lands. Everything above has already rendered.
+if preview.waiting:
+    @st.fragment(run_every=approx.REFINE_POLL_SECONDS)
+    def wait_for_exact():
+        if any(future.done() for future in preview.waiting):
+            st.rerun()
+
+    wait_for_exact()
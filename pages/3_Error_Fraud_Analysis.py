@@ -1,9 +1,17 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+import approx
+import columnar
+import db
+import disk_cache
+import error_flags
+import profiling
+import queries
+import trends
+
 st.markdown("""
     <style>
         .block-container {
@@ -16,52 +24,96 @@ st.markdown("<h1 style='text-align: center;'>Error & Fraud Analysis</h1>", unsaf
 st.markdown("<h5 style='text-align: center;'>Exploring transaction errors, their relationship to fraud, and where they occur.</h5>", unsafe_allow_html=True)
 st.markdown("<p style='text-align: center; color: grey;'>by Yasith Senanayake</p>", unsafe_allow_html=True)
 
+version = db.data_version()
+
+# Every chart covers each whole month the date range below touches, and its
+# loader reads only those months
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_date_range(version):
+    return trends.date_range(db.query(queries.DAY_RANGE))
+
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_sample_rates(version):
+    return approx.stored_rates()
+
+first_day, last_day = load_date_range(version)
+start, end = st.slider('Date range', min_value=first_day, max_value=last_day,
+                       value=(first_day, last_day), format='YYYY-MM-DD')
+
+# Accuracy trades precision for speed: below Exact, the error distribution is
+# drawn from a sample of that size first while the in-memory engine loads
+# transactions (see approx.py). The fraud charts read the rollup tables and
+# are always exact. Under load, turning off refining keeps the estimate and
+# runs no exact query.
+levels = {approx.rate_label(rate): rate for rate in load_sample_rates(version)} if columnar.ENABLED else {}
+if levels:
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        level = st.select_slider('Accuracy', options=[*levels, 'Exact'], value='Exact')
+    with col2:
+        refine = st.toggle('Refine to exact', value=True, disabled=level == 'Exact')
+    preview = approx.Preview(levels.get(level), refine)
+else:
+    preview = approx.Preview(None)
+
 # ── Chart 1: Error Distribution ────────────────────────────────────────────────
-@st.cache_data
-def load_error_distribution():
-    conn = sqlite3.connect('data/finance.db')
-    return pd.read_sql_query("""
-        SELECT 
-            errors,
-            COUNT(*) AS transaction_count
-        FROM transactions
-        WHERE errors != 'No Error'
-        AND errors NOT LIKE '%,%'
-        GROUP BY errors
-        ORDER BY transaction_count DESC
-        LIMIT 10
-    """, conn)
-
-df_errors = load_error_distribution()
+# The refine pool calls this outside any session, hence no spinner (approx.py)
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64, show_spinner=False)))
+def load_error_distribution(start, end, version):
+    if columnar.ENABLED:
+        return columnar.get_store(version).error_distribution(months=trends.month_range(start, end))
+    return db.query(queries.ERROR_DISTRIBUTION, trends.month_range(start, end))
+
+@profiling.loader(st.cache_data(max_entries=64))
+def load_error_distribution_estimate(rate, start, end, version):
+    return approx.get_sample(version).error_distribution(rate, trends.month_range(start, end))
+
+df_errors = preview.load(load_error_distribution, load_error_distribution_estimate, start, end, version)
 
 st.subheader('Distribution of Transaction Errors')
 fig_errors = px.bar(
     df_errors, x='transaction_count', y='errors',
     orientation='h',
     labels={'transaction_count': 'Number of Transactions', 'errors': ''},
+    error_x=approx.margin(df_errors, 'transaction_count'),
     template='plotly_white',
 )
 fig_errors.update_traces(marker_color='steelblue')
 fig_errors.update_layout(yaxis=dict(categoryorder='total ascending'))
 st.plotly_chart(fig_errors, width='stretch')
+if preview.estimated(df_errors):
+    st.caption(preview.caption())
 
 # ── Loading pre-loaded data (for long queries) ────────────────────────────────────────────────
-@st.cache_data
-def load_fraud_by_error():
-    df = pd.read_csv('data/fraud_by_error.csv')
+# The CSVs precompute.py writes cover the whole history. A narrower range runs
+# the same query over just its months of the rollup.
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64)))
+def load_fraud_by_error(start, end, version):
+    if trends.month_range(start, end) == trends.month_range(*load_date_range(version)):
+        df = pd.read_csv('data/fraud_by_error.csv')
+    else:
+        df = db.query(queries.FRAUD_BY_ERROR, trends.month_range(start, end))
+        df.insert(0, 'errors', error_flags.labels(df['error_mask']))
     df['errors'] = df['errors'].fillna('No Error')
     return df
 
-@st.cache_data
-def load_fraud_over_time():
+@profiling.loader(st.cache_data)
+def load_fraud_over_time(version):
     return pd.read_csv('data/fraud_over_time.csv')
 
-@st.cache_data
-def load_fraud_amounts():
-    return pd.read_csv('data/fraud_amounts.csv')
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64)))
+def load_fraud_amounts(start, end, version):
+    if trends.month_range(start, end) == trends.month_range(*load_date_range(version)):
+        return pd.read_csv('data/fraud_amounts.csv')
+    return db.query(queries.FRAUD_AMOUNTS, trends.month_range(start, end))
 
-df_fraud_error = load_fraud_by_error()
-df_fraud_amounts = load_fraud_amounts()
+df_fraud_error = load_fraud_by_error(start, end, version)
+df_fraud_amounts = load_fraud_amounts(start, end, version)
+
+def average_amount(df, is_fraud):
+    # The metric text. A narrow range may hold no fraud at all.
+    row = df[df['is_fraud'] == is_fraud]
+    return f"${row['avg_amount'].values[0]:,.2f}" if not row.empty else '-'
 
 # ── Chart 2 & 3: Fraud Rate by Error + Avg Transaction Amount ─────────────────
 col1, col2 = st.columns([4, 1])
@@ -88,16 +140,18 @@ with col1:
 with col2:
     st.subheader('How Much Do Fraudsters Spend?')
     with st.container(border=True):
-        st.metric('Typical Transaction (avg)', f"${df_fraud_amounts[df_fraud_amounts['is_fraud'] == 'No']['avg_amount'].values[0]:,.2f}")
+        st.metric('Typical Transaction (avg)', average_amount(df_fraud_amounts, 'No'))
     with st.container(border=True):
-        st.metric('Fraudulent Transaction (avg)', f"${df_fraud_amounts[df_fraud_amounts['is_fraud'] == 'Yes']['avg_amount'].values[0]:,.2f}")
+        st.metric('Fraudulent Transaction (avg)', average_amount(df_fraud_amounts, 'Yes'))
 
 # ── Chart 4: Fraud Rate by Merchant Category ──────────────────────────────────
-@st.cache_data
-def load_fraud_by_category():
-    return pd.read_csv('data/fraud_by_category.csv')
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64)))
+def load_fraud_by_category(start, end, version):
+    if trends.month_range(start, end) == trends.month_range(*load_date_range(version)):
+        return pd.read_csv('data/fraud_by_category.csv')
+    return db.query(queries.FRAUD_BY_CATEGORY, trends.month_range(start, end))
 
-df_fraud_cat = load_fraud_by_category()
+df_fraud_cat = load_fraud_by_category(start, end, version)
 
 st.subheader('Fraud Rate by Merchant Category: Top 10')
 
@@ -114,3 +168,92 @@ fig_top.update_traces(marker_color='steelblue')
 fig_top.update_layout(yaxis=dict(categoryorder='total ascending'))
 st.plotly_chart(fig_top, width='stretch')
 
+
+# ── Chart 5 & 6: Fraud Rate by Error Flag + Primary Error ─────────────────────
+# Errors are stored as a bitmask (see error_flags.py), so these breakdowns are
+# bit tests on the rollup rather than substring matches on every transaction.
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64)))
+def load_fraud_by_flag(start, end, version):
+    return db.query(queries.FRAUD_BY_FLAG, trends.month_range(start, end))
+
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64)))
+def load_fraud_by_primary_error(start, end, version):
+    return db.query(queries.FRAUD_BY_PRIMARY_ERROR, trends.month_range(start, end))
+
+df_fraud_flag = load_fraud_by_flag(start, end, version)
+df_fraud_primary = load_fraud_by_primary_error(start, end, version)
+
+col1, col2 = st.columns(2)
+
+with col1:
+    st.subheader('Fraud Rate by Error Flag')
+    fig_flag = px.bar(
+        df_fraud_flag, x='fraud_rate', y='error',
+        orientation='h',
+        labels={'fraud_rate': 'Fraud Rate (%)', 'error': ''},
+        hover_data=['total_transactions', 'fraud_count'],
+        template='plotly_white',
+    )
+    fig_flag.update_traces(marker_color='darkorange')
+    fig_flag.update_layout(yaxis=dict(categoryorder='total ascending'))
+    st.plotly_chart(fig_flag, width='stretch')
+    st.write('Every transaction carrying the flag, whether alone or alongside other errors.')
+
+with col2:
+    st.subheader('Fraud Rate by Primary Error')
+    fig_primary = px.bar(
+        df_fraud_primary, x='fraud_rate', y='primary_error',
+        orientation='h',
+        labels={'fraud_rate': 'Fraud Rate (%)', 'primary_error': ''},
+        hover_data=['total_transactions', 'fraud_count'],
+        template='plotly_white',
+    )
+    fig_primary.update_traces(marker_color='steelblue')
+    fig_primary.update_layout(yaxis=dict(categoryorder='total ascending'))
+    st.plotly_chart(fig_primary, width='stretch')
+    st.write('Each transaction counted once, under its highest-priority error: '
+             + ' > '.join(error_flags.FLAGS) + '.')
+
+# ── Chart 7: Error Flag Combinations ──────────────────────────────────────────
+@profiling.loader(disk_cache.tier(st.cache_data(max_entries=64)))
+def load_fraud_by_combination(mask, start, end, version):
+    df = db.query(queries.FRAUD_BY_COMBINATION, (mask, mask, *trends.month_range(start, end)))
+    df.insert(0, 'errors', error_flags.labels(df['error_mask']))
+    df['errors'] = df['errors'].fillna('No Error')
+    df['fraud_rate'] = (100 * df['fraud_count'] / df['total_transactions']).round(2)
+    return df
+
+st.subheader('Error Flag Combinations')
+selected = st.multiselect('Transactions with all of these errors', list(error_flags.FLAGS), default=['Bad CVV'])
+mask = sum(error_flags.FLAGS[name] for name in selected)
+df_combo = load_fraud_by_combination(mask, start, end, version)
+
+total = df_combo['total_transactions'].sum()
+fraud = df_combo['fraud_count'].sum()
+col1, col2, col3 = st.columns(3)
+with col1:
+    with st.container(border=True):
+        st.metric('Transactions', f'{total:,}')
+with col2:
+    with st.container(border=True):
+        st.metric('Fraudulent', f'{fraud:,}')
+with col3:
+    with st.container(border=True):
+        st.metric('Fraud Rate', f'{100 * fraud / total:.2f}%' if total else '-')
+
+st.dataframe(
+    df_combo[['errors', 'total_transactions', 'fraud_count', 'fraud_rate']],
+    hide_index=True, width='stretch',
+)
+st.write('Every exact combination of errors that includes the selected ones. Leave the selection empty to see all of them.')
+
+# ── Refinement ─────────────────────────────────────────────────────────────────
+# While an exact answer a chart above is estimating is still running, poll it
+# and rerun the page once it lands. Everything above has already rendered.
+if preview.waiting:
+    @st.fragment(run_every=approx.REFINE_POLL_SECONDS)
+    def wait_for_exact():
+        if any(future.done() for future in preview.waiting):
+            st.rerun()
+
+    wait_for_exact()
@@ -1,10 +1,13 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from statsmodels.tsa.statespace.sarimax import SARIMAX
-from sklearn.metrics import mean_absolute_error
+
+import db
+import disk_cache
+import forecasting
+import profiling
+import queries
 
 st.markdown("""
     <style>
@@ -18,46 +21,79 @@ st.markdown("<h1 style='text-align: center;'>Forecasting</h1>", unsafe_allow_htm
 st.markdown("<h5 style='text-align: center;'>Time series forecasting using SARIMA - trained on 2010–2018 spending data, validated against 2019, and projected 12 months ahead.</h5>", unsafe_allow_html=True)
 st.markdown("<p style='text-align: center; color: grey;'>by Yasith Senanayake</p>", unsafe_allow_html=True)
 
+version = db.data_version()
+
+
+# Models are fitted ahead of time by precompute.py, so each one below is
+# normally a file read. A model whose series changed since the last precompute
+# run is refitted in the background instead of inline: until it is stored the
+# page shows the forecast that run left in the forecasts table (or just the
+# history), then reruns to swap the new one in.
+FIT_POLL_SECONDS = 2
+
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_series(series, version):
+    if series == forecasting.TOTAL:
+        history = forecasting.load_total_series()
+        return history, forecasting.model_order(history, forecasting.TOTAL_ORDER)
+    history = forecasting.load_category_series(series)
+    return history, forecasting.model_order(history, forecasting.CATEGORY_ORDER)
+
+# Only called once fit_status reports the artifact stored, so the cache never
+# holds a placeholder
+@profiling.loader(st.cache_data)
+def load_fitted(series, version):
+    history, order = load_series(series, version)
+    return forecasting.get_artifact(history, order)
+
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_stored_forecast(series, version):
+    try:
+        return db.query(queries.SERIES_FORECAST, (series,))
+    except Exception as e:
+        if not db.missing_table(e):
+            raise
+        return pd.DataFrame()
+
+# With FINANCE_FORECAST_ENGINE=ets every category is forecast in one batch
+# Holt-Winters fit instead, which takes well under a second. The total keeps
+# its SARIMA model.
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_ets_forecasts(version):
+    return forecasting.ets_forecasts()
+
+def forecast_state(series):
+    # (status, error, forecast rows, artifact). The artifact is None until the
+    # fit is done, and the rows are the last stored forecast until then.
+    if forecasting.ENGINE == 'ets' and series != forecasting.TOTAL:
+        df_ets = load_ets_forecasts(version)
+        return 'ready', None, df_ets[df_ets['series'] == series].reset_index(drop=True), None
+    history, order = load_series(series, version)
+    status, error = forecasting.fit_status(series, history, order)
+    if status == 'ready':
+        artifact = load_fitted(series, version)
+        return status, error, forecasting.forecast_rows(series, artifact), artifact
+    return status, error, load_stored_forecast(series, version), None
+
+def forecast_series(df_fc):
+    # Forecast rows -> (mean, 95% interval) indexed by month
+    index = pd.DatetimeIndex(pd.to_datetime(df_fc['month'].astype(str), format='%Y%m').values, freq='MS')
+    future_mean = pd.Series(df_fc['forecast'].to_numpy(), index=index)
+    future_ci   = pd.DataFrame({'lower': df_fc['lower'].to_numpy(), 'upper': df_fc['upper'].to_numpy()}, index=index)
+    return future_mean, future_ci
 
-@st.cache_data
-def load_monthly():
-    conn = sqlite3.connect('data/finance.db')
-    df = pd.read_sql_query("""
-        SELECT 
-            strftime('%Y-%m', date) AS month,
-            SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS monthly_total
-        FROM transactions
-        GROUP BY month
-        ORDER BY month ASC
-    """, conn)
-    df['month'] = pd.to_datetime(df['month'])
-    df = df.set_index('month')
-    df.index = pd.DatetimeIndex(df.index.values, freq='MS')
-    return df
-
-@st.cache_resource
-def fit_eval_model():
-    df = load_monthly()
-    train = df[df.index < '2019-01-01']
-    test  = df[df.index >= '2019-01-01']
-    model = SARIMAX(train['monthly_total'], order=(1, 0, 1), seasonal_order=(1, 0, 1, 12))
-    result = model.fit(disp=False)
-    forecast_mean = result.get_forecast(steps=len(test)).predicted_mean
-    mae  = mean_absolute_error(test['monthly_total'], forecast_mean)
-    mape = (abs(test['monthly_total'] - forecast_mean) / test['monthly_total']).mean() * 100
-    return mae, mape, forecast_mean
-
-@st.cache_resource
-def fit_overall_model():
-    df = load_monthly()
-    model = SARIMAX(df['monthly_total'], order=(1, 0, 1), seasonal_order=(1, 0, 1, 12))
-    return model.fit(disp=False), df
-
-df = load_monthly()
-train = df[df.index < '2019-01-01']
-test  = df[df.index >= '2019-01-01']
-mae, mape, eval_mean = fit_eval_model()
-result, df = fit_overall_model()
+def fit_notice(series, status, error, df_fc):
+    stale = 'showing the last stored forecast' if not df_fc.empty else 'showing the history only'
+    if status == 'fitting':
+        st.info(f'Fitting the {series} model on the latest data ({stale} until it is ready)...')
+    elif status == 'failed':
+        st.warning(f'The {series} model could not be fitted ({stale}): {error}')
+
+status, error, df_fc, artifact = forecast_state(forecasting.TOTAL)
+df    = load_series(forecasting.TOTAL, version)[0].to_frame()
+train = df[df.index < forecasting.SPLIT_DATE]
+test  = df[df.index >= forecasting.SPLIT_DATE]
+fit_notice('total spend', status, error, df_fc)
 
 # ── Train/Test Chart ───────────────────────────────────────────────────────────
 st.subheader('Model Validation: Forecast vs Actual (2019)')
@@ -71,16 +107,19 @@ fig_eval.add_trace(go.Scatter(
     x=test.index, y=test['monthly_total'],
     name='Actual', line=dict(color='orange')
 ))
-fig_eval.add_trace(go.Scatter(
-    x=eval_mean.index, y=eval_mean.values,
-    name='Forecast', line=dict(color='green')
-))
-fig_eval.add_trace(go.Scatter(
-    x=[train.index[-1], eval_mean.index[0]],
-    y=[train['monthly_total'].iloc[-1], eval_mean.iloc[0]],
-    line=dict(color='green', dash='dash'),
-    showlegend=False
-))
+# The stored forecast rows have no 2019 predictions, so the line waits for the fit
+if artifact is not None:
+    eval_mean = artifact['eval_mean']
+    fig_eval.add_trace(go.Scatter(
+        x=eval_mean.index, y=eval_mean.values,
+        name='Forecast', line=dict(color='green')
+    ))
+    fig_eval.add_trace(go.Scatter(
+        x=[train.index[-1], eval_mean.index[0]],
+        y=[train['monthly_total'].iloc[-1], eval_mean.iloc[0]],
+        line=dict(color='green', dash='dash'),
+        showlegend=False
+    ))
 fig_eval.update_layout(
     xaxis_title='Date',
     yaxis_title='Total Spent',
@@ -106,41 +145,39 @@ st.write('The model was trained on 2010–2018 data and tested on 2019. The fore
 # ── Metrics ────────────────────────────────────────────────────────────────────
 col1, col2 = st.columns(2)
 with col1:
-    st.metric('MAE', f"${mae:,.0f}")
+    st.metric('MAE', f"${df_fc['mae'][0]:,.0f}" if not df_fc.empty else '-')
 with col2:
-    st.metric('MAPE', f"{mape:.2f}%")
+    st.metric('MAPE', f"{df_fc['mape'][0]:.2f}%" if not df_fc.empty else '-')
 
 st.info('Average error per month in dollars (MAE) and as a percentage (MAPE). **Under 2% MAPE is considered excellent for real-world financial data**')
 
 # ── Future Forecast Chart ──────────────────────────────────────────────────────
 st.subheader('12 Month Forecast (Nov 2019 — Oct 2020)')
 
-future_forecast = result.get_forecast(steps=12)
-future_mean     = future_forecast.predicted_mean
-future_ci       = future_forecast.conf_int()
-
 fig_future = go.Figure()
 fig_future.add_trace(go.Scatter(
     x=df.index, y=df['monthly_total'],
     name='Actual', line=dict(color='steelblue')
 ))
-fig_future.add_trace(go.Scatter(
-    x=future_mean.index, y=future_mean.values,
-    name='Forecast', line=dict(color='green')
-))
-fig_future.add_trace(go.Scatter(
-    x=[df.index[-1], future_mean.index[0]],
-    y=[df['monthly_total'].iloc[-1], future_mean.iloc[0]],
-    line=dict(color='green', dash='dash'),
-    showlegend=False
-))
-fig_future.add_trace(go.Scatter(
-    x=list(future_ci.index) + list(future_ci.index[::-1]),
-    y=list(future_ci.iloc[:, 0]) + list(future_ci.iloc[:, 1][::-1]),
-    fill='toself', fillcolor='rgba(0,200,100,0.15)',
-    line=dict(color='rgba(255,255,255,0)'),
-    name='95% Confidence Interval'
-))
+if not df_fc.empty:
+    future_mean, future_ci = forecast_series(df_fc)
+    fig_future.add_trace(go.Scatter(
+        x=future_mean.index, y=future_mean.values,
+        name='Forecast', line=dict(color='green')
+    ))
+    fig_future.add_trace(go.Scatter(
+        x=[df.index[-1], future_mean.index[0]],
+        y=[df['monthly_total'].iloc[-1], future_mean.iloc[0]],
+        line=dict(color='green', dash='dash'),
+        showlegend=False
+    ))
+    fig_future.add_trace(go.Scatter(
+        x=list(future_ci.index) + list(future_ci.index[::-1]),
+        y=list(future_ci.iloc[:, 0]) + list(future_ci.iloc[:, 1][::-1]),
+        fill='toself', fillcolor='rgba(0,200,100,0.15)',
+        line=dict(color='rgba(255,255,255,0)'),
+        name='95% Confidence Interval'
+    ))
 fig_future.update_layout(
     xaxis_title='Date',
     yaxis_title='Total Spend',
@@ -163,82 +200,53 @@ st.plotly_chart(fig_future, width='stretch')
 
 st.write('The model was refit on the full dataset before forecasting. The shaded area shows where the predictions are expected to fall with 95% confidence')
 
-@st.cache_data
-def load_top_categories():
-    conn = sqlite3.connect('data/finance.db')
-    return pd.read_sql_query("""
-        SELECT 
-            mcc_codes.description,
-            COUNT(*) AS total_transactions
-        FROM transactions
-        LEFT JOIN mcc_codes ON transactions.mcc = mcc_codes.mcc
-        GROUP BY mcc_codes.description
-        ORDER BY total_transactions DESC
-        LIMIT 10
-    """, conn)['description'].tolist()
-
-@st.cache_resource
-def fit_category_model(category):
-    conn = sqlite3.connect('data/finance.db')
-    df_cat = pd.read_sql_query(f"""
-        SELECT 
-            strftime('%Y-%m', date) AS month,
-            SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS monthly_total
-        FROM transactions
-        LEFT JOIN mcc_codes ON transactions.mcc = mcc_codes.mcc
-        WHERE mcc_codes.description = '{category}'
-        GROUP BY month
-        ORDER BY month ASC
-    """, conn)
-    df_cat['month'] = pd.to_datetime(df_cat['month'])
-    df_cat = df_cat.set_index('month')
-    df_cat.index = pd.DatetimeIndex(df_cat.index.values, freq='MS')
-    
-    train = df_cat[df_cat.index < '2019-01-01']
-    test  = df_cat[df_cat.index >= '2019-01-01']
-    
-    model = SARIMAX(df_cat['monthly_total'], order=(1, 1, 1), seasonal_order=(1, 1, 1, 12))
-    result = model.fit(disp=False)
-    future_mean = result.get_forecast(steps=12).predicted_mean
-    future_ci   = result.get_forecast(steps=12).conf_int()
-    
-    eval_model  = SARIMAX(train['monthly_total'], order=(1, 1, 1), seasonal_order=(1, 1, 1, 12))
-    eval_result = eval_model.fit(disp=False)
-    eval_mean   = eval_result.get_forecast(steps=len(test)).predicted_mean
-    mae  = mean_absolute_error(test['monthly_total'], eval_mean)
-    mape = (abs(test['monthly_total'] - eval_mean) / test['monthly_total']).mean() * 100
-    
-    return df_cat, future_mean, future_ci, mae, mape
+# Every category once `python forecast.py` (or precompute.py) has written the
+# forecasts table, otherwise (or if every fit failed) the ten busiest.
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_categories(version):
+    try:
+        categories = db.query(queries.FORECAST_CATEGORIES, (forecasting.TOTAL,))['series'].tolist()
+    except Exception as e:
+        if not db.missing_table(e):
+            raise
+        categories = []
+    return categories or db.query(queries.TOP_CATEGORIES)['description'].tolist()
 
 st.subheader('Forecast by Industry')
+if forecasting.ENGINE == 'ets':
+    st.caption('Category forecasts from the batch Holt-Winters engine (additive, damped trend, 12-month season).')
 
-categories = load_top_categories()
+categories = load_categories(version)
 selected = st.selectbox('Select a category', categories)
 
-df_cat, future_mean_cat, future_ci_cat, mae_cat, mape_cat = fit_category_model(selected)
+status_cat, error_cat, df_fc_cat, _ = forecast_state(selected)
+df_cat = load_series(selected, version)[0].to_frame()
+fit_notice(selected, status_cat, error_cat, df_fc_cat)
 
 fig_cat = go.Figure()
 fig_cat.add_trace(go.Scatter(
     x=df_cat.index, y=df_cat['monthly_total'],
     name='Actual', line=dict(color='steelblue')
 ))
-fig_cat.add_trace(go.Scatter(
-    x=future_mean_cat.index, y=future_mean_cat.values,
-    name='Forecast', line=dict(color='green')
-))
-fig_cat.add_trace(go.Scatter(
-    x=list(future_ci_cat.index) + list(future_ci_cat.index[::-1]),
-    y=list(future_ci_cat.iloc[:, 0]) + list(future_ci_cat.iloc[:, 1][::-1]),
-    fill='toself', fillcolor='rgba(0,200,100,0.15)',
-    line=dict(color='rgba(255,255,255,0)'),
-    name='95% Confidence Interval'
-))
-fig_cat.add_trace(go.Scatter(
-    x=[df_cat.index[-1], future_mean_cat.index[0]],
-    y=[df_cat['monthly_total'].iloc[-1], future_mean_cat.iloc[0]],
-    line=dict(color='green', dash='dash'),
-    showlegend=False
-))
+if not df_fc_cat.empty:
+    future_mean_cat, future_ci_cat = forecast_series(df_fc_cat)
+    fig_cat.add_trace(go.Scatter(
+        x=future_mean_cat.index, y=future_mean_cat.values,
+        name='Forecast', line=dict(color='green')
+    ))
+    fig_cat.add_trace(go.Scatter(
+        x=list(future_ci_cat.index) + list(future_ci_cat.index[::-1]),
+        y=list(future_ci_cat.iloc[:, 0]) + list(future_ci_cat.iloc[:, 1][::-1]),
+        fill='toself', fillcolor='rgba(0,200,100,0.15)',
+        line=dict(color='rgba(255,255,255,0)'),
+        name='95% Confidence Interval'
+    ))
+    fig_cat.add_trace(go.Scatter(
+        x=[df_cat.index[-1], future_mean_cat.index[0]],
+        y=[df_cat['monthly_total'].iloc[-1], future_mean_cat.iloc[0]],
+        line=dict(color='green', dash='dash'),
+        showlegend=False
+    ))
 fig_cat.update_layout(
     xaxis_title='Date',
     yaxis_title='Total Spend',
@@ -261,6 +269,53 @@ st.plotly_chart(fig_cat, width='stretch')
 
 col1, col2 = st.columns(2)
 with col1:
-    st.metric('MAE (2019 validation)', f"${mae_cat:,.0f}")
+    st.metric('MAE (2019 validation)', f"${df_fc_cat['mae'][0]:,.0f}" if not df_fc_cat.empty else '-')
 with col2:
-    st.metric('MAPE (2019 validation)', f"{mape_cat:.2f}%")
\ No newline at end of file
+    st.metric('MAPE (2019 validation)', f"{df_fc_cat['mape'][0]:.2f}%" if not df_fc_cat.empty else '-')
+
+# ── Backtest Chart ─────────────────────────────────────────────────────────────
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_backtest(series, version):
+    try:
+        return db.query(queries.SERIES_BACKTEST, (series,))
+    except Exception as e:
+        if not db.missing_table(e):
+            raise
+        return pd.DataFrame()
+
+df_bt_total = load_backtest(forecasting.TOTAL, version)
+df_bt_cat   = load_backtest(selected, version)
+
+if not df_bt_total.empty:
+    st.subheader('Forecast Error by Horizon')
+
+    fig_bt = go.Figure()
+    fig_bt.add_trace(go.Scatter(
+        x=df_bt_total['horizon'], y=df_bt_total['mape'],
+        name='Total', line=dict(color='steelblue')
+    ))
+    if not df_bt_cat.empty:
+        fig_bt.add_trace(go.Scatter(
+            x=df_bt_cat['horizon'], y=df_bt_cat['mape'],
+            name=selected, line=dict(color='green')
+        ))
+    fig_bt.update_layout(
+        xaxis_title='Months Ahead',
+        yaxis_title='MAPE (%)',
+        template='plotly_white',
+    )
+    st.plotly_chart(fig_bt, width='stretch')
+
+    st.write('Walk-forward validation: a 12 month forecast is made from every month after the first two years and scored against what actually happened. The model parameters are held fixed at the 2010–2018 fit.')
+
+# ── Background fits ────────────────────────────────────────────────────────────
+# While a model this run needed is still fitting, poll its status and rerun
+# the page once it lands. Everything above has already rendered.
+waiting = [series for series, state in [(forecasting.TOTAL, status), (selected, status_cat)] if state == 'fitting']
+if waiting:
+    @st.fragment(run_every=FIT_POLL_SECONDS)
+    def wait_for_fits():
+        if any(forecasting.fit_status(series, *load_series(series, version))[0] != 'fitting' for series in waiting):
+            st.rerun()
+
+    wait_for_fits()
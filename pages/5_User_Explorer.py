@@ -0,0 +1,100 @@
+import streamlit as st
+import plotly.graph_objects as go
+
+import db
+import disk_cache
+import profiling
+import queries
+import user_features
+
+st.markdown("""
+    <style>
+        .block-container {
+            padding-top: 2rem;
+            padding-bottom: 2rem;
+        }
+    </style>
+""", unsafe_allow_html=True)
+st.markdown("<h1 style='text-align: center;'>User Explorer</h1>", unsafe_allow_html=True)
+st.markdown("<h5 style='text-align: center;'>Spending, income and fraud exposure for an individual customer.</h5>", unsafe_allow_html=True)
+st.markdown("<p style='text-align: center; color: grey;'>by Yasith Senanayake</p>", unsafe_allow_html=True)
+
+version = db.data_version()
+
+# ── Data Loaders ───────────────────────────────────────────────────────────────
+# Everything here comes from the user_features table and the users x months
+# matrix precompute.py builds, so picking a user never touches transactions.
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_user_ids(version):
+    return db.query(queries.USER_IDS)['client_id'].tolist()
+
+@profiling.loader(st.cache_resource)
+def load_user_matrix(version):
+    return user_features.UserMatrix.load()
+
+@profiling.loader(disk_cache.tier(st.cache_data))
+def load_user(client_id, version):
+    return db.query(queries.USER_FEATURES, (client_id,))
+
+user_ids = load_user_ids(version)
+client_id = st.selectbox('Select a user', user_ids)
+
+df_user = load_user(client_id, version)
+df_history = load_user_matrix(version).history(client_id)
+
+# ── Metrics ────────────────────────────────────────────────────────────────────
+col1, col2, col3 = st.columns(3)
+with col1:
+    with st.container(border=True):
+        st.metric('Total Spent', f"${df_user['total_spent'][0]:,.2f}")
+        st.metric('Spend Rank', f"#{df_user['spend_rank'][0]:,} of {len(user_ids):,}")
+with col2:
+    with st.container(border=True):
+        st.metric('Avg Monthly Spending', f"${df_user['avg_monthly_spending'][0]:,.2f}")
+        st.metric('Monthly Income', f"${df_user['monthly_income'][0]:,.2f}")
+with col3:
+    with st.container(border=True):
+        st.metric('Income Spent', f"{df_user['pct_income_spent'][0]:.2f}%")
+        st.metric('Fraud Rate', f"{df_user['fraud_rate'][0]:.2f}%")
+
+st.write(f"Active in {df_user['active_months'][0]} of {df_user['total_months'][0]} months with "
+         f"{df_user['total_transactions'][0]:,} transactions. Averages count inactive months as zero spend.")
+
+# ── Chart: Monthly Spending and Running Total ──────────────────────────────────
+st.subheader('Monthly Spending')
+
+fig = go.Figure()
+fig.add_trace(go.Bar(
+    x=df_history['month'], y=df_history['monthly_spending'],
+    name='Monthly Spending', marker_color='steelblue'
+))
+fig.add_trace(go.Scatter(
+    x=df_history['month'], y=df_history['running_total'],
+    name='Running Total', line=dict(color='green'), yaxis='y2'
+))
+fig.update_layout(
+    xaxis_title='Date',
+    yaxis=dict(title='Monthly Spend', tickformat='.2s', tickprefix='$'),
+    yaxis2=dict(title='Running Total', tickformat='.2s', tickprefix='$', overlaying='y', side='right'),
+    template='plotly_white',
+    legend=dict(orientation='h', y=1.1),
+)
+st.plotly_chart(fig, width='stretch')
+
+# ── Chart: Month-on-Month Change ───────────────────────────────────────────────
+st.subheader('Month-on-Month Change')
+
+colors = ['seagreen' if v >= 0 else 'indianred' for v in df_history['month_on_month_change'].fillna(0)]
+fig_change = go.Figure(go.Bar(
+    x=df_history['month'], y=df_history['month_on_month_change'],
+    marker_color=colors
+))
+fig_change.update_layout(
+    xaxis_title='Date',
+    yaxis_title='Change in Spend',
+    yaxis_tickformat='.2s',
+    yaxis_tickprefix='$',
+    template='plotly_white',
+)
+st.plotly_chart(fig_change, width='stretch')
+st.write('Change against the previous calendar month, with months without transactions counted as zero spend.')
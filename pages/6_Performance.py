@@ -0,0 +1,95 @@
+import time
+
+import streamlit as st
+
+import profiling
+import warmup
+
+st.markdown("""
+    <style>
+        .block-container {
+            padding-top: 2rem;
+            padding-bottom: 2rem;
+        }
+    </style>
+""", unsafe_allow_html=True)
+st.markdown("<h1 style='text-align: center;'>Performance</h1>", unsafe_allow_html=True)
+st.markdown("<h5 style='text-align: center;'>Loader latency, cache hit rates and the slowest queries and model fits since the server started.</h5>", unsafe_allow_html=True)
+
+# ── Controls ───────────────────────────────────────────────────────────────────
+# Kept under a plain session key rather than the widget's own, which Streamlit
+# drops as soon as another page is shown
+col1, col2, col3 = st.columns(3)
+with col1:
+    st.session_state.profile_pages = st.toggle(
+        'Profile my page runs with cProfile', value=st.session_state.get('profile_pages', False),
+        help='Captures every page this session runs from now on. Results appear under Profiles below.',
+    )
+with col2:
+    st.download_button('Export as JSON', profiling.export_json(), file_name='performance.json',
+                       mime='application/json')
+with col3:
+    if st.button('Clear'):
+        profiling.clear()
+        st.rerun()
+
+if not profiling.ENABLED:
+    st.warning('Recording is off because the server was started with FINANCE_PROFILE=0.')
+
+# ── Warm-up ────────────────────────────────────────────────────────────────────
+st.subheader('Warm-up')
+report = warmup.report()
+col1, col2 = st.columns(2)
+with col1:
+    st.metric('Time to first render', f"{report['first_render']:.2f}s" if report['first_render'] is not None else '-')
+with col2:
+    st.metric('Time to fully warm', f"{report['warm']:.2f}s" if report['warm'] is not None else '-')
+if report['pages']:
+    st.dataframe(report['pages'], hide_index=True, width='stretch')
+st.write('Both are measured from server start under `python app.py`, or from the first session under `streamlit run app.py`.')
+
+# ── Loaders ────────────────────────────────────────────────────────────────────
+st.subheader('Loaders')
+df_loaders = profiling.loader_summary()
+if df_loaders.empty:
+    st.info('No loader calls recorded yet. Open the other pages to populate this one.')
+else:
+    st.dataframe(df_loaders, hide_index=True, width='stretch')
+    st.write('Latency covers every call, cache hits included. miss_p95_ms is what a call pays when the cache is cold.')
+
+# ── Page Runs ──────────────────────────────────────────────────────────────────
+st.subheader('Page Runs')
+df_pages = profiling.page_summary()
+if not df_pages.empty:
+    st.dataframe(df_pages, hide_index=True, width='stretch')
+
+# ── Slowest Queries ────────────────────────────────────────────────────────────
+st.subheader('Slowest Queries')
+df_queries = profiling.slowest('query')
+if not df_queries.empty:
+    st.dataframe(df_queries, hide_index=True, width='stretch')
+    st.write('full_scan marks a plan that reads a stored table or index in full rather than searching it.')
+
+    statements = df_queries['name'].drop_duplicates().tolist()
+    sql = st.selectbox('Query plan for', statements, format_func=lambda s: ' '.join(s.split())[:120])
+    st.code(profiling.plan_for(sql) or 'No plan recorded.', language='text')
+
+# ── Slowest Model Fits ─────────────────────────────────────────────────────────
+st.subheader('Slowest Model Fits')
+df_fits = profiling.slowest('fit')
+if df_fits.empty:
+    st.write('No SARIMAX fits in this server process. Forecasts are normally loaded from precomputed artifacts.')
+else:
+    st.dataframe(df_fits.drop(columns=['bytes', 'full_scan']), hide_index=True, width='stretch')
+
+# ── Profiles ───────────────────────────────────────────────────────────────────
+st.subheader('Profiles')
+runs = profiling.profiles()
+if not runs:
+    st.write('Turn on profiling above, then open a page.')
+else:
+    runs = runs[::-1]
+    labels = [f"{run['page']} at {time.strftime('%H:%M:%S', time.localtime(run['at']))} ({run['seconds']:.2f}s)"
+              for run in runs]
+    i = st.selectbox('Page run', range(len(runs)), format_func=lambda i: labels[i])
+    st.code(runs[i]['stats'], language='text')
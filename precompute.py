@@ -1,72 +1,140 @@
-import sqlite3
-import pandas as pd
+import argparse
 
-conn = sqlite3.connect('data/finance.db')
+import db
+import forecasting
+import jobs
+import trends
+import user_features
 
-# # Fraud rate by error type
-# df_fraud_error = pd.read_sql_query("""
-#     SELECT 
-#         t.errors,
-#         COUNT(*) AS total_transactions,
-#         SUM(CASE WHEN f.is_fraud = 'Yes' THEN 1 ELSE 0 END) AS fraud_count,
-#         ROUND(100.0 * SUM(CASE WHEN f.is_fraud = 'Yes' THEN 1 ELSE 0 END) / COUNT(*), 2) AS fraud_rate
-#     FROM transactions t
-#     LEFT JOIN fraud_labels f ON t.id = f.transaction_idpytho
-#     GROUP BY t.errors
-#     HAVING COUNT(*) >= 1000
-#     ORDER BY fraud_rate DESC
-# """, conn)
-# df_fraud_error.to_csv('data/fraud_by_error.csv', index=False)
-# print('Done - fraud_by_error.csv saved')
+parser = argparse.ArgumentParser(description='Build the rollup table and the precomputed fraud CSVs.')
+parser.add_argument('--incremental', action='store_true',
+                    help='fold only transactions added since the last run into the rollup')
+parser.add_argument('--skip-forecasts', action='store_true',
+                    help='do not fit the Forecasting page models')
+parser.add_argument('--force', action='store_true',
+                    help='rebuild every precomputed artifact, even those whose inputs are unchanged')
+args = parser.parse_args()
 
+# ── Rollup cube ────────────────────────────────────────────────────────────────
+# One scan of transactions aggregated to month × mcc × error flags × fraud
+# flag (1, 0, or NULL when unlabelled). Every page aggregate and fraud CSV below
+# is a slice of this table, so nothing else needs to touch the raw rows.
+# Scoped to an id range so an incremental run only reads the new rows.
+ROLLUP_SQL = """
+    SELECT
+        t.month,
+        t.mcc,
+        t.error_mask,
+        f.is_fraud,
+        CAST(COUNT(*) AS BIGINT) AS n,
+        CAST(SUM(t.amount_cents) AS BIGINT) AS sum_cents,
+        SUM(CAST(t.amount_cents AS DOUBLE) * t.amount_cents) AS sum_sq_cents,
+        MIN(t.amount_cents) AS min_cents,
+        MAX(t.amount_cents) AS max_cents
+    FROM transactions t
+    LEFT JOIN fraud_labels f ON t.id = f.transaction_id
+    WHERE t.id > {after_id} AND t.id <= {up_to_id}
+    GROUP BY t.month, t.mcc, t.error_mask, f.is_fraud
+"""
 
-# # Fraud rate over time
-# df_fraud_time = pd.read_sql_query("""
-#     SELECT 
-#         strftime('%Y-%m', t.date) AS month,
-#         COUNT(*) AS total_transactions,
-#         SUM(CASE WHEN f.is_fraud = 'Yes' THEN 1 ELSE 0 END) AS fraud_count,
-#         ROUND(100.0 * SUM(CASE WHEN f.is_fraud = 'Yes' THEN 1 ELSE 0 END) / COUNT(*), 2) AS fraud_rate
-#     FROM transactions t
-#     LEFT JOIN fraud_labels f ON t.id = f.transaction_id
-#     GROUP BY month
-#     ORDER BY month ASC
-# """, conn)
-# df_fraud_time.to_csv('data/fraud_over_time.csv', index=False)
-# print('Done - fraud_over_time.csv saved')
+# Every rollup measure can be combined cell by cell, so merging a delta is one
+# more GROUP BY over the existing cube plus the new cells.
+MERGE_SQL = """
+    SELECT
+        month,
+        mcc,
+        error_mask,
+        is_fraud,
+        CAST(SUM(n) AS BIGINT) AS n,
+        CAST(SUM(sum_cents) AS BIGINT) AS sum_cents,
+        SUM(sum_sq_cents) AS sum_sq_cents,
+        MIN(min_cents) AS min_cents,
+        MAX(max_cents) AS max_cents
+    FROM (
+        SELECT * FROM rollup
+        UNION ALL
+        {delta}
+    ) AS cells
+    GROUP BY month, mcc, error_mask, is_fraud
+"""
 
-# # Fraud vs non-fraud amounts
-# df_fraud_amounts = pd.read_sql_query("""
-#     SELECT 
-#         f.is_fraud,
-#         ROUND(AVG(CAST(REPLACE(t.amount, '$', '') AS REAL)), 2) AS avg_amount,
-#         ROUND(MIN(CAST(REPLACE(t.amount, '$', '') AS REAL)), 2) AS min_amount,
-#         ROUND(MAX(CAST(REPLACE(t.amount, '$', '') AS REAL)), 2) AS max_amount
-#     FROM transactions t
-#     LEFT JOIN fraud_labels f ON t.id = f.transaction_id
-#     WHERE f.is_fraud IS NOT NULL
-#     GROUP BY f.is_fraud
-# """, conn)
-# df_fraud_amounts.to_csv('data/fraud_amounts.csv', index=False)
-# print('Done - fraud_amounts.csv saved')
+ROLLUP_INDEXES = [
+    'CREATE INDEX idx_rollup_mcc_month ON rollup (mcc, month)',
+    'CREATE INDEX idx_rollup_month ON rollup (month)',
+]
 
+# (table, SQL over an id range, SQL merging a delta into the table, indexes)
+# for the tables built straight from transactions
+TABLES = [
+    ('rollup', ROLLUP_SQL, MERGE_SQL, ROLLUP_INDEXES),
+    ('user_months', user_features.USER_MONTHS_SQL, user_features.USER_MONTHS_MERGE_SQL,
+     user_features.USER_MONTHS_INDEXES),
+    ('daily_rollup', trends.DAILY_ROLLUP_SQL, trends.DAILY_ROLLUP_MERGE_SQL, trends.DAILY_ROLLUP_INDEXES),
+]
 
-# Fraud rate by merchant category
-df_fraud_category = pd.read_sql_query("""
-    SELECT 
-        mcc_codes.description,
-        COUNT(*) AS total_transactions,
-        SUM(CASE WHEN f.is_fraud = 'Yes' THEN 1 ELSE 0 END) AS fraud_count,
-        ROUND(100.0 * SUM(CASE WHEN f.is_fraud = 'Yes' THEN 1 ELSE 0 END) / COUNT(*), 2) AS fraud_rate
-    FROM transactions t
-    LEFT JOIN fraud_labels f ON t.id = f.transaction_id
-    LEFT JOIN mcc_codes ON t.mcc = mcc_codes.mcc
-    WHERE mcc_codes.description IS NOT NULL
-    GROUP BY mcc_codes.description
-    HAVING COUNT(*) >= 1000
-    ORDER BY fraud_rate DESC
-""", conn)
-df_fraud_category.to_csv('data/fraud_by_category.csv', index=False)
-print('Done - fraud_by_category.csv saved')
+# The highest id, taken from the end of the id order: a bare MAX(id) cannot
+# be answered from the rowid trees once transactions is a view over year
+# partitions and scans every row instead. NULL with no transactions, which
+# builds empty tables under a zero watermark.
+up_to_id = int(db.query(
+    'SELECT MAX(id) AS max_id FROM (SELECT id FROM transactions ORDER BY id DESC LIMIT 1) AS last'
+)['max_id'].fillna(0)[0])
+
+if args.incremental:
+    version = db.data_version()
+    if version is None:
+        raise SystemExit('No rollup to update yet - run `python precompute.py` once without --incremental')
+    if up_to_id <= version:
+        print(f'Nothing to do - no transactions after id {version:,}')
+        raise SystemExit(0)
+    # Each table carries its own watermark, swapped in with its rows, so a run
+    # stopped between two merges picks every table up where it left off
+    # rather than merging the same transactions twice. Tables from before
+    # per-table watermarks start from the data version.
+    for name, sql, merge_sql, indexes in TABLES:
+        after_id = db.watermark(name)
+        if after_id is None:
+            after_id = version
+        if after_id >= up_to_id:
+            print(f'Skipped - {name} already has transactions up to {after_id:,}')
+            continue
+        db.materialize(name, merge_sql.format(delta=sql.format(after_id=after_id, up_to_id=up_to_id)),
+                       indexes=indexes, watermark=up_to_id)
+        print(f'Done - {name} updated with transactions {after_id + 1:,} to {up_to_id:,}')
+else:
+    for name, sql, _, indexes in TABLES:
+        db.materialize(name, sql.format(after_id=0, up_to_id=up_to_id), indexes=indexes, watermark=up_to_id)
+    print('Done - rollup, user_months and daily_rollup tables built')
+
+# ── User features ──────────────────────────────────────────────────────────────
+# Per-client metrics and the dense users x months matrix behind the User
+# Explorer page, derived from user_months (a row per client and month) so
+# they never rescan transactions.
+user_months = db.query('SELECT * FROM user_months')
+users = db.query('SELECT id, yearly_income FROM users')
+db.store('user_features', user_features.build_features(user_months, users),
+         indexes=user_features.USER_FEATURES_INDEXES)
+user_features.save_matrix(*user_features.build_matrix(user_months))
+print('Done - user_features table and user matrix saved')
+
+# The watermark doubles as the data version the pages cache against
+db.materialize('rollup_watermark', f'SELECT {up_to_id} AS max_id')
+
+# ── Artifacts ──────────────────────────────────────────────────────────────────
+# The fraud CSVs and any other job declared in jobs.JOBS, run concurrently.
+# A job whose inputs have not changed since its last build is skipped.
+report = jobs.run(jobs.JOBS, force=args.force)
+for job in report.itertuples():
+    detail = f'{job.rows:,.0f} rows in {job.seconds:.2f}s' if job.status == 'built' else job.error or 'unchanged'
+    print(f'{job.status.capitalize()} - {job.output} ({detail})')
+if report['status'].isin(['failed', 'blocked']).any():
+    raise SystemExit('Some precompute jobs failed, see above')
 
-conn.close()
\ No newline at end of file
+# ── Forecasts ──────────────────────────────────────────────────────────────────
+# Fits the total and every category into data/models and the forecasts table,
+# so no visitor waits on a fit. Series that have not changed since the last
+# run keep their stored model. `python forecast.py` runs this stage alone.
+if not args.skip_forecasts:
+    report = forecasting.run_batch()
+    fitted = (report['status'] != 'cached').sum()
+    print(f'Done - {fitted} of {len(report)} forecast models refitted, see {forecasting.REPORT_PATH}')
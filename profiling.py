@@ -0,0 +1,245 @@
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+# Every database call, model fit, page loader and page run is timed into an
+# in-process ring buffer, which the Performance page summarises. Set
+# FINANCE_PROFILE=0 to stop recording; timing itself costs microseconds and
+# EXPLAIN runs once per distinct statement.
+ENABLED = os.environ.get('FINANCE_PROFILE', '1') != '0'
+
+# The Performance page is only added to the navigation with FINANCE_ADMIN=1
+ADMIN = os.environ.get('FINANCE_ADMIN') == '1'
+
+MAX_EVENTS    = 20_000
+MAX_PROFILES  = 20
+PROFILE_LINES = 40
+
+_events   = deque(maxlen=MAX_EVENTS)
+_profiles = deque(maxlen=MAX_PROFILES)
+_plans    = {}
+
+# Only one cProfile profiler can be active per process
+_profiler_lock = threading.Lock()
+
+# The page and loader a call is made from. Streamlit runs each script run in
+# its own thread, so these never leak between sessions.
+_page   = contextvars.ContextVar('page', default=None)
+_loader = contextvars.ContextVar('loader', default=None)
+
+
+# ── Recording ──────────────────────────────────────────────────────────────────
+@contextlib.contextmanager
+def timed(kind, name, **fields):
+    # Times the block and records it as one event. The block may add fields
+    # (rows, bytes, ...) to the yielded dict.
+    event = {'kind': kind, 'name': name, 'page': _page.get(), 'loader': _loader.get(), **fields}
+    started = time.perf_counter()
+    try:
+        yield event
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        event['error'] = type(e).__name__
+        raise
+    finally:
+        event['seconds'] = time.perf_counter() - started
+        event['at'] = time.time()
+        if ENABLED:
+            _events.append(event)
+
+
+def record(kind, name, seconds, **fields):
+    # An event timed somewhere timed() cannot wrap, such as a fit that ran in
+    # a worker process
+    if ENABLED:
+        _events.append({'kind': kind, 'name': name, 'page': _page.get(), 'loader': _loader.get(),
+                        **fields, 'seconds': seconds, 'at': time.time()})
+
+
+def frame_size(df):
+    # (rows, bytes) of a DataFrame result, strings included
+    return len(df), int(df.memory_usage(index=False, deep=True).sum())
+
+
+def plan(backend, sql, params=()):
+    # (plan text, full scans) for `sql`, from the backend's EXPLAIN. Cached
+    # per statement text, so a loader called with new parameters reuses it.
+    if not ENABLED:
+        return None, []
+    key = (backend.name, sql)
+    if key not in _plans:
+        try:
+            _plans[key] = backend.explain(sql, params)
+        except Exception as e:
+            # Not cached: the table may exist by the next call
+            return f'EXPLAIN failed: {e}', []
+    return _plans[key]
+
+
+def loader(cache):
+    # Used in place of a page loader's cache decorator:
+    #
+    #   @profiling.loader(st.cache_data)
+    #   def load_metrics(version): ...
+    #
+    # Every call is timed. The function body only runs on a cache miss, which
+    # is how hits are told apart, and db calls and fits made from it are
+    # attributed to the loader.
+    def decorate(fn):
+        state = threading.local()
+
+        @functools.wraps(fn)
+        def body(*args, **kwargs):
+            state.miss = True
+            return fn(*args, **kwargs)
+        cached = cache(body)
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            state.miss = False
+            token = _loader.set(fn.__name__)
+            try:
+                with timed('loader', fn.__name__) as event:
+                    result = cached(*args, **kwargs)
+                    event['cache'] = 'miss' if state.miss else 'hit'
+                    if isinstance(result, pd.DataFrame):
+                        event['rows'], event['bytes'] = frame_size(result)
+            finally:
+                _loader.reset(token)
+            return result
+        call.clear = cached.clear
+        return call
+    return decorate
+
+
+@contextlib.contextmanager
+def page_run(name, profile=False):
+    # Wraps one run of a page script. With profile=True the run is also
+    # captured with cProfile, unless another run is being profiled already.
+    token = _page.set(name)
+    profiler = None
+    if profile and ENABLED and _profiler_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool (a debugger, coverage) owns the hook
+            _profiler_lock.release()
+            profiler = None
+    try:
+        with timed('page', name) as event:
+            yield event
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profiler_lock.release()
+            _profiles.append({'page': name, 'at': time.time(), 'seconds': event['seconds'],
+                              'stats': _stats_text(profiler)})
+        _page.reset(token)
+
+
+def _stats_text(profiler):
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return out.getvalue()
+
+
+def clear():
+    _events.clear()
+    _profiles.clear()
+    _plans.clear()
+
+
+# ── Summaries ──────────────────────────────────────────────────────────────────
+def events(kind=None):
+    df = pd.DataFrame(list(_events))
+    if df.empty:
+        return df
+    for column in ['page', 'loader', 'rows', 'bytes', 'cache', 'error', 'full_scans']:
+        if column not in df:
+            df[column] = None
+    df['at'] = pd.to_datetime(df['at'], unit='s')
+    return df[df['kind'] == kind].reset_index(drop=True) if kind else df
+
+
+def _percentiles(df, by):
+    seconds = df.groupby(by, dropna=False)['seconds']
+    return pd.DataFrame({
+        'calls': seconds.size(),
+        'p50_ms': seconds.quantile(0.5) * 1000,
+        'p95_ms': seconds.quantile(0.95) * 1000,
+        'max_ms': seconds.max() * 1000,
+    })
+
+
+def loader_summary():
+    # p50/p95 per loader over all calls, with the cache hit rate and the
+    # latency of misses, which is what a cold session pays
+    df = events('loader')
+    if df.empty:
+        return df
+    summary = _percentiles(df, ['page', 'name'])
+    misses = df[df['cache'] == 'miss']
+    summary['hit_rate'] = df.groupby(['page', 'name'], dropna=False)['cache'].apply(lambda c: (c == 'hit').mean() * 100)
+    summary['miss_p95_ms'] = misses.groupby(['page', 'name'], dropna=False)['seconds'].quantile(0.95) * 1000
+    summary['rows'] = misses.groupby(['page', 'name'], dropna=False)['rows'].last()
+    return summary.reset_index().sort_values('p95_ms', ascending=False, ignore_index=True).round(2)
+
+
+def page_summary():
+    df = events('page')
+    if df.empty:
+        return df
+    return _percentiles(df, 'name').reset_index().sort_values('p95_ms', ascending=False, ignore_index=True).round(2)
+
+
+def slowest(kind='query', n=20):
+    # The n slowest single calls, with a flag for plans that scan a table in full
+    df = events(kind)
+    if df.empty:
+        return df
+    df = df.sort_values('seconds', ascending=False).head(n).reset_index(drop=True)
+    df['ms'] = (df['seconds'] * 1000).round(2)
+    df['full_scan'] = df['full_scans'].apply(lambda scans: bool(scans) if isinstance(scans, list) else False)
+    return df[['at', 'page', 'loader', 'name', 'ms', 'rows', 'bytes', 'full_scan', 'error']]
+
+
+def plan_for(sql):
+    # Cached plan text for a statement, whichever backend ran it
+    for (_, statement), (text, _) in _plans.items():
+        if statement == sql:
+            return text
+    return None
+
+
+def profiles():
+    return list(_profiles)
+
+
+def export_json():
+    # Everything the Performance page shows, plus the raw events
+    def records(df):
+        return json.loads(df.to_json(orient='records', date_format='iso')) if not df.empty else []
+
+    return json.dumps({
+        'exported_at': pd.Timestamp.now().isoformat(),
+        'loaders': records(loader_summary()),
+        'pages': records(page_summary()),
+        'slowest_queries': records(slowest('query')),
+        'slowest_fits': records(slowest('fit')),
+        'plans': [{'backend': backend, 'sql': sql, 'plan': text, 'full_scans': scans}
+                  for (backend, sql), (text, scans) in _plans.items()],
+        'profiles': profiles(),
+        'events': records(events()),
+    }, indent=2, default=str)
@@ -0,0 +1,319 @@
+# SQL behind the page loaders. Kept to the dialect SQLite and DuckDB share, so
+# every backend in db.py runs exactly the same text.
+#
+# Aggregates read the `rollup` cube built by precompute.py (one row per month,
+# mcc, error pattern and fraud flag) rather than the 13M-row transactions table.
+# Distinct users come from user_months (one row per client and month), so no
+# page query scans the raw table.
+#
+# Page aggregates take the dashboard's date range as `month BETWEEN ? AND ?`
+# over YYYYMM keys (trends.month_range), so only the months in view are read,
+# as an index range of those tables. Callers that want the whole history pass
+# ALL_MONTHS.
+ALL_MONTHS = (0, 999912)
+
+# ── Spending Overview ──────────────────────────────────────────────────────────
+# Both headline totals in one pass over the rollup. The page fuses this with
+# UNIQUE_USERS (db.fuse) so all three metrics come back from one statement.
+ROLLUP_TOTALS = """
+    SELECT
+        SUM(sum_cents) / 100.0 AS total_spent,
+        SUM(n) AS transaction_count
+    FROM rollup
+    WHERE month BETWEEN ? AND ?
+"""
+
+# Answered from user_months' (month, client_id) index
+UNIQUE_USERS = """
+    SELECT COUNT(DISTINCT client_id) AS unique_users
+    FROM user_months
+    WHERE month BETWEEN ? AND ?
+"""
+
+MONTHLY_TOTALS = """
+    SELECT
+        month,
+        SUM(sum_cents) / 100.0 AS monthly_total
+    FROM rollup
+    WHERE month BETWEEN ? AND ?
+    GROUP BY month
+    ORDER BY month ASC
+"""
+
+# Day and week trend charts: only the days of the visible range (plus the
+# moving average warm-up) are read from the daily_rollup table
+DAILY_TOTALS = """
+    SELECT
+        day,
+        SUM(sum_cents) / 100.0 AS total
+    FROM daily_rollup
+    WHERE day BETWEEN ? AND ?
+    GROUP BY day
+    ORDER BY day ASC
+"""
+
+# Separate subqueries so SQLite answers each from one end of the day index
+DAY_RANGE = """
+    SELECT
+        (SELECT MIN(day) FROM daily_rollup) AS first_day,
+        (SELECT MAX(day) FROM daily_rollup) AS last_day
+"""
+
+# ── Spending by Category ───────────────────────────────────────────────────────
+# Aggregating by mcc first keeps the join to ~100 per-mcc rows.
+TOP_BY_VOLUME = """
+    WITH by_mcc AS (
+        SELECT mcc, SUM(n) AS n, SUM(sum_cents) AS cents
+        FROM rollup
+        WHERE month BETWEEN ? AND ?
+        GROUP BY mcc
+    )
+    SELECT
+        mcc_codes.description,
+        SUM(by_mcc.n) AS number_transactions,
+        SUM(by_mcc.cents) / 100.0 AS total_spent,
+        ROUND(SUM(by_mcc.cents) / 100.0 / SUM(by_mcc.n), 2) AS avg_transaction
+    FROM by_mcc
+    LEFT JOIN mcc_codes ON by_mcc.mcc = mcc_codes.mcc
+    GROUP BY mcc_codes.description
+    ORDER BY number_transactions DESC, mcc_codes.description ASC
+    LIMIT 10
+"""
+
+TOP_BY_AVG = """
+    WITH by_mcc AS (
+        SELECT mcc, SUM(n) AS n, SUM(sum_cents) AS cents
+        FROM rollup
+        WHERE month BETWEEN ? AND ?
+        GROUP BY mcc
+    )
+    SELECT
+        mcc_codes.description,
+        SUM(by_mcc.n) AS number_transactions,
+        SUM(by_mcc.cents) / 100.0 AS total_spent,
+        ROUND(SUM(by_mcc.cents) / 100.0 / SUM(by_mcc.n), 2) AS avg_transaction
+    FROM by_mcc
+    LEFT JOIN mcc_codes ON by_mcc.mcc = mcc_codes.mcc
+    GROUP BY mcc_codes.description
+    ORDER BY avg_transaction DESC, mcc_codes.description ASC
+    LIMIT 10
+"""
+
+# CROSS JOIN pins SQLite's join order so only this category's slice of the
+# rollup's (mcc, month) index is read. Also used by the Forecasting page.
+CATEGORY_MONTHLY_TOTALS = """
+    SELECT
+        r.month,
+        SUM(r.sum_cents) / 100.0 AS monthly_total
+    FROM mcc_codes
+    CROSS JOIN rollup r
+    WHERE r.mcc = mcc_codes.mcc
+    AND mcc_codes.description = ?
+    AND r.month BETWEEN ? AND ?
+    GROUP BY r.month
+    ORDER BY r.month ASC
+"""
+
+CATEGORY_DAILY_TOTALS = """
+    SELECT
+        d.day,
+        SUM(d.sum_cents) / 100.0 AS total
+    FROM mcc_codes
+    CROSS JOIN daily_rollup d
+    WHERE d.mcc = mcc_codes.mcc
+    AND mcc_codes.description = ?
+    AND d.day BETWEEN ? AND ?
+    GROUP BY d.day
+    ORDER BY d.day ASC
+"""
+
+ALL_CATEGORIES = """
+    SELECT DISTINCT mcc_codes.description
+    FROM (SELECT DISTINCT mcc FROM rollup) AS used
+    JOIN mcc_codes ON used.mcc = mcc_codes.mcc
+    ORDER BY mcc_codes.description ASC
+"""
+
+# ── Error & Fraud Analysis ─────────────────────────────────────────────────────
+# Transactions with exactly one error: their error_mask equals a single flag
+ERROR_DISTRIBUTION = """
+    SELECT
+        error_flags.name AS errors,
+        SUM(r.n) AS transaction_count
+    FROM rollup r
+    JOIN error_flags ON r.error_mask = error_flags.flag
+    WHERE r.month BETWEEN ? AND ?
+    GROUP BY error_flags.name
+    ORDER BY transaction_count DESC, errors ASC
+    LIMIT 10
+"""
+
+# Every transaction carrying the flag, alone or alongside others
+FRAUD_BY_FLAG = """
+    SELECT
+        error_flags.name AS error,
+        SUM(r.n) AS total_transactions,
+        IFNULL(SUM(r.n * r.is_fraud), 0) AS fraud_count,
+        ROUND(100.0 * IFNULL(SUM(r.n * r.is_fraud), 0) / SUM(r.n), 2) AS fraud_rate
+    FROM rollup r
+    JOIN error_flags ON (r.error_mask & error_flags.flag) != 0
+    WHERE r.month BETWEEN ? AND ?
+    GROUP BY error_flags.flag, error_flags.name
+    ORDER BY fraud_rate DESC, total_transactions DESC
+"""
+
+# Each transaction under its highest-priority error. Flags are numbered in
+# priority order, so that is the lowest set bit of error_mask.
+FRAUD_BY_PRIMARY_ERROR = """
+    SELECT
+        IFNULL(error_flags.name, 'Clean') AS primary_error,
+        SUM(r.n) AS total_transactions,
+        IFNULL(SUM(r.n * r.is_fraud), 0) AS fraud_count,
+        ROUND(100.0 * IFNULL(SUM(r.n * r.is_fraud), 0) / SUM(r.n), 2) AS fraud_rate
+    FROM rollup r
+    LEFT JOIN error_flags ON error_flags.flag = (r.error_mask & -r.error_mask)
+    WHERE r.month BETWEEN ? AND ?
+    GROUP BY primary_error
+    ORDER BY fraud_rate DESC, total_transactions DESC
+"""
+
+# Every combination of flags that includes all the flags in mask `?`
+FRAUD_BY_COMBINATION = """
+    SELECT
+        error_mask,
+        SUM(n) AS total_transactions,
+        IFNULL(SUM(n * is_fraud), 0) AS fraud_count
+    FROM rollup
+    WHERE (error_mask & ?) = ?
+    AND month BETWEEN ? AND ?
+    GROUP BY error_mask
+    ORDER BY total_transactions DESC, error_mask
+"""
+
+# The page's fraud breakdowns. precompute.py writes them over ALL_MONTHS to
+# the fraud CSVs (jobs.JOBS); the page queries the rollup directly for any
+# narrower range.
+FRAUD_BY_ERROR = """
+    SELECT
+        error_mask,
+        SUM(n) AS total_transactions,
+        IFNULL(SUM(n * is_fraud), 0) AS fraud_count,
+        ROUND(100.0 * IFNULL(SUM(n * is_fraud), 0) / SUM(n), 2) AS fraud_rate
+    FROM rollup
+    WHERE month BETWEEN ? AND ?
+    GROUP BY error_mask
+    HAVING SUM(n) >= 1000
+    ORDER BY fraud_rate DESC, total_transactions DESC, error_mask
+"""
+
+FRAUD_AMOUNTS = """
+    SELECT
+        CASE WHEN is_fraud = 1 THEN 'Yes' ELSE 'No' END AS is_fraud,
+        ROUND(SUM(sum_cents) / 100.0 / SUM(n), 2) AS avg_amount,
+        ROUND(MIN(min_cents) / 100.0, 2) AS min_amount,
+        ROUND(MAX(max_cents) / 100.0, 2) AS max_amount
+    FROM rollup
+    WHERE is_fraud IS NOT NULL
+    AND month BETWEEN ? AND ?
+    GROUP BY is_fraud
+    ORDER BY is_fraud ASC
+"""
+
+FRAUD_BY_CATEGORY = """
+    SELECT
+        mcc_codes.description,
+        SUM(r.n) AS total_transactions,
+        IFNULL(SUM(r.n * r.is_fraud), 0) AS fraud_count,
+        ROUND(100.0 * IFNULL(SUM(r.n * r.is_fraud), 0) / SUM(r.n), 2) AS fraud_rate
+    FROM rollup r
+    JOIN mcc_codes ON r.mcc = mcc_codes.mcc
+    WHERE r.month BETWEEN ? AND ?
+    GROUP BY mcc_codes.description
+    HAVING SUM(r.n) >= 1000
+    ORDER BY fraud_rate DESC, total_transactions DESC, mcc_codes.description
+"""
+
+# ── Forecasting ────────────────────────────────────────────────────────────────
+TOP_CATEGORIES = """
+    WITH by_mcc AS (
+        SELECT mcc, SUM(n) AS total_transactions
+        FROM rollup
+        GROUP BY mcc
+    )
+    SELECT
+        mcc_codes.description,
+        SUM(by_mcc.total_transactions) AS total_transactions
+    FROM by_mcc
+    LEFT JOIN mcc_codes ON by_mcc.mcc = mcc_codes.mcc
+    GROUP BY mcc_codes.description
+    ORDER BY total_transactions DESC
+    LIMIT 10
+"""
+
+# Every category's monthly series in one pass, for the batch forecasts
+ALL_CATEGORY_MONTHLY_TOTALS = """
+    SELECT
+        mcc_codes.description AS category,
+        r.month,
+        SUM(r.sum_cents) / 100.0 AS monthly_total
+    FROM rollup r
+    JOIN mcc_codes ON r.mcc = mcc_codes.mcc
+    GROUP BY mcc_codes.description, r.month
+    ORDER BY category ASC, r.month ASC
+"""
+
+# The `forecasts` table is written by `python forecast.py`. The total
+# series is stored alongside the categories, under forecasting.TOTAL.
+FORECAST_CATEGORIES = """
+    SELECT DISTINCT series
+    FROM forecasts
+    WHERE series != ?
+    ORDER BY series ASC
+"""
+
+SERIES_FORECAST = """
+    SELECT month, forecast, lower, upper, mae, mape, converged
+    FROM forecasts
+    WHERE series = ?
+    ORDER BY month ASC
+"""
+
+# Rolling-origin error by forecast horizon, also written by `python forecast.py`
+SERIES_BACKTEST = """
+    SELECT horizon, origins, mae, mape, rmse
+    FROM backtests
+    WHERE series = ?
+    ORDER BY horizon ASC
+"""
+
+# ── User Explorer ──────────────────────────────────────────────────────────────
+# user_features holds one row per client, built by precompute.py
+USER_IDS = "SELECT client_id FROM user_features ORDER BY client_id ASC"
+
+USER_FEATURES = "SELECT * FROM user_features WHERE client_id = ?"
+
+USER_COUNT = "SELECT COUNT(*) AS n FROM user_features"
+
+# Every query a page runs, for comparing backends. Queries take a category
+# description for `description = ?`, a day range for `day BETWEEN ? AND ?`
+# and a month range for `month BETWEEN ? AND ?`.
+PAGE_QUERIES = {
+    'rollup_totals': ROLLUP_TOTALS,
+    'unique_users': UNIQUE_USERS,
+    'monthly_totals': MONTHLY_TOTALS,
+    'daily_totals': DAILY_TOTALS,
+    'day_range': DAY_RANGE,
+    'top_by_volume': TOP_BY_VOLUME,
+    'top_by_avg': TOP_BY_AVG,
+    'category_monthly_totals': CATEGORY_MONTHLY_TOTALS,
+    'category_daily_totals': CATEGORY_DAILY_TOTALS,
+    'all_categories': ALL_CATEGORIES,
+    'error_distribution': ERROR_DISTRIBUTION,
+    'fraud_by_flag': FRAUD_BY_FLAG,
+    'fraud_by_primary_error': FRAUD_BY_PRIMARY_ERROR,
+    'fraud_by_error': FRAUD_BY_ERROR,
+    'fraud_amounts': FRAUD_AMOUNTS,
+    'fraud_by_category': FRAUD_BY_CATEGORY,
+    'top_categories': TOP_CATEGORIES,
+    'all_category_monthly_totals': ALL_CATEGORY_MONTHLY_TOTALS,
+}
@@ -1,40 +1,676 @@
-import pandas as pd
-import sqlite3
+import argparse
+import functools
+import io
+import itertools
 import json
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import approx
+import columnar
+import db
+import error_flags
+from db import DB_PATH, PARQUET_DIR
+
+TRANSACTIONS_CSV  = 'data/transactions_data.csv'
+FRAUD_LABELS_JSON = 'data/train_fraud_labels.json'
+
+# Column types of the raw CSV. Fixing them up front means every chunk parses the
+# same way, even a chunk that happens to have no ONLINE rows or no errors in it.
+TRANSACTION_DTYPES = {
+    'id': 'int64',
+    'date': 'object',
+    'client_id': 'int64',
+    'card_id': 'int64',
+    'amount': 'object',
+    'use_chip': 'object',
+    'merchant_id': 'int64',
+    'merchant_city': 'object',
+    'merchant_state': 'object',
+    'zip': 'float64',
+    'mcc': 'int64',
+    'errors': 'object',
+}
+
+# Rough in-memory cost of one row while a chunk is in flight (raw CSV bytes in
+# the parent, the parsed frame in the worker and the pickled row tuples on the
+# way back). Used to turn --memory-limit-mb into a number of chunks in flight.
+ROW_BYTES = 1024
+
+# How often a producer blocked on a full writer queue checks the writer is alive
+WRITER_POLL_SECONDS = 0.1
+
+
+# Typed storage schema. Amounts are whole cents and `month` is a YYYYMM integer
+# key, so loaders aggregate integers instead of parsing '$' strings and dates
+# on every row. `error_mask` holds `errors` as one bit per error_flags.FLAGS
+# entry. `id` is the rowid, which makes the fraud label join a lookup.
+TRANSACTIONS_SCHEMA = """
+    CREATE TABLE {table} (
+        id             INTEGER PRIMARY KEY,
+        date           TEXT,
+        month          INTEGER,
+        client_id      INTEGER,
+        card_id        INTEGER,
+        amount_cents   INTEGER,
+        use_chip       TEXT,
+        merchant_id    INTEGER,
+        merchant_city  TEXT,
+        merchant_state TEXT,
+        zip            REAL,
+        mcc            INTEGER,
+        errors         TEXT,
+        error_mask     INTEGER
+    )
+"""
+TRANSACTION_COLUMNS = [
+    'id', 'date', 'month', 'client_id', 'card_id', 'amount_cents', 'use_chip',
+    'merchant_id', 'merchant_city', 'merchant_state', 'zip', 'mcc', 'errors', 'error_mask',
+]
+
+# Covering indexes for the page loaders: monthly totals, category trends and
+# per-client history can all be answered from the index without the table.
+# Created on every year partition when transactions is partitioned.
+TRANSACTION_INDEXES = [
+    'CREATE INDEX idx_{table}_month ON {table} (month, amount_cents)',
+    'CREATE INDEX idx_{table}_mcc_month ON {table} (mcc, month, amount_cents)',
+    'CREATE INDEX idx_{table}_client_date ON {table} (client_id, date, amount_cents)',
+]
+
+# Position of `month` in an inserted row, which picks the row's year partition
+MONTH_COLUMN = 2
+
+
+def to_cents(amounts):
+    return (pd.to_numeric(amounts.str.lstrip('$')) * 100).round().astype('int64')
+
+
+def to_dollars(amounts):
+    return pd.to_numeric(amounts.str.lstrip('$')).astype('int64')
+
+
+def month_key(dates):
+    return dates.str[:4].astype('int64') * 100 + dates.str[5:7].astype('int64')
+
+
+# ── Transactions: parallel chunked ingest ──────────────────────────────────────
+def read_raw_chunks(path, chunk_rows):
+    # Splits the CSV into blocks of whole lines without parsing them, so the
+    # parent process only ever holds raw bytes.
+    with open(path, 'rb') as f:
+        header = f.readline()
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                break
+            yield header + b''.join(lines)
+
+
+def parse_chunk(raw, fmt, after_id):
+    df = pd.read_csv(io.BytesIO(raw), dtype=TRANSACTION_DTYPES)
+    df = df[df['id'] > after_id]
+    df['amount_cents'] = to_cents(df['amount'])
+    df['month'] = month_key(df['date'])
+    df['error_mask'] = error_flags.encode(df['errors'])
+    df = df[TRANSACTION_COLUMNS]
+    if fmt == 'parquet':
+        import pyarrow as pa
+        return pa.Table.from_pandas(df, schema=transactions_arrow_schema(), preserve_index=False)
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+def transactions_arrow_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('id', pa.int64()), ('date', pa.string()), ('month', pa.int64()),
+        ('client_id', pa.int64()), ('card_id', pa.int64()), ('amount_cents', pa.int64()),
+        ('use_chip', pa.string()), ('merchant_id', pa.int64()), ('merchant_city', pa.string()),
+        ('merchant_state', pa.string()), ('zip', pa.float64()), ('mcc', pa.int64()),
+        ('errors', pa.string()), ('error_mask', pa.int64()),
+    ])
+
+
+def create_transactions_table(conn, partitioned=False):
+    # Drops the table, or the view and every year partition, left by a
+    # previous build. Partitions are created by the writer as their years
+    # turn up.
+    if is_partitioned(conn):
+        conn.execute('DROP VIEW transactions')
+    else:
+        conn.execute('DROP TABLE IF EXISTS transactions')
+    for year in partition_years(conn):
+        conn.execute(f'DROP TABLE {partition_name(year)}')
+    if not partitioned:
+        conn.execute(TRANSACTIONS_SCHEMA.format(table='transactions'))
+    conn.commit()
+
+
+def create_transaction_indexes(db_path):
+    conn = sqlite3.connect(db_path)
+    tables = [partition_name(year) for year in partition_years(conn)] if is_partitioned(conn) else ['transactions']
+    for table in tables:
+        for statement in TRANSACTION_INDEXES:
+            statement = statement.format(table=table)
+            started = time.perf_counter()
+            conn.execute(statement)
+            print(f'  {statement.split()[2]}: {time.perf_counter() - started:.1f}s')
+    conn.commit()
+    conn.close()
+
+
+# ── Transactions: year partitions ──────────────────────────────────────────────
+# With --partition-by-year the rows are stored one table per calendar year
+# (transactions_2010, transactions_2011, ...) and `transactions` is a view
+# that UNION ALLs them, so every query still reads `transactions`. SQLite
+# pushes a query's WHERE into each arm of the view, where a month range is an
+# index seek: partitions outside the range return nothing after a few page
+# reads, and a recent window costs what the window holds rather than the
+# whole history. Appends only ever write to the newest partitions.
+PARTITION_PATTERN = 'transactions_[0-9][0-9][0-9][0-9]'
+
+
+def partition_name(year):
+    return f'transactions_{year}'
+
+
+def partition_years(conn):
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+                        (PARTITION_PATTERN,))
+    return sorted(int(name[-4:]) for name, in rows)
+
+
+def is_partitioned(conn):
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'transactions'").fetchone()
+    return row is not None and row[0] == 'view'
+
+
+def create_partition(conn, year, indexed):
+    table = partition_name(year)
+    conn.execute(TRANSACTIONS_SCHEMA.format(table=table))
+    if indexed:
+        for statement in TRANSACTION_INDEXES:
+            conn.execute(statement.format(table=table))
+
+
+def create_partitions_view(conn):
+    # Recreated whenever a year is added. Partitions are in year order, and
+    # ids increase with date, so the view lists rows in id order.
+    arms = [f'SELECT * FROM {partition_name(year)}' for year in partition_years(conn)]
+    conn.execute('DROP VIEW IF EXISTS transactions')
+    conn.execute('CREATE VIEW transactions AS ' + ' UNION ALL '.join(arms))
+
+
+def report_progress(written, done_bytes, total_bytes, started):
+    elapsed = time.perf_counter() - started
+    print(f'  transactions: {written:,} rows ({100 * done_bytes / total_bytes:.0f}%, '
+          f'{written / elapsed:,.0f} rows/sec)', flush=True)
+
+
+def sqlite_writer(db_path, chunks, commit_rows, total_bytes, partitioned=False, index_partitions=False):
+    # With `partitioned`, each row goes to its year's partition, created when
+    # the first row of a new year arrives (with its indexes already in place
+    # if index_partitions, as on an append).
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    placeholders = ', '.join('?' * len(TRANSACTION_COLUMNS))
+    insert = f'INSERT INTO {{table}} VALUES ({placeholders})'
+    years = set(partition_years(conn))
+
+    written = pending = done_bytes = 0
+    started = time.perf_counter()
+    conn.execute('BEGIN')
+    while (item := chunks.get()) is not None:
+        rows, raw_bytes = item
+        if partitioned:
+            by_year = {}
+            for row in rows:
+                by_year.setdefault(row[MONTH_COLUMN] // 100, []).append(row)
+            for year, part in by_year.items():
+                if year not in years:
+                    create_partition(conn, year, indexed=index_partitions)
+                    years.add(year)
+                conn.executemany(insert.format(table=partition_name(year)), part)
+        else:
+            conn.executemany(insert.format(table='transactions'), rows)
+        written += len(rows)
+        pending += len(rows)
+        done_bytes += raw_bytes
+        if pending >= commit_rows:
+            conn.execute('COMMIT')
+            conn.execute('BEGIN')
+            pending = 0
+        report_progress(written, done_bytes, total_bytes, started)
+    conn.execute('COMMIT')
+    if partitioned and years:
+        create_partitions_view(conn)
+    conn.close()
+
+
+def parquet_writer(root, chunks, commit_rows, total_bytes, part='part-0'):
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    # One file per year partition (transactions/year=YYYY/<part>.parquet).
+    # Each chunk becomes a row group in the file(s) for the years it covers;
+    # appends add a new part file next to the existing ones.
+    writers = {}
+    written = done_bytes = 0
+    started = time.perf_counter()
+    while (item := chunks.get()) is not None:
+        table, raw_bytes = item
+        years = pc.divide(table['month'], 100)
+        for year in pc.unique(years).to_pylist():
+            if year not in writers:
+                directory = os.path.join(root, 'transactions', f'year={year}')
+                os.makedirs(directory, exist_ok=True)
+                writers[year] = pq.ParquetWriter(os.path.join(directory, f'{part}.parquet'), table.schema)
+            writers[year].write_table(table.filter(pc.equal(years, year)))
+        written += table.num_rows
+        done_bytes += raw_bytes
+        report_progress(written, done_bytes, total_bytes, started)
+    for w in writers.values():
+        w.close()
+
+
+def load_transactions(fmt, csv_path, workers, chunk_rows, memory_limit_mb, commit_rows, after_id=0,
+                      partitioned=False):
+    # after_id > 0 appends only the rows newer than that watermark to the
+    # existing store instead of building it from scratch, in whichever
+    # layout it has. `partitioned` builds SQLite year partitions; the
+    # Parquet export is always split by year.
+    if fmt == 'parquet':
+        target, writer = PARQUET_DIR, functools.partial(parquet_writer, part=f'part-{after_id}')
+    else:
+        conn = sqlite3.connect(DB_PATH)
+        if after_id:
+            partitioned = is_partitioned(conn)
+        else:
+            create_transactions_table(conn, partitioned)
+        conn.close()
+        target = DB_PATH
+        writer = functools.partial(sqlite_writer, partitioned=partitioned, index_partitions=bool(after_id))
+
+    # Chunks are either being parsed, parsed and waiting for the writer, or
+    # being inserted. Splitting the slots between the pool and the writer
+    # queue keeps the total number of chunks alive under the memory limit.
+    budget = memory_limit_mb * 1024 * 1024
+    chunk_rows = max(1000, min(chunk_rows, budget // (3 * ROW_BYTES)))
+    slots = max(3, budget // (chunk_rows * ROW_BYTES))
+    max_pending = max(1, slots // 2)
+    chunks = queue.Queue(maxsize=max(1, slots - max_pending - 1))
+
+    # A writer that raises stops taking chunks, so the producer never waits on
+    # the queue for it: the error is raised at the next hand-off, or after
+    # join() if the writer failed on its last commit.
+    failed = []
+
+    def write():
+        try:
+            writer(target, chunks, commit_rows, os.path.getsize(csv_path))
+        except BaseException as e:
+            failed.append(e)
+
+    def put(item):
+        while thread.is_alive():
+            try:
+                chunks.put(item, timeout=WRITER_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    started = time.perf_counter()
+    rows_total = 0
+
+    def hand_off(pending):
+        nonlocal rows_total
+        future, raw_bytes = pending.popleft()
+        rows = future.result()
+        rows_total += len(rows)
+        put((rows, raw_bytes))
+        if failed:
+            raise failed[0]
+
+    # Futures are consumed in submission order so rows land in the same order
+    # as the CSV.
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for raw in read_raw_chunks(csv_path, chunk_rows):
+                pending.append((pool.submit(parse_chunk, raw, fmt, after_id), len(raw)))
+                del raw
+                while len(pending) >= max_pending or (pending and pending[0][0].done()):
+                    hand_off(pending)
+            while pending:
+                hand_off(pending)
+    finally:
+        put(None)
+        thread.join()
+    if failed:
+        raise failed[0]
+
+    elapsed = time.perf_counter() - started
+    print(f'  transactions: {rows_total:,} rows in {elapsed:.1f}s '
+          f'({rows_total / elapsed:,.0f} rows/sec)')
+
+
+# ── JSON: streaming string members ─────────────────────────────────────────────
+# The label and MCC files are flat {"key": "value", ...} objects (the labels
+# nested under "target"). They are tokenised in fixed-size blocks with NumPy
+# rather than json.load, so memory stays at a couple of blocks whatever the
+# file size and no per-entry Python objects are built for the labels.
+JSON_BLOCK_BYTES = 4 << 20
+JSON_GAP_BYTES   = 8
+
+QUOTE, BACKSLASH, COLON = ord('"'), ord('\\'), ord(':')
+WHITESPACE = np.zeros(256, dtype=bool)
+WHITESPACE[[ord(' '), ord('\t'), ord('\n'), ord('\r')]] = True
+
+
+def _unescaped_quotes(buf):
+    quotes = np.flatnonzero(buf == QUOTE)
+    # A quote is escaped when an odd run of backslashes precedes it. Rare
+    # enough that the few candidates are checked one by one.
+    escaped = np.zeros(len(quotes), dtype=bool)
+    for i in np.flatnonzero(buf[np.maximum(quotes - 1, 0)] == BACKSLASH):
+        run = 0
+        while quotes[i] - run > 0 and buf[quotes[i] - run - 1] == BACKSLASH:
+            run += 1
+        escaped[i] = run % 2 == 1
+    return quotes[~escaped]
+
+
+def _is_member_gap(buf, start, end):
+    # Whether each buf[start:end] is one colon plus whitespace. Gaps are a
+    # few bytes, so this walks them a column at a time; the rare long ones
+    # (pretty-printed files) are checked individually.
+    length = end - start
+    colons = np.zeros(len(start), dtype=np.int64)
+    other = np.zeros(len(start), dtype=bool)
+    for k in range(min(int(length.max(initial=0)), JSON_GAP_BYTES)):
+        inside = length > k
+        c = buf[np.minimum(start + k, len(buf) - 1)]
+        colons += inside & (c == COLON)
+        other |= inside & (c != COLON) & ~WHITESPACE[c]
+    result = (colons == 1) & ~other
+    for i in np.flatnonzero(length > JSON_GAP_BYTES):
+        gap = buf[start[i]:end[i]]
+        result[i] = (gap == COLON).sum() == 1 and bool((WHITESPACE[gap] | (gap == COLON)).all())
+    return result
+
+
+def iter_json_members(path, block_bytes=JSON_BLOCK_BYTES):
+    # Yields (buf, keys, values) for every block of the file: `buf` the block
+    # as a uint8 array and `keys` / `values` (n, 2) arrays of [start, end)
+    # offsets into it for each "key": "value" member whose value is a string.
+    # Members with object values, like the "target" wrapper, are skipped.
+    # A member cut by the block boundary is carried over to the next block.
+    with open(path, 'rb') as f:
+        tail = b''
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                break
+            buf = np.frombuffer(tail + block, dtype=np.uint8)
+            quotes = _unescaped_quotes(buf)
+            quotes = quotes[:len(quotes) // 2 * 2]  # drop a string still open at the end
+            opens, closes = quotes[0::2], quotes[1::2]
+
+            # String j is a key and j + 1 its value when only a colon and
+            # whitespace lie between them
+            key = np.flatnonzero(_is_member_gap(buf, closes[:-1] + 1, opens[1:]))
+
+            keys = np.stack([opens[key] + 1, closes[key]], axis=1)
+            values = np.stack([opens[key + 1] + 1, closes[key + 1]], axis=1)
+            yield buf, keys, values
+
+            done = int(values[-1, 1]) + 1 if len(values) else 0
+            tail = buf[done:].tobytes()
+
+
+def json_int_keys(buf, spans):
+    # The spans' digits as int64, parsed without building strings: keys of
+    # each length are gathered into an (n, length) digit matrix at once
+    lengths = spans[:, 1] - spans[:, 0]
+    result = np.empty(len(spans), dtype=np.int64)
+    for length in np.unique(lengths):
+        if not 0 < length <= 18:
+            raise ValueError('Expected integer keys of 1 to 18 digits')
+        rows = np.flatnonzero(lengths == length)
+        digits = buf[spans[rows, 0, None] + np.arange(length)].astype(np.int64) - ord('0')
+        if ((digits < 0) | (digits > 9)).any():
+            raise ValueError('Expected integer keys of 1 to 18 digits')
+        result[rows] = digits @ 10 ** np.arange(length - 1, -1, -1, dtype=np.int64)
+    return result
+
+
+def json_strings(buf, spans):
+    # The spans as Python strings, JSON escapes decoded
+    raw = buf.tobytes()
+    return [json.loads(raw[s - 1:e + 1]) if BACKSLASH in raw[s:e] else raw[s:e].decode()
+            for s, e in spans]
+
+
+def iter_fraud_labels(path, block_bytes=JSON_BLOCK_BYTES):
+    # (transaction_id, is_fraud) batches as int64 arrays, sorted by id within
+    # each batch so they insert in primary-key order. is_fraud is 1 for "Yes".
+    for buf, keys, values in iter_json_members(path, block_bytes):
+        ids = json_int_keys(buf, keys)
+        is_fraud = np.zeros(len(ids), dtype=bool)
+        three = np.flatnonzero(values[:, 1] - values[:, 0] == 3)
+        start = values[three, 0]
+        is_fraud[three] = (buf[start] == ord('Y')) & (buf[start + 1] == ord('e')) & (buf[start + 2] == ord('s'))
+        if (ids[1:] < ids[:-1]).any():
+            order = np.argsort(ids, kind='stable')
+            ids, is_fraud = ids[order], is_fraud[order]
+        yield ids, is_fraud.astype(np.int64)
+
+
+def read_mcc_codes(path):
+    parts = [(json_int_keys(buf, keys), json_strings(buf, values))
+             for buf, keys, values in iter_json_members(path)]
+    return pd.DataFrame({
+        'mcc': np.concatenate([mcc for mcc, _ in parts]) if parts else np.empty(0, dtype=np.int64),
+        'description': [d for _, descriptions in parts for d in descriptions],
+    })
+
+
+def load_fraud_labels(fmt, path, after_id=0):
+    # Streams the labels file into the store one block at a time. Only ids
+    # above after_id are written, so an append skips labels already stored.
+    batches = ((ids[ids > after_id], is_fraud[ids > after_id]) for ids, is_fraud in iter_fraud_labels(path))
+    started = time.perf_counter()
+    written = 0
+    if fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([('transaction_id', pa.int64()), ('is_fraud', pa.int64())])
+        directory = os.path.join(PARQUET_DIR, 'fraud_labels')
+        os.makedirs(directory, exist_ok=True)
+        with pq.ParquetWriter(os.path.join(directory, f'part-{after_id}.parquet'), schema) as writer:
+            for ids, is_fraud in batches:
+                writer.write_table(pa.table([ids, is_fraud], schema=schema))
+                written += len(ids)
+    else:
+        conn = sqlite3.connect(DB_PATH, isolation_level=None)
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('BEGIN')
+        if not after_id:
+            # transaction_id is the primary key, so the label join is an index
+            # lookup that also carries the flag (1 = fraud, 0 = not fraud).
+            conn.execute('DROP TABLE IF EXISTS fraud_labels')
+            conn.execute('CREATE TABLE fraud_labels (transaction_id INTEGER PRIMARY KEY, is_fraud INTEGER NOT NULL)')
+        # Each batch goes in as one statement: the pairs packed into a JSON
+        # array of id * 2 + is_fraud and unpacked by SQLite's json_each, which
+        # avoids building a Python tuple per row
+        for ids, is_fraud in batches:
+            conn.execute('INSERT OR REPLACE INTO fraud_labels SELECT value >> 1, value & 1 FROM json_each(?)',
+                         (json.dumps((ids * 2 + is_fraud).tolist()),))
+            written += len(ids)
+        conn.execute('COMMIT')
+        conn.close()
+    elapsed = time.perf_counter() - started
+    print(f'  fraud_labels: {written:,} rows in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f} rows/sec)')
+
+
+# ── Small tables ───────────────────────────────────────────────────────────────
+def read_small_tables():
+    cards = pd.read_csv('data/cards_data.csv')
+    users = pd.read_csv('data/users_data.csv')
+
+    # Whole-dollar '$' columns are stored as integers
+    cards['credit_limit'] = to_dollars(cards['credit_limit'])
+    for col in ['per_capita_income', 'yearly_income', 'total_debt']:
+        users[col] = to_dollars(users[col])
+
+    mcc_codes = read_mcc_codes('data/mcc_codes.json')
+    return {'cards': cards, 'users': users, 'mcc_codes': mcc_codes, 'error_flags': error_flags.FLAGS_TABLE}
+
+
+def write_small_tables_sqlite(db_path, tables):
+    conn = sqlite3.connect(db_path)
+    tables['cards'].to_sql('cards', conn, if_exists='replace', index=False)
+    tables['users'].to_sql('users', conn, if_exists='replace', index=False)
+
+    conn.execute('DROP TABLE IF EXISTS mcc_codes')
+    conn.execute('CREATE TABLE mcc_codes (mcc INTEGER PRIMARY KEY, description TEXT)')
+    conn.executemany('INSERT INTO mcc_codes VALUES (?, ?)', tables['mcc_codes'].itertuples(index=False))
+
+    conn.execute('DROP TABLE IF EXISTS error_flags')
+    conn.execute('CREATE TABLE error_flags (flag INTEGER PRIMARY KEY, name TEXT, priority INTEGER)')
+    conn.executemany('INSERT INTO error_flags VALUES (?, ?, ?)', tables['error_flags'].itertuples(index=False))
+    conn.commit()
+    conn.close()
+
+
+def write_small_tables_parquet(root, tables):
+    for name, df in tables.items():
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+        df.to_parquet(os.path.join(root, name, 'part-0.parquet'), index=False)
+
+
+# ── Stratified sample ──────────────────────────────────────────────────────────
+def build_sample(fmt, rates, after_id=0):
+    # Draws the sample behind the pages' approximate answers (approx.py) and
+    # records its rates in sample_rates. An append keeps the rates already
+    # stored and redraws only the strata from the first new row's month on,
+    # since those are the only ones whose rows changed. No rates record an
+    # empty sample_rates, which keeps the pages at exact answers.
+    backend = db.BACKENDS[fmt]()
+    started = time.perf_counter()
+    try:
+        try:
+            stored = backend.query('SELECT rate FROM sample_rates')['rate'].tolist()
+        except Exception as e:
+            if not db.missing_table(e):
+                raise
+            stored = None
+        if not (after_id and stored) and not rates:
+            backend.store('sample_rates', pd.DataFrame({'rate': pd.Series([], dtype='float64')}))
+            print('  transactions_sample: skipped (no sample rates)')
+            return
+        if after_id and stored:
+            rates = stored
+            first = backend.query('SELECT month FROM transactions WHERE id > ? ORDER BY id LIMIT 1', (after_id,))
+            if first.empty:
+                return
+            from_month = int(first['month'][0])
+            sql = approx.SAMPLE_MERGE_SQL.format(from_month=from_month,
+                                                 redrawn=approx.sample_sql(max(rates), from_month))
+        else:
+            sql = approx.sample_sql(max(rates))
+        backend.materialize('transactions_sample', sql)
+        backend.store('sample_rates', pd.DataFrame({'rate': sorted(rates)}))
+        rows = int(backend.query('SELECT COUNT(*) AS n FROM transactions_sample')['n'][0])
+    finally:
+        backend.close()
+    print(f'  transactions_sample: {rows:,} rows in {time.perf_counter() - started:.1f}s '
+          f'(rates {", ".join(f"{rate:g}" for rate in sorted(rates))})')
 
-# Load CSVs
-transactions = pd.read_csv('data/transactions_data.csv')
-cards        = pd.read_csv('data/cards_data.csv')
-users        = pd.read_csv('data/users_data.csv')
 
-# Load MCC codes
-with open('data/mcc_codes.json') as f:
-    mcc_raw = json.load(f)
+# ── Incremental append ─────────────────────────────────────────────────────────
+def watermark(fmt, table, column):
+    # Transaction ids increase with date, so the highest stored id marks
+    # everything already loaded. Cheap on both stores: SQLite reads the end of
+    # the rowid tree (of each year partition, merged, when partitioned) and
+    # DuckDB skips row groups that cannot beat the running top value.
+    backend = db.BACKENDS[fmt]()
+    try:
+        df = backend.query(f'SELECT {column} AS max_id FROM {table} ORDER BY {column} DESC LIMIT 1')
+    finally:
+        backend.close()
+    return 0 if df.empty or pd.isna(df['max_id'][0]) else int(df['max_id'][0])
 
-mcc_codes = pd.DataFrame([
-    {'mcc': int(k), 'description': v}
-    for k, v in mcc_raw.items()
-])
 
-# Load fraud labels
-with open('data/train_fraud_labels.json') as f:
-    fraud_raw = json.load(f)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build data/finance.db (or the Parquet export) from the Kaggle CSV and JSON files.')
+    parser.add_argument('--format', choices=['sqlite', 'parquet'], default='sqlite',
+                        help=f'write {DB_PATH} or a year-partitioned Parquet export in {PARQUET_DIR}/')
+    parser.add_argument('--append', metavar='CSV',
+                        help='append transactions newer than the stored watermark from this file instead of rebuilding')
+    parser.add_argument('--labels', metavar='JSON',
+                        help='with --append, fraud labels for the new transactions (same layout as train_fraud_labels.json)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='processes parsing transaction chunks (default: one per CPU)')
+    parser.add_argument('--chunk-rows', type=int, default=200_000,
+                        help='transactions per chunk')
+    parser.add_argument('--memory-limit-mb', type=int, default=1024,
+                        help='approximate cap on memory held by chunks in flight')
+    parser.add_argument('--commit-rows', type=int, default=2_000_000,
+                        help='rows inserted per write transaction')
+    parser.add_argument('--partition-by-year', action='store_true',
+                        help='store SQLite transactions as one table per year behind a `transactions` view '
+                             '(the Parquet export is always split by year)')
+    parser.add_argument('--sample-rates', type=lambda value: [float(rate) for rate in value.split(',')],
+                        default=approx.SAMPLE_RATES if columnar.ENABLED else [], metavar='RATES',
+                        help='comma-separated fractions of each (month, mcc) stratum kept in the sample behind '
+                             'the approximate answers (default: %(default)s; only the FINANCE_ENGINE=numpy '
+                             'pages estimate, so other engines draw none; an append keeps the stored rates)')
+    args = parser.parse_args()
 
-fraud_labels = pd.DataFrame([
-    {'transaction_id': int(k), 'is_fraud': v}
-    for k, v in fraud_raw['target'].items()
-])
+    if args.append:
+        after_id = watermark(args.format, 'transactions', 'id')
+        print(f'Appending transactions after id {after_id:,}')
+        load_transactions(args.format, args.append, args.workers, args.chunk_rows,
+                          args.memory_limit_mb, args.commit_rows, after_id=after_id)
+        if args.labels:
+            load_fraud_labels(args.format, args.labels,
+                              after_id=watermark(args.format, 'fraud_labels', 'transaction_id'))
+        build_sample(args.format, args.sample_rates, after_id=after_id)
+        print('Append finished - run `python precompute.py --incremental` to refresh the aggregates')
 
-# Connect to SQLite
-conn = sqlite3.connect('data/finance.db')
+    elif args.format == 'parquet':
+        shutil.rmtree(PARQUET_DIR, ignore_errors=True)
+        load_transactions(args.format, TRANSACTIONS_CSV, args.workers, args.chunk_rows,
+                          args.memory_limit_mb, args.commit_rows)
+        write_small_tables_parquet(PARQUET_DIR, read_small_tables())
+        load_fraud_labels(args.format, FRAUD_LABELS_JSON)
+        build_sample(args.format, args.sample_rates)
+        print('Parquet export built successfully')
 
-# Write tables
-transactions.to_sql('transactions', conn, if_exists='replace', index=False)
-cards.to_sql('cards',        conn, if_exists='replace', index=False)
-users.to_sql('users',        conn, if_exists='replace', index=False)
-mcc_codes.to_sql('mcc_codes',    conn, if_exists='replace', index=False)
-fraud_labels.to_sql('fraud_labels', conn, if_exists='replace', index=False)
+    else:
+        load_transactions(args.format, TRANSACTIONS_CSV, args.workers, args.chunk_rows,
+                          args.memory_limit_mb, args.commit_rows, partitioned=args.partition_by_year)
+        create_transaction_indexes(DB_PATH)
+        write_small_tables_sqlite(DB_PATH, read_small_tables())
+        load_fraud_labels(args.format, FRAUD_LABELS_JSON)
+        build_sample(args.format, args.sample_rates)
 
-conn.close()
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute('ANALYZE')
+        conn.close()
 
-print('Database built successfully')
\ No newline at end of file
+        print('Database built successfully')
@@ -1,18 +1,18 @@
 -- Total spent per user, ordered by highest
--- Note: Amount has '$' prefix and is stored as text, so we strip '$' and cast to REAL before aggregating
+-- Note: Amounts are stored as integer cents (amount_cents), so we divide by 100.0 after aggregating
 SELECT 
     client_id,
-    SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS total_spent
+    SUM(amount_cents) / 100.0 AS total_spent
 FROM transactions
 GROUP BY client_id
 ORDER BY total_spent DESC
 
 -- Total spent and transaction count across all users by month
--- strftime('%Y-%m', date) extracts year and month from the date column
+-- month is a YYYYMM integer key precomputed from the date column at ingest
 SELECT 
-    strftime('%Y-%m', date) AS month,
+    month,
     COUNT(*) AS number_transactions,
-    SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS monthly_total
+    SUM(amount_cents) / 100.0 AS monthly_total
 FROM transactions
 GROUP BY month
 ORDER BY month ASC
@@ -21,8 +21,8 @@ ORDER BY month ASC
 SELECT 
     mcc_codes.description,
     COUNT(*) AS number_transactions,
-    SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS total_spent,
-	ROUND(AVG(CAST(REPLACE(amount, '$', '') AS REAL)), 2) AS avg_transaction
+    SUM(amount_cents) / 100.0 AS total_spent,
+	ROUND(AVG(amount_cents) / 100.0, 2) AS avg_transaction
 FROM transactions
 LEFT JOIN mcc_codes ON transactions.mcc = mcc_codes.mcc
 GROUP BY mcc_codes.description
@@ -33,8 +33,8 @@ LIMIT 10
 SELECT 
     mcc_codes.description,
     COUNT(*) AS number_transactions,
-    SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS total_spent,
-	ROUND(AVG(CAST(REPLACE(amount, '$', '') AS REAL)), 2) AS avg_transaction
+    SUM(amount_cents) / 100.0 AS total_spent,
+	ROUND(AVG(amount_cents) / 100.0, 2) AS avg_transaction
 FROM transactions
 LEFT JOIN mcc_codes ON transactions.mcc = mcc_codes.mcc
 GROUP BY mcc_codes.description
@@ -44,20 +44,13 @@ LIMIT 10
 -- Simplifies errors to a single primary label for easier analysis.
 -- Priority is ordered by business impact and fraud risk
 -- Bad CVV is prioritised after analysis showed it has the highest fraud rate of any individual error type at 2.28%.
+-- error_flags numbers the flags in this priority order, so the primary error is
+-- the lowest bit set in error_mask (error_mask & -error_mask).
 SELECT
-    CASE 
-        WHEN errors IS NULL THEN 'Clean'
-        WHEN errors LIKE '%Insufficient Balance%' THEN 'Insufficient Balance'
-        WHEN errors LIKE '%Bad CVV%' THEN 'Bad CVV'
-        WHEN errors LIKE '%Bad PIN%' THEN 'Bad PIN'
-        WHEN errors LIKE '%Technical Glitch%' THEN 'Technical Glitch'
-        WHEN errors LIKE '%Bad Card Number%' THEN 'Bad Card Number'
-        WHEN errors LIKE '%Bad Expiration%' THEN 'Bad Expiration'
-        WHEN errors LIKE '%Bad Zipcode%' THEN 'Bad Zipcode'
-        ELSE 'Other'
-    END AS primary_error,
+    IFNULL(error_flags.name, 'Clean') AS primary_error,
     COUNT(*) AS count
 FROM transactions
+LEFT JOIN error_flags ON error_flags.flag = (transactions.error_mask & -transactions.error_mask)
 GROUP BY primary_error
 ORDER BY count DESC
 
@@ -66,13 +59,13 @@ ORDER BY count DESC
 -- However, most fraud occurs on clean transactions, highlighting the limits of error-based detection alone.
 
 SELECT 
-    transactions.errors,
+    transactions.error_mask,
     COUNT(*) AS total_transactions,
-    SUM(CASE WHEN fraud_labels.is_fraud = 'Yes' THEN 1 ELSE 0 END) AS fraud_count,
-    ROUND(SUM(CASE WHEN fraud_labels.is_fraud = 'Yes' THEN 1 ELSE 0 END) * 100.0 / COUNT(*), 2) AS fraud_rate
+    IFNULL(SUM(fraud_labels.is_fraud), 0) AS fraud_count,
+    ROUND(IFNULL(SUM(fraud_labels.is_fraud), 0) * 100.0 / COUNT(*), 2) AS fraud_rate
 FROM transactions
 LEFT JOIN fraud_labels ON transactions.id = fraud_labels.transaction_id
-GROUP BY transactions.errors
+GROUP BY transactions.error_mask
 ORDER BY fraud_rate DESC
 
 -- Introduces CTEs to calculate average monthly spending per user and compare 
@@ -81,8 +74,8 @@ ORDER BY fraud_rate DESC
 WITH monthly_spending AS (
     SELECT 
         client_id,
-        strftime('%Y-%m', date) AS month,
-        SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS monthly_spending
+        month,
+        SUM(amount_cents) / 100.0 AS monthly_spending
     FROM transactions
     GROUP BY client_id, month
 )
@@ -90,7 +83,7 @@ SELECT
     monthly_spending.client_id,
     COUNT(DISTINCT monthly_spending.month) AS active_months,
     '$' || ROUND(AVG(monthly_spending.monthly_spending), 2) AS avg_monthly_spending,
-    '$' || ROUND(CAST(REPLACE(users.yearly_income, '$', '') AS REAL) / 12.0, 2) AS monthly_income
+    '$' || ROUND(users.yearly_income / 12.0, 2) AS monthly_income
 FROM monthly_spending
 LEFT JOIN users ON monthly_spending.client_id = users.id
 GROUP BY monthly_spending.client_id
@@ -104,20 +97,20 @@ ORDER BY AVG(monthly_spending.monthly_spending) DESC
 WITH monthly_spending AS (
     SELECT 
         client_id,
-        strftime('%Y-%m', date) AS month,
-        SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS monthly_spending
+        month,
+        SUM(amount_cents) / 100.0 AS monthly_spending
     FROM transactions
     GROUP BY client_id, month
 ),
 total_months AS (
-    SELECT COUNT(DISTINCT strftime('%Y-%m', date)) AS num_months
+    SELECT COUNT(DISTINCT month) AS num_months
     FROM transactions
 ),
 fraud_per_user AS (
     SELECT 
         transactions.client_id,
         COUNT(*) AS total_transactions,
-        SUM(CASE WHEN fraud_labels.is_fraud = 'Yes' THEN 1 ELSE 0 END) AS fraud_count
+        IFNULL(SUM(fraud_labels.is_fraud), 0) AS fraud_count
     FROM transactions
     LEFT JOIN fraud_labels ON transactions.id = fraud_labels.transaction_id
     GROUP BY transactions.client_id
@@ -127,23 +120,23 @@ SELECT
     COUNT(DISTINCT monthly_spending.month) AS active_months,
     total_months.num_months AS total_months,
     '$' || ROUND(SUM(monthly_spending.monthly_spending) / total_months.num_months, 2) AS avg_monthly_spending,
-    '$' || ROUND(CAST(REPLACE(users.yearly_income, '$', '') AS REAL) / 12.0, 2) AS monthly_income,
-    ROUND((SUM(monthly_spending.monthly_spending) / total_months.num_months) / (CAST(REPLACE(users.yearly_income, '$', '') AS REAL) / 12.0) * 100, 2) || '%' AS pct_income_spent,
+    '$' || ROUND(users.yearly_income / 12.0, 2) AS monthly_income,
+    ROUND((SUM(monthly_spending.monthly_spending) / total_months.num_months) / (users.yearly_income / 12.0) * 100, 2) || '%' AS pct_income_spent,
     ROUND(fraud_per_user.fraud_count * 100.0 / fraud_per_user.total_transactions, 2) || '%' AS fraud_rate
 FROM monthly_spending
 LEFT JOIN users ON monthly_spending.client_id = users.id
 LEFT JOIN fraud_per_user ON monthly_spending.client_id = fraud_per_user.client_id
 CROSS JOIN total_months
 GROUP BY monthly_spending.client_id
-ORDER BY (SUM(monthly_spending.monthly_spending) / total_months.num_months) / (CAST(REPLACE(users.yearly_income, '$', '') AS REAL) / 12.0) DESC
+ORDER BY (SUM(monthly_spending.monthly_spending) / total_months.num_months) / (users.yearly_income / 12.0) DESC
 
 -- Running total spend per user over time, ordered chronologically.
 -- Date sorting works correctly here as the YYYY-MM-DD format is both alphabetically and chronologically ordered.
 SELECT 
     client_id,
     date,
-    CAST(REPLACE(amount, '$', '') AS REAL) AS amount,
-    SUM(CAST(REPLACE(amount, '$', '') AS REAL)) OVER (PARTITION BY client_id ORDER BY date) AS running_total
+    amount_cents / 100.0 AS amount,
+    SUM(amount_cents) OVER (PARTITION BY client_id ORDER BY date) / 100.0 AS running_total
 FROM transactions
 
 -- Ranks users by total spend
@@ -151,7 +144,7 @@ FROM transactions
 WITH total_spent AS (
     SELECT 
         client_id,
-        SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS total_spent
+        SUM(amount_cents) / 100.0 AS total_spent
     FROM transactions
     GROUP BY client_id
 )
@@ -167,8 +160,8 @@ FROM total_spent
 WITH monthly_spending AS (
     SELECT 
         client_id,
-        strftime('%Y-%m', date) AS month,
-        SUM(CAST(REPLACE(amount, '$', '') AS REAL)) AS monthly_spending
+        month,
+        SUM(amount_cents) / 100.0 AS monthly_spending
     FROM transactions
     GROUP BY client_id, month
 )
@@ -0,0 +1,81 @@
+# Fixtures building a small synthetic database with the repo's own scripts,
+# the way benchmarks/suite.py does. The first BASE_ROWS transactions are
+# loaded by setup_db.py and precomputed; the rest are left in new_rows.csv for
+# tests that append.
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+ROWS      = 12_000
+BASE_ROWS = 9_000
+
+
+def run(workdir, *command, check=True):
+    # Runs `python *command` in workdir with the repo importable, returning
+    # the completed process
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get('PYTHONPATH', ''),
+               FINANCE_DISK_CACHE='0')
+    proc = subprocess.run([sys.executable, *command], cwd=workdir, env=env, capture_output=True, text=True)
+    if check and proc.returncode:
+        raise AssertionError(f'{" ".join(command)} failed:\n{proc.stdout}\n{proc.stderr}')
+    return proc
+
+
+def script(name):
+    return os.path.join(REPO, name)
+
+
+def read_table(workdir, sql):
+    conn = sqlite3.connect(os.path.join(workdir, 'data', 'finance.db'))
+    try:
+        return pd.read_sql_query(sql, conn)
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope='session')
+def built(tmp_path_factory):
+    # Working directory with data/finance.db built and precomputed from the
+    # first BASE_ROWS transactions. Shared, so tests must not write to it.
+    workdir = tmp_path_factory.mktemp('built')
+    run(workdir, '-m', 'benchmarks.generate_data', '--rows', str(ROWS), '--out', 'data')
+    path = os.path.join(workdir, 'data', 'transactions_data.csv')
+    shutil.move(path, os.path.join(workdir, 'new_rows.csv'))
+    with open(os.path.join(workdir, 'new_rows.csv')) as src, open(path, 'w') as dst:
+        for _ in range(BASE_ROWS + 1):
+            dst.write(src.readline())
+    # The sample is drawn by default only under FINANCE_ENGINE=numpy
+    run(workdir, script('setup_db.py'), '--workers', '1', '--sample-rates', '0.001,0.01')
+    run(workdir, script('precompute.py'), '--skip-forecasts')
+    return workdir
+
+
+@pytest.fixture
+def workdir(built, tmp_path):
+    # A private copy of `built` for a test to modify
+    copy = tmp_path / 'workdir'
+    shutil.copytree(built, copy)
+    return copy
+
+
+@pytest.fixture(scope='session')
+def database(built):
+    # The db module reading `built`, for tests that query it in-process
+    import db
+
+    cwd = os.getcwd()
+    os.chdir(built)
+    db.close()
+    try:
+        yield db
+    finally:
+        db.close()
+        os.chdir(cwd)
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import approx
+import queries
+from conftest import read_table, run, script
+
+# The fixture data is generated from a fixed seed and the sample is drawn by a
+# hash of the id, so every estimate below is the same on every run
+
+
+@pytest.fixture(scope='module')
+def sample(database):
+    return approx.Sample(database.data_version())
+
+
+@pytest.fixture(scope='module', params=approx.SAMPLE_RATES)
+def rate(request):
+    return request.param
+
+
+def covered(estimate, exact, margin):
+    # Share of estimates within their 95% margin of the exact value
+    return np.mean(np.abs(estimate - exact) <= margin + 1e-9)
+
+
+def test_stored_rates(sample):
+    assert sample.rates == sorted(approx.SAMPLE_RATES)
+
+
+def test_category_counts_are_exact(database, sample, rate):
+    # A category is a union of whole (month, mcc) strata, so its estimated
+    # transaction count is the population and carries no margin
+    for months in [queries.ALL_MONTHS, (201503, 201608)]:
+        exact = database.query(queries.TOP_BY_VOLUME, months)
+        estimate = sample.top_categories(rate, months, 'number_transactions')
+        pd.testing.assert_frame_equal(estimate[['description', 'number_transactions']],
+                                      exact[['description', 'number_transactions']], check_dtype=False)
+        assert (estimate['number_transactions_moe'] == 0).all()
+
+
+def test_spend_within_margins(database, sample, rate):
+    exact = database.query(queries.TOP_BY_VOLUME, queries.ALL_MONTHS)
+    estimate = sample.top_categories(rate, queries.ALL_MONTHS, 'number_transactions')
+    assert covered(estimate['total_spent'], exact['total_spent'], estimate['total_spent_moe']) >= 0.9
+    assert covered(estimate['avg_transaction'], exact['avg_transaction'],
+                   estimate['avg_transaction_moe'] + 0.01) >= 0.9
+
+    # Strata are independent, so the total's margin adds in quadrature
+    everything = sample.top_categories(rate, queries.ALL_MONTHS, 'number_transactions', limit=1000)
+    total = database.query(queries.ROLLUP_TOTALS, queries.ALL_MONTHS)['total_spent'][0]
+    assert abs(everything['total_spent'].sum() - total) <= np.sqrt((everything['total_spent_moe'] ** 2).sum())
+
+
+def test_error_counts_within_margins(database, sample, rate):
+    exact = database.query(queries.ERROR_DISTRIBUTION, queries.ALL_MONTHS).set_index('errors')
+    estimate = sample.error_distribution(rate, queries.ALL_MONTHS).set_index('errors')
+    assert set(estimate.index) <= set(exact.index)
+    joined = estimate.join(exact, rsuffix='_exact')
+    assert covered(joined['transaction_count'], joined['transaction_count_exact'],
+                   joined['transaction_count_moe'] + 1) == 1.0
+
+
+def test_whole_strata_are_exact(database, sample, rate):
+    # Months whose strata were kept whole have no margin and the exact total
+    category = database.query(queries.TOP_CATEGORIES)['description'][0]
+    exact = database.query(queries.CATEGORY_MONTHLY_TOTALS, (category, *queries.ALL_MONTHS))
+    estimate = sample.category_monthly_totals(category, rate, queries.ALL_MONTHS)
+    assert estimate['month'].tolist() == exact['month'].tolist()
+    whole = estimate['monthly_total_moe'] == 0
+    assert whole.any()
+    np.testing.assert_allclose(estimate['monthly_total'][whole], exact['monthly_total'][whole])
+
+
+def test_no_sample_without_the_in_memory_engine(workdir):
+    # Only FINANCE_ENGINE=numpy pages estimate, so a default rebuild under the
+    # SQL engine drops the rates the fixture stored and the pages stay exact
+    run(workdir, script('setup_db.py'), '--workers', '1')
+    assert read_table(workdir, 'SELECT * FROM sample_rates').empty
+    assert run(workdir, '-c', 'import approx; print(approx.stored_rates())').stdout.strip() == '[]'
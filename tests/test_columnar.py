@@ -0,0 +1,72 @@
+import json
+
+import pandas as pd
+import pytest
+
+import columnar
+import queries
+from conftest import read_table, run, script
+
+# The whole history and a range that starts and ends mid-year
+RANGES = [queries.ALL_MONTHS, (201503, 201608)]
+
+# Store size and monthly spend, next to the rollup's, at the current version
+STORE_VS_ROLLUP = """
+import json
+import columnar, db, queries
+store = columnar.TransactionStore(db.data_version())
+totals = store.monthly_totals(queries.ALL_MONTHS)
+print(json.dumps({'rows': len(store), 'spend': float(totals['monthly_total'].sum()),
+                  'rollup': float(db.query(queries.MONTHLY_TOTALS, queries.ALL_MONTHS)['monthly_total'].sum())}))
+"""
+
+
+@pytest.fixture(scope='module')
+def store(database):
+    return columnar.TransactionStore(database.data_version())
+
+
+def assert_same(expected, result):
+    pd.testing.assert_frame_equal(expected, result, check_dtype=False, rtol=1e-9)
+
+
+def test_loads_every_transaction(database, store):
+    assert len(store) == database.query('SELECT COUNT(*) AS n FROM transactions')['n'][0]
+
+
+@pytest.mark.parametrize('months', RANGES)
+def test_aggregates_match_sql(database, store, months):
+    assert_same(database.query(queries.MONTHLY_TOTALS, months), store.monthly_totals(months))
+    assert_same(database.query(queries.TOP_BY_VOLUME, months), store.top_by_volume(months=months))
+    assert_same(database.query(queries.TOP_BY_AVG, months), store.top_by_avg(months=months))
+    assert_same(database.query(queries.ERROR_DISTRIBUTION, months), store.error_distribution(months=months))
+
+
+@pytest.mark.parametrize('months', RANGES)
+def test_category_totals_match_sql(database, store, months):
+    for category in database.query(queries.TOP_CATEGORIES)['description'][:3]:
+        assert_same(database.query(queries.CATEGORY_MONTHLY_TOTALS, (category, *months)),
+                    store.category_monthly_totals(category, months))
+
+
+def test_all_categories_match_sql(database, store):
+    assert store.all_categories() == database.query(queries.ALL_CATEGORIES)['description'].tolist()
+
+
+def store_vs_rollup(workdir):
+    return json.loads(run(workdir, '-c', STORE_VS_ROLLUP).stdout.strip().splitlines()[-1])
+
+
+def test_loads_only_what_the_rollup_covers(workdir):
+    # Appended but not yet precomputed rows belong to the next version
+    run(workdir, script('setup_db.py'), '--append', 'new_rows.csv', '--workers', '1')
+    version = read_table(workdir, 'SELECT max_id FROM rollup_watermark')['max_id'][0]
+    result = store_vs_rollup(workdir)
+    assert result['rows'] == read_table(workdir, f'SELECT COUNT(*) AS n FROM transactions WHERE id <= {version}')['n'][0]
+    assert result['rows'] < read_table(workdir, 'SELECT COUNT(*) AS n FROM transactions')['n'][0]
+    assert result['spend'] == pytest.approx(result['rollup'])
+
+
+def test_is_empty_before_the_first_precompute(workdir):
+    run(workdir, '-c', 'import sqlite3; sqlite3.connect("data/finance.db").execute("DROP TABLE rollup_watermark")')
+    assert store_vs_rollup(workdir)['rows'] == 0
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+
+import pytest
+
+from conftest import run
+
+DATA_VERSION = 'import db; print(db.data_version())'
+
+
+def test_data_version_is_none_before_the_first_precompute(tmp_path):
+    os.makedirs(tmp_path / 'data')
+    sqlite3.connect(tmp_path / 'data' / 'finance.db').execute('CREATE TABLE transactions (id INTEGER)')
+    assert run(tmp_path, '-c', DATA_VERSION).stdout.strip() == 'None'
+
+
+def test_data_version_raises_on_an_unreadable_database(tmp_path):
+    os.makedirs(tmp_path / 'data')
+    (tmp_path / 'data' / 'finance.db').write_bytes(b'not a database' * 100)
+    proc = run(tmp_path, '-c', DATA_VERSION, check=False)
+    assert proc.returncode != 0
+    assert 'file is not a database' in proc.stderr
+
+
+def test_data_version_reads_the_watermark(built):
+    assert run(built, '-c', DATA_VERSION).stdout.strip().isdigit()
+
+
+def test_missing_table_tells_missing_tables_from_other_failures():
+    import duckdb
+    import pandas as pd
+
+    import db
+
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (a INTEGER)')
+    errors = {}
+    for sql in ['SELECT * FROM missing', 'SELECT missing FROM t']:
+        try:
+            pd.read_sql_query(sql, conn)
+        except Exception as e:
+            errors[sql] = e
+    assert db.missing_table(errors['SELECT * FROM missing'])
+    assert not db.missing_table(errors['SELECT missing FROM t'])
+
+    with pytest.raises(duckdb.CatalogException) as raised:
+        duckdb.connect().execute('SELECT * FROM missing')
+    assert db.missing_table(raised.value)
+    assert not db.missing_table(ValueError('no such table'))
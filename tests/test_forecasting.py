@@ -0,0 +1,47 @@
+import json
+
+import numpy as np
+
+import forecasting
+from conftest import REPO, run
+
+# Runs the batch with every fit failing, then renders the Forecasting page
+ALL_FITS_FAIL = """
+import json, os
+from streamlit.testing.v1 import AppTest
+import db, forecasting
+
+def _fit(*args, **kwargs):
+    raise RuntimeError('injected')
+
+forecasting._fit = _fit
+report = forecasting.run_batch(workers=1)
+at = AppTest.from_file(os.path.join({repo!r}, 'pages', '4_Forecasting.py'), default_timeout=120).run()
+print(json.dumps({{
+    'statuses': report['status'].tolist(),
+    'forecasts': int(db.query('SELECT COUNT(*) AS n FROM forecasts')['n'][0]),
+    'backtests': int(db.query('SELECT COUNT(*) AS n FROM backtests')['n'][0]),
+    'exception': [e.value for e in at.exception],
+    'category': at.selectbox[0].value,
+}}))
+"""
+
+
+def test_percentage_error_skips_months_without_spend():
+    actuals = np.array([[0.0, 10.0, 20.0], [0.0, 0.0, 0.0]])
+    predicted = np.array([[5.0, 11.0, 18.0], [1.0, 1.0, 1.0]])
+    mape = forecasting.percentage_error(actuals, predicted)
+    assert mape[0] == 10.0
+    assert np.isnan(mape[1])
+
+
+def test_ets_mape_is_never_infinite(database):
+    assert not np.isinf(forecasting.ets_forecasts()['mape']).any()
+
+
+def test_page_renders_after_every_fit_failed(workdir):
+    result = json.loads(run(workdir, '-c', ALL_FITS_FAIL.format(repo=REPO)).stdout.strip().splitlines()[-1])
+    assert set(result['statuses']) == {'failed'}
+    assert result['forecasts'] == 0 and result['backtests'] == 0
+    assert result['exception'] == []
+    assert result['category']
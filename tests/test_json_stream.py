@@ -0,0 +1,107 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+import setup_db
+
+# Block sizes small enough that keys, values, escapes and multi-byte
+# characters are cut at every possible offset, plus one that reads the file whole
+BLOCK_BYTES = [1, 2, 3, 5, 7, 1 << 20]
+
+CASES = {
+    'escaped quotes': r'{"1": "a\"b", "22": "\\", "333": "c\\\"d", "4": "\\\\\""}',
+    'backslash runs': r'{"1": "\\", "2": "\\\\", "3": "x\\\\\\\\", "4": "\"\""}',
+    'structure in values': r'{"1": "\": \"", "2": ": ", "3": "{\"4\": \"5\"}", "6": ","}',
+    'unicode': '{"7": "caf\u00e9 \u2615", "8": "\\u00e9\\n\\t\\/", "9": "\U0001f600"}',
+    'whitespace': '{\n    "10"    :     \n\n   "x"  ,\r\n\t"11":"y","12"\t:\t""\n}',
+    'other values': '{"1": 5, "2": "x", "3": null, "4": ["y", "z"], "5": {}, "6": "w", "7": true}',
+    'empty': '{}',
+}
+
+
+def string_members(obj):
+    # The (key, value) pairs iter_json_members yields: every member with a
+    # string value, nested objects included
+    pairs = []
+    for key, value in obj.items():
+        if isinstance(value, str):
+            pairs.append((key, value))
+        elif isinstance(value, dict):
+            pairs.extend(string_members(value))
+    return pairs
+
+
+def streamed_members(path, block_bytes):
+    pairs = []
+    for buf, keys, values in setup_db.iter_json_members(path, block_bytes):
+        pairs.extend(zip(setup_db.json_strings(buf, keys), setup_db.json_strings(buf, values)))
+    return pairs
+
+
+def random_document(rng):
+    # A flat object of awkward strings, dumped with random spacing
+    alphabet = ['a', '1', ' ', '"', '\\', ':', ',', '{', '}', '\n', '\u00e9', '\u2615', '\U0001f600']
+    members = {str(rng.randrange(10 ** rng.randint(1, 12))):
+               ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+               for _ in range(rng.randint(0, 30))}
+    return json.dumps(members, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 0, 4]),
+                      separators=rng.choice([(', ', ': '), (',', ':'), (' ,', ' : ')]))
+
+
+def write(tmp_path, text):
+    path = tmp_path / 'doc.json'
+    path.write_text(text, encoding='utf-8')
+    return path
+
+
+@pytest.mark.parametrize('block_bytes', BLOCK_BYTES)
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_members_match_json_load(tmp_path, case, block_bytes):
+    path = write(tmp_path, CASES[case])
+    assert streamed_members(path, block_bytes) == string_members(json.loads(CASES[case]))
+
+
+@pytest.mark.parametrize('block_bytes', BLOCK_BYTES)
+def test_random_documents_match_json_load(tmp_path, block_bytes):
+    rng = random.Random(block_bytes)
+    for _ in range(50):
+        text = random_document(rng)
+        path = write(tmp_path, text)
+        expected = json.loads(text)
+        assert streamed_members(path, block_bytes) == string_members(expected), text
+
+        keys = np.concatenate([setup_db.json_int_keys(buf, spans)
+                               for buf, spans, _ in setup_db.iter_json_members(path, block_bytes)] or [[]])
+        assert keys.tolist() == [int(key) for key in expected]
+
+
+@pytest.mark.parametrize('block_bytes', BLOCK_BYTES)
+def test_fraud_labels_match_json_load(tmp_path, block_bytes):
+    rng = random.Random(0)
+    labels = {str(rng.randrange(1, 10 ** 9)): rng.choice(['Yes', 'No']) for _ in range(300)}
+    text = json.dumps({'target': labels}, indent=rng.choice([None, 2]))
+    path = write(tmp_path, text)
+
+    batches = list(setup_db.iter_fraud_labels(path, block_bytes))
+    ids = np.concatenate([ids for ids, _ in batches])
+    is_fraud = np.concatenate([is_fraud for _, is_fraud in batches])
+    assert sorted(zip(ids.tolist(), is_fraud.tolist())) == \
+        sorted((int(key), int(value == 'Yes')) for key, value in json.loads(text)['target'].items())
+    for batch, _ in batches:
+        assert (np.diff(batch) >= 0).all()
+
+
+def test_mcc_codes_match_json_load(tmp_path):
+    codes = {'5411': 'Grocery Stores, Supermarkets', '7801': 'Betting (including "Lottery" Tickets)',
+             '5970': 'Artist Supply Stores\\Craft Shops', '4829': 'Money Transfer \u2013 Wire'}
+    path = write(tmp_path, json.dumps(codes))
+    df = setup_db.read_mcc_codes(path)
+    assert dict(zip(df['mcc'].astype(str), df['description'])) == codes
+
+
+def test_non_integer_keys_are_rejected(tmp_path):
+    path = write(tmp_path, '{"12a": "Yes"}')
+    with pytest.raises(ValueError):
+        list(setup_db.iter_fraud_labels(path))
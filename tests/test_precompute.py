@@ -0,0 +1,71 @@
+import pandas as pd
+
+from conftest import read_table, run, script
+
+# Interrupts precompute.py --incremental just before it merges daily_rollup,
+# after rollup and user_months have been merged
+INTERRUPTED = """
+import runpy, sys
+import db
+
+materialize = db.materialize
+
+def interrupted(name, *args, **kwargs):
+    if name == 'daily_rollup':
+        raise SystemExit('interrupted')
+    materialize(name, *args, **kwargs)
+
+db.materialize = interrupted
+sys.argv = ['precompute.py', '--incremental', '--skip-forecasts']
+runpy.run_path({path!r}, run_name='__main__')
+"""
+
+TABLES = {
+    'rollup': ['month', 'mcc', 'error_mask', 'is_fraud'],
+    'user_months': ['client_id', 'month'],
+    'daily_rollup': ['day', 'mcc'],
+}
+
+
+def assert_tables_equal(left, right):
+    for table, key in TABLES.items():
+        a = read_table(left, f'SELECT * FROM {table}').sort_values(key, ignore_index=True)
+        b = read_table(right, f'SELECT * FROM {table}').sort_values(key, ignore_index=True)
+        pd.testing.assert_frame_equal(a, b[a.columns], check_exact=False, check_dtype=False)
+
+
+def test_incremental_run_matches_full_rebuild(workdir, tmp_path):
+    run(workdir, script('setup_db.py'), '--append', 'new_rows.csv', '--workers', '1')
+    rebuilt = tmp_path / 'rebuilt'
+    run(workdir, '-c', f'import shutil; shutil.copytree(".", {str(rebuilt)!r})')
+
+    run(workdir, script('precompute.py'), '--incremental', '--skip-forecasts')
+    run(rebuilt, script('precompute.py'), '--skip-forecasts')
+    assert_tables_equal(workdir, rebuilt)
+
+
+def test_interrupted_incremental_run_resumes(workdir, tmp_path):
+    run(workdir, script('setup_db.py'), '--append', 'new_rows.csv', '--workers', '1')
+    rebuilt = tmp_path / 'rebuilt'
+    run(workdir, '-c', f'import shutil; shutil.copytree(".", {str(rebuilt)!r})')
+
+    proc = run(workdir, '-c', INTERRUPTED.format(path=script('precompute.py')), check=False)
+    assert proc.returncode != 0 and 'interrupted' in proc.stderr
+    run(workdir, script('precompute.py'), '--incremental', '--skip-forecasts')
+    run(rebuilt, script('precompute.py'), '--skip-forecasts')
+    assert_tables_equal(workdir, rebuilt)
+
+    version = read_table(workdir, 'SELECT max_id FROM rollup_watermark')['max_id'][0]
+    marks = read_table(workdir, 'SELECT name, max_id FROM watermarks')
+    assert (marks['max_id'] == version).all() and set(marks['name']) == set(TABLES)
+
+
+def test_empty_transactions_build_empty_tables(workdir):
+    path = workdir / 'data' / 'transactions_data.csv'
+    path.write_text(path.read_text().splitlines()[0] + '\n')
+    run(workdir, script('setup_db.py'), '--workers', '1')
+    run(workdir, script('precompute.py'), '--skip-forecasts')
+    for table in TABLES:
+        assert read_table(workdir, f'SELECT COUNT(*) AS n FROM {table}')['n'][0] == 0
+    assert read_table(workdir, 'SELECT max_id FROM rollup_watermark')['max_id'].tolist() == [0]
+    assert 'Nothing to do' in run(workdir, script('precompute.py'), '--incremental', '--skip-forecasts').stdout
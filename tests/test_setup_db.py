@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+
+import pytest
+
+import setup_db
+
+# Small enough that the writer queue holds a single 1,000-row chunk, so a
+# producer feeding a dead writer blocks on its second hand-off
+MEMORY_LIMIT_MB = 3
+
+
+def failing_after(chunks_written):
+    def writer(target, chunks, *args, **kwargs):
+        for _ in range(chunks_written):
+            chunks.get()
+        raise sqlite3.OperationalError('disk I/O error')
+    return writer
+
+
+def load(workdir, monkeypatch, writer):
+    # Runs load_transactions with `writer` in place of the SQLite writer,
+    # returning the exception it raised. Fails instead of hanging.
+    monkeypatch.chdir(workdir)
+    monkeypatch.setattr(setup_db, 'sqlite_writer', writer)
+    raised = []
+
+    def target():
+        try:
+            setup_db.load_transactions('sqlite', setup_db.TRANSACTIONS_CSV, 1, 1000, MEMORY_LIMIT_MB, 1000)
+        except BaseException as e:
+            raised.append(e)
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive(), 'load_transactions hung on a dead writer'
+    return raised
+
+
+@pytest.mark.parametrize('chunks_written', [0, 1, 3])
+def test_writer_failure_stops_the_load(workdir, monkeypatch, chunks_written):
+    raised = load(workdir, monkeypatch, failing_after(chunks_written))
+    assert len(raised) == 1 and isinstance(raised[0], sqlite3.OperationalError)
+
+
+def test_writer_failure_after_the_last_chunk_is_raised(workdir, monkeypatch):
+    def writer(target, chunks, *args, **kwargs):
+        while chunks.get() is not None:
+            pass
+        raise sqlite3.OperationalError('database or disk is full')
+    raised = load(workdir, monkeypatch, writer)
+    assert len(raised) == 1 and 'disk is full' in str(raised[0])
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import trends
+
+
+@pytest.mark.parametrize('n, points', [(5000, 1000), (1001, 1000), (10, 3), (3653, 500)])
+def test_lttb_keeps_endpoints_and_point_count(n, points):
+    rng = np.random.default_rng(n)
+    x = np.arange(n, dtype='float64')
+    y = rng.lognormal(0, 1, n)
+    keep = trends.lttb(x, y, points)
+    assert len(keep) == points
+    assert keep[0] == 0 and keep[-1] == n - 1
+    assert (np.diff(keep) > 0).all()
+
+
+@pytest.mark.parametrize('points', [1, 2, 100, 101])
+def test_lttb_keeps_everything_it_cannot_reduce(points):
+    y = np.linspace(0, 1, 100)
+    assert trends.lttb(np.arange(100.0), y, points).tolist() == list(range(100))
+
+
+def test_lttb_keeps_spikes():
+    y = np.zeros(1000)
+    y[[137, 500, 861]] = [50, -50, 80]
+    keep = trends.lttb(np.arange(1000.0), y, 50)
+    assert {137, 500, 861} <= set(keep.tolist())
+
+
+def test_trend_downsamples_long_ranges():
+    days = pd.date_range('2010-01-01', '2019-10-31', freq='D')
+    totals = pd.Series(np.random.default_rng(0).lognormal(8, 1, len(days)), index=days, name='total')
+    start, end = days[400].date(), days[-1].date()
+
+    df = trends.trend(totals, 'Day', start, end)
+    assert len(df) == trends.MAX_POINTS
+    assert df.index[0] == pd.Timestamp(start) and df.index[-1] == pd.Timestamp(end)
+    full = trends.trend(totals, 'Day', start, end, max_points=len(days))
+    pd.testing.assert_frame_equal(df, full.loc[df.index])
+    assert len(trends.trend(totals, 'Week', start, end)) < trends.MAX_POINTS
@@ -0,0 +1,31 @@
+import json
+
+from conftest import REPO, run
+
+# Warms every page, then runs each one in AppTest and reports what its disk
+# tier lookups found
+WARM_THEN_VISIT = """
+import glob, json, os
+os.environ['FINANCE_DISK_CACHE'] = '1'
+from streamlit.testing.v1 import AppTest
+import profiling, warmup
+
+# app.py's PAGES, which cannot be imported outside a server
+pages = [(path, os.path.basename(path)) for path in sorted(glob.glob(os.path.join({repo!r}, 'pages', '[1-5]_*.py')))]
+warmup._run(pages)
+warmed = len(profiling.events('disk_cache'))
+for path, _ in pages:
+    at = AppTest.from_file(path, default_timeout=120).run()
+    assert not at.exception, at.exception
+visits = profiling.events('disk_cache').iloc[warmed:]
+print(json.dumps({{'errors': [page['error'] for page in warmup.report()['pages']],
+                  'warmed': warmed, 'misses': visits.loc[visits['cache'] == 'miss', 'name'].tolist()}}))
+"""
+
+
+def test_first_visits_find_warmed_entries(workdir):
+    proc = run(workdir, '-c', WARM_THEN_VISIT.format(repo=REPO))
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    assert result['errors'] == [None] * len(result['errors'])
+    assert result['warmed'] > 0
+    assert result['misses'] == []
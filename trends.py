@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+# Spend and transaction count per day and mcc, built by precompute.py from the
+# id range {after_id} < id <= {up_to_id} like the rollup. Days are YYYYMMDD
+# integers. At most one row per day and mcc, so any date range of the trend
+# charts is an index range scan rather than a pass over transactions.
+DAILY_ROLLUP_SQL = """
+    SELECT
+        CAST(REPLACE(SUBSTR(date, 1, 10), '-', '') AS INTEGER) AS day,
+        mcc,
+        CAST(COUNT(*) AS BIGINT) AS n,
+        CAST(SUM(amount_cents) AS BIGINT) AS sum_cents
+    FROM transactions
+    WHERE id > {after_id} AND id <= {up_to_id}
+    GROUP BY day, mcc
+"""
+
+DAILY_ROLLUP_MERGE_SQL = """
+    SELECT
+        day,
+        mcc,
+        CAST(SUM(n) AS BIGINT) AS n,
+        CAST(SUM(sum_cents) AS BIGINT) AS sum_cents
+    FROM (
+        SELECT * FROM daily_rollup
+        UNION ALL
+        {delta}
+    ) AS cells
+    GROUP BY day, mcc
+"""
+
+DAILY_ROLLUP_INDEXES = [
+    'CREATE INDEX idx_daily_rollup_day ON daily_rollup (day, sum_cents)',
+    'CREATE INDEX idx_daily_rollup_mcc_day ON daily_rollup (mcc, day, sum_cents)',
+]
+
+# Points per trace sent to the browser. A range holding more periods than
+# this at the chosen granularity is downsampled before it is drawn.
+MAX_POINTS = 1000
+
+# Granularity -> (pandas period, periods in the 3-month and 12-month moving
+# averages). Finest first, which is the order auto_granularity tries them in.
+GRANULARITIES = {
+    'Day':   ('D', 91, 365),
+    'Week':  ('W', 13, 52),
+    'Month': ('M', 3, 12),
+}
+
+# How the charts title each granularity
+TITLES = {'Day': 'Daily', 'Week': 'Weekly', 'Month': 'Monthly'}
+
+# Read before the visible range so the 12-month average is defined from its
+# first point
+LOOKBACK = pd.DateOffset(days=371)
+
+
+def day_key(date):
+    date = pd.Timestamp(date)
+    return date.year * 10_000 + date.month * 100 + date.day
+
+
+def day_range(start, end):
+    # (first, last) YYYYMMDD keys to query for a chart of start..end,
+    # moving average warm-up included
+    return day_key(pd.Timestamp(start) - LOOKBACK), day_key(end)
+
+
+def month_key(date):
+    date = pd.Timestamp(date)
+    return date.year * 100 + date.month
+
+
+def month_range(start, end):
+    # (first, last) YYYYMM keys of every month start..end touches, for the
+    # `month BETWEEN ? AND ?` of the page aggregates
+    return month_key(start), month_key(end)
+
+
+def trend_months(start, end):
+    # (first, last) YYYYMM keys to query for a monthly chart of start..end,
+    # moving average warm-up included
+    return month_key(pd.Timestamp(start) - LOOKBACK), month_key(end)
+
+
+def date_range(df):
+    # DAY_RANGE row -> (first, last) dates for the charts' range slider
+    first, last = (pd.to_datetime(str(df[column][0]), format='%Y%m%d').date() for column in ['first_day', 'last_day'])
+    return first, last
+
+
+def daily(df):
+    # (day, total) rows -> totals indexed by date
+    days = pd.to_datetime(df['day'].astype(str), format='%Y%m%d')
+    return pd.Series(df['total'].to_numpy(dtype='float64'), index=days.values, name='total')
+
+
+def monthly(df):
+    # (month, monthly_total) rows -> totals indexed by month start
+    months = pd.to_datetime(df['month'].astype(str), format='%Y%m')
+    return pd.Series(df['monthly_total'].to_numpy(dtype='float64'), index=months.values, name='total')
+
+
+def auto_granularity(start, end, max_points=MAX_POINTS):
+    # The finest granularity that fits start..end in max_points periods
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    for granularity, per_day in [('Day', 1), ('Week', 1 / 7)]:
+        if days * per_day <= max_points:
+            return granularity
+    return 'Month'
+
+
+def lttb(x, y, points):
+    # Indices of the `points` samples Largest-Triangle-Three-Buckets keeps:
+    # the first and last, plus from each bucket in between the one forming
+    # the largest triangle with the previous pick and the next bucket's mean.
+    # Unlike a stride it keeps the peaks and troughs.
+    n = len(y)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = (np.arange(points - 1) * ((n - 2) / (points - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    keep = np.empty(points, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+
+def trend(totals, granularity, start, end, max_points=MAX_POINTS):
+    # Chart frame for start..end: total spend per period plus the 3-month and
+    # 12-month moving averages, indexed by period start. `totals` may hold
+    # days or months and should reach LOOKBACK before start. Periods with no
+    # transactions count as zero spend. Past max_points periods every column
+    # is downsampled at the points LTTB picks from the total.
+    period, short, long = GRANULARITIES[granularity]
+    totals = totals.groupby(totals.index.to_period(period)).sum()
+    if not totals.empty:
+        totals = totals.reindex(pd.period_range(totals.index.min(), totals.index.max(), freq=period),
+                                fill_value=0.0)
+    df = totals.to_frame('total')
+    df['ma_3']  = df['total'].rolling(window=short).mean()
+    df['ma_12'] = df['total'].rolling(window=long).mean()
+    df.index = df.index.start_time.rename('period')
+    df = df[(df.index >= pd.Timestamp(start).to_period(period).start_time) & (df.index <= pd.Timestamp(end))]
+    if len(df) > max_points:
+        df = df.iloc[lttb(df.index.asi8.astype('float64'), df['total'].to_numpy(), max_points)]
+    return df
@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Dense users x months spending matrix written by precompute.py next to the
+# user_features table. Small enough (clients x months x 8 bytes) to hold in
+# memory, so a user's whole history is one row lookup.
+MATRIX_PATH = 'data/user_months.npz'
+
+# Spend, transaction count and labelled fraud per client and month, built
+# from the id range {after_id} < id <= {up_to_id} like the rollup
+USER_MONTHS_SQL = """
+    SELECT
+        t.client_id,
+        t.month,
+        CAST(COUNT(*) AS BIGINT) AS n,
+        CAST(SUM(t.amount_cents) AS BIGINT) AS sum_cents,
+        CAST(IFNULL(SUM(f.is_fraud), 0) AS BIGINT) AS fraud_count
+    FROM transactions t
+    LEFT JOIN fraud_labels f ON t.id = f.transaction_id
+    WHERE t.id > {after_id} AND t.id <= {up_to_id}
+    GROUP BY t.client_id, t.month
+"""
+
+USER_MONTHS_MERGE_SQL = """
+    SELECT
+        client_id,
+        month,
+        CAST(SUM(n) AS BIGINT) AS n,
+        CAST(SUM(sum_cents) AS BIGINT) AS sum_cents,
+        CAST(SUM(fraud_count) AS BIGINT) AS fraud_count
+    FROM (
+        SELECT * FROM user_months
+        UNION ALL
+        {delta}
+    ) AS cells
+    GROUP BY client_id, month
+"""
+
+USER_MONTHS_INDEXES = [
+    'CREATE UNIQUE INDEX idx_user_months_client_month ON user_months (client_id, month)',
+    'CREATE INDEX idx_user_months_month ON user_months (month, client_id)',
+]
+
+USER_FEATURES_INDEXES = [
+    'CREATE UNIQUE INDEX idx_user_features_client ON user_features (client_id)',
+]
+
+
+def build_features(user_months, users):
+    # One row per client with the per-user analyses from sql/queries.sql.
+    # Averages divide by every month in the data, not just the client's
+    # active ones, so quiet months count as zero spend.
+    total_months = user_months['month'].nunique()
+    per_user = user_months.groupby('client_id').agg(
+        active_months=('month', 'nunique'),
+        total_transactions=('n', 'sum'),
+        total_cents=('sum_cents', 'sum'),
+        fraud_count=('fraud_count', 'sum'),
+    ).reset_index()
+
+    df = per_user.merge(users[['id', 'yearly_income']], how='left', left_on='client_id', right_on='id')
+    df['total_spent'] = df['total_cents'] / 100
+    df['total_months'] = total_months
+    df['avg_monthly_spending'] = (df['total_spent'] / total_months).round(2)
+    df['monthly_income'] = (df['yearly_income'] / 12).round(2)
+    df['pct_income_spent'] = (df['total_spent'] / total_months / (df['yearly_income'] / 12) * 100).round(2)
+    df['fraud_rate'] = (df['fraud_count'] * 100 / df['total_transactions']).round(2)
+    df['spend_rank'] = df['total_spent'].rank(method='min', ascending=False).astype('int64')
+    return df[[
+        'client_id', 'active_months', 'total_months', 'total_transactions', 'total_spent',
+        'avg_monthly_spending', 'monthly_income', 'pct_income_spent', 'fraud_count', 'fraud_rate',
+        'spend_rank',
+    ]].sort_values('client_id', ignore_index=True)
+
+
+def build_matrix(user_months):
+    # (client_ids, months, cents) with cents[i, j] the spend of client_ids[i]
+    # in months[j], zero where the client had no transactions
+    client_ids, rows = np.unique(user_months['client_id'].to_numpy(), return_inverse=True)
+    months, cols = np.unique(user_months['month'].to_numpy(), return_inverse=True)
+    cents = np.zeros((len(client_ids), len(months)), dtype='int64')
+    cents[rows, cols] = user_months['sum_cents'].to_numpy()
+    return client_ids, months, cents
+
+
+def save_matrix(client_ids, months, cents, path=MATRIX_PATH):
+    # Written to a temporary file first so a page never loads a partial matrix
+    with open(f'{path}.tmp', 'wb') as f:
+        np.savez(f, client_ids=client_ids, months=months, cents=cents)
+    os.replace(f'{path}.tmp', path)
+
+
+class UserMatrix:
+
+    def __init__(self, client_ids, months, cents):
+        self.client_ids = client_ids
+        self.months = months
+        self.cents = cents
+
+    @classmethod
+    def load(cls, path=MATRIX_PATH):
+        with np.load(path) as data:
+            return cls(data['client_ids'], data['months'], data['cents'])
+
+    def history(self, client_id):
+        # Monthly spend for one client with the running total and the change
+        # from the previous calendar month. Returns None for an unknown client.
+        i = np.searchsorted(self.client_ids, client_id)
+        if i == len(self.client_ids) or self.client_ids[i] != client_id:
+            return None
+        cents = self.cents[i]
+        previous = np.concatenate([[np.nan], cents[:-1]])
+        return pd.DataFrame({
+            'month': pd.to_datetime(self.months.astype(str), format='%Y%m'),
+            'monthly_spending': cents / 100,
+            'running_total': np.cumsum(cents) / 100,
+            'prev_month_spending': previous / 100,
+            'month_on_month_change': ((cents - previous) / 100).round(2),
+        })
@@ -0,0 +1,143 @@
+import ast
+import itertools
+import os
+import threading
+import time
+
+import profiling
+
+# After a restart the first visitor would otherwise pay for every cold query,
+# import and model load. app.py starts this once per server process: each
+# page's disk-cached loaders are called in a background thread, in navigation
+# order, with the arguments a first visit passes, so their entries are on disk
+# before anyone asks. Nothing here touches Streamlit. Set FINANCE_WARMUP=0 to
+# skip it; with FINANCE_DISK_CACHE=0 there is nothing to fill.
+ENABLED = os.environ.get('FINANCE_WARMUP', '1') != '0'
+
+# When this process started serving: the import of this module, which under
+# `python app.py` comes before the server starts
+STARTED = time.time()
+
+_lock   = threading.Lock()
+_thread = None
+_report = {'first_render': None, 'warm': None, 'pages': []}
+
+
+def page_loaders(path):
+    # The page's load_* functions without their decorators, so every call
+    # runs the body (benchmarks/suite.py times them cold). Only the page's
+    # imports and those functions are executed, not the page body. Named
+    # like Streamlit's own run of the page, so through disk_cache.persist
+    # they share the page's entries.
+    tree = ast.parse(open(path).read(), path)
+    keep = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name.startswith('load_'):
+            node.decorator_list = []
+            keep.append(node)
+    namespace = {'__name__': '__main__', '__file__': path}
+    exec(compile(ast.Module(body=keep, type_ignores=[]), path, 'exec'), namespace)
+    return {name: fn for name, fn in namespace.items() if name.startswith('load_') and callable(fn)}
+
+
+def _disk_cached(path):
+    # Names of the page's load_* functions decorated with disk_cache.tier.
+    # The others only cache in memory, which a call from here cannot fill.
+    tree = ast.parse(open(path).read(), path)
+    return {
+        node.name for node in tree.body
+        if isinstance(node, ast.FunctionDef) and node.name.startswith('load_') and any(
+            isinstance(n, ast.Attribute) and n.attr == 'tier' and isinstance(n.value, ast.Name)
+            and n.value.id == 'disk_cache'
+            for decorator in node.decorator_list for n in ast.walk(decorator))
+    }
+
+
+def first_visit(loaders):
+    # Argument values by parameter name, as a first visit passes them: the
+    # whole date range at its auto granularity, the first entry of each
+    # dropdown (the Forecasting page also draws the total) and the error
+    # flags preselected on the Error & Fraud page. They come from the page's
+    # own loaders, which are warmed on the way.
+    import db
+    import error_flags
+    import forecasting
+    import trends
+
+    version = db.data_version()
+    values = {'version': [version], 'mask': [error_flags.FLAGS['Bad CVV']]}
+    if 'load_date_range' in loaders:
+        start, end = loaders['load_date_range'](version)
+        values.update(start=[start], end=[end], granularity=[trends.auto_granularity(start, end)])
+    if 'load_all_categories' in loaders:
+        values['category'] = loaders['load_all_categories'](version)[:1]
+    if 'load_categories' in loaders:
+        values['series'] = [forecasting.TOTAL, *loaders['load_categories'](version)[:1]]
+    if 'load_user_ids' in loaders:
+        values['client_id'] = loaders['load_user_ids'](version)[:1]
+    return values
+
+
+def _prime(path):
+    # Calls the page's disk-cached loaders without their decorators, through
+    # the same disk tier. A loader taking an argument first_visit() has no
+    # value for (the sample rate of an estimate) is left cold.
+    import db
+    import disk_cache
+    cached = _disk_cached(path)
+    bare = {name: fn for name, fn in page_loaders(path).items() if name in cached}
+    loaders = {name: disk_cache.persist(fn, db.fingerprint) for name, fn in bare.items()}
+    values = first_visit(loaders)
+    for name, fn in bare.items():
+        params = fn.__code__.co_varnames[:fn.__code__.co_argcount]
+        if all(param in values for param in params):
+            for args in itertools.product(*(values[param] for param in params)):
+                loaders[name](*args)
+
+
+def _run(pages):
+    for path, title in pages:
+        started = time.perf_counter()
+        error = None
+        try:
+            with profiling.timed('warmup', title):
+                _prime(path)
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        _report['pages'].append({'page': title, 'seconds': round(time.perf_counter() - started, 3), 'error': error})
+    _report['warm'] = time.time() - STARTED
+    failed = [page['page'] for page in _report['pages'] if page['error']]
+    print(f'Warm-up - fully warm {_report["warm"]:.2f}s after start'
+          + (f' ({", ".join(failed)} failed)' if failed else ''), flush=True)
+
+
+def start(pages):
+    # Primes each (script, title) page in turn, unless this process already
+    # has started to
+    import disk_cache
+
+    global _thread
+    with _lock:
+        if _thread is None and ENABLED and disk_cache.ENABLED:
+            _thread = threading.Thread(target=_run, args=(list(pages),), name='warmup', daemon=True)
+            _thread.start()
+
+
+def rendered():
+    # Called after every page run; the first one is the time to first render
+    if _report['first_render'] is None:
+        with _lock:
+            if _report['first_render'] is None:
+                _report['first_render'] = time.time() - STARTED
+                print(f'Warm-up - first page rendered {_report["first_render"]:.2f}s after start', flush=True)
+
+
+def wait(timeout=None):
+    if _thread is not None:
+        _thread.join(timeout)
+
+
+def report():
+    # Seconds from start to the first rendered page and to fully warm (None
+    # until reached), and how long each page took to prime
+    return {**_report, 'pages': list(_report['pages'])}